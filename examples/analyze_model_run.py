@@ -1,23 +1,20 @@
 #!/usr/bin/env python
 
 '''
-This script reads and a pickled Model object and creates analysis plots. 
-The Model object contains chains, a sample spectrum, and templates used.
+This script reads the chain store of a fit (see 
+spamm.ChainStore.write_chain_store) and creates analysis plots. Pickle files
+written by older versions of SPAMM are read too.
 
 Usage:
-    > python analyze_model_run.py model.pickle.gz
+    > python analyze_model_run.py model.chain
 '''
 
 #import os
+import os
 import sys
-import gzip
 import argparse
 #import inspect
 import numpy as np
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
 
 import triangle
 #sys.path.append(os.path.abspath("../source"))
@@ -27,6 +24,8 @@ from spamm.components.NuclearContinuumComponent import NuclearContinuumComponent
 from spamm.components.HostGalaxyComponent import HostGalaxyComponent
 from spamm.components.FeComponent import FeComponent
 from spamm.Analysis import *
+from spamm.ChainStore import StoredChain
+from spamm.Samples import read_samples
 
 #-----------------------------------------------------------------------------#
 
@@ -38,23 +37,19 @@ def make_chain_plots(model_filename):
         - triangle plot of chains
 
     Args:
-        model_filename (str): Name of input zipped model pickle file.
+        model_filename (str): Name of input chain store.
     """
-    try:
-        p_data = pickle.loads(gzip.open(model_filename).read())
-    except UnicodeDecodeError:
-        p_data = pickle.loads(gzip.open(model_filename).read(), encoding="latin1")
-    model = p_data["model"]
-    params = p_data["comp_params"] 
-        
 #   We can do this intelligently based on number of iterations.
-    samples = model.sampler.chain[:, 50:, :].reshape((-1, model.total_parameter_count))
+    model, samples, params = read_samples(model_filename, burn=50)
+    labels = model.parameter_names if isinstance(model, StoredChain) \
+             else model.model_parameter_names()
+    model_filename = os.path.basename(model_filename.rstrip(os.sep))
     
     if np.size(samples) == 0:
         print("WARNING, size of samples is 0! Exiting analysis code now...")
         exit()
     
-    fig = triangle.corner(samples, labels=model.model_parameter_names())
+    fig = triangle.corner(samples, labels=labels)
     figname = "plots/{0}_triangle.png".format(model_filename)
     fig.savefig(figname)
     print("\tWrote {0}".format(figname))
@@ -72,7 +67,7 @@ def make_chain_plots(model_filename):
     #	You can easily tell if the chains are converged because you can
     #	no longer tell where the individual particle chains are sliced together.
     #	For testing, I saved 2000 iterations and ignored the first 1000.
-    fig = plot_chains(samples, labels=model.model_parameter_names())
+    fig = plot_chains(samples, labels=labels)
     figname = "plots/{0}_chain.png".format(model_filename)
     fig.savefig(figname)
     print("\tWrote {0}".format(figname))
@@ -81,7 +76,7 @@ def make_chain_plots(model_filename):
     #	These are histograms of the MCMC chains.  We should add
     #	parameter names to this and the previous plots at some point.
     #	boxes = 20 is the default.
-    fig = plot_posteriors(samples, labels=model.model_parameter_names(), boxes=20, params=params)
+    fig = plot_posteriors(samples, labels=labels, boxes=20, params=params)
     figname = "plots/{0}_posterior.png".format(model_filename)
     fig.savefig(figname)
     print("\tWrote {0}".format(figname))
@@ -96,7 +91,7 @@ def make_chain_plots(model_filename):
 if __name__ == "__main__":
     # read the name of the SPAMM pickle from the command line.
     parser = argparse.ArgumentParser()
-    parser.add_argument("model_filename", help="SPAMM model pickle file", type=str)
+    parser.add_argument("model_filename", help="SPAMM chain store", type=str)
     args = parser.parse_args()
     
     model_filename = args.model_filename
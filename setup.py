@@ -18,7 +18,6 @@ setup(
                         'astropy',
                         'matplotlib',
                         'scipy>=0.17.1',
-                        'emcee==2.2.1',
-                        'pysynphot']
+                        'emcee==2.2.1']
     )
 
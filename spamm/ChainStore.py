@@ -0,0 +1,479 @@
+#!/usr/bin/python
+
+import os
+import copy
+import glob
+import gzip
+import json
+import shutil
+import pickle
+import hashlib
+import threading
+import queue
+import numpy as np
+
+STATE_FILE = "state.pickle"
+SEGMENT_FILE = "segment_{0:05d}.npz"
+
+# Files of a stored fit, see write_chain_store().
+MANIFEST_FILE = "manifest.json"
+MODEL_FILE = "model.pickle.gz"
+CHUNK_FILE = "chunk_{0:05d}.npz"
+COLUMN_FILE = "chunk_{0:05d}_{1}.npy"
+STORE_FORMAT = 1
+
+# Number of iterations per chunk of a stored fit.
+CHUNK_SIZE = 100
+
+#-----------------------------------------------------------------------------#
+
+class ChainStore(object):
+    """
+    On-disk store for an MCMC run that is written while the sampler runs.
+    The chain is saved as a sequence of segments, each holding the steps
+    taken since the previous checkpoint, together with the state needed to
+    continue the run (walker positions, log-probabilities, random number
+    generator state and acceptance counts).
+
+    Writes happen on a background thread so that sampling is not stalled
+    by disk I/O. A segment is always written before the state that refers
+    to it, and the state file is replaced atomically, so a run that is
+    killed at any point can be resumed from its last complete checkpoint.
+
+    Attributes:
+        directory (str): Directory holding the store.
+        n_segments (int): Number of segments in the last checkpoint.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): Directory holding the store. It is created if
+                it does not exist.
+        """
+
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.n_segments = 0
+        if self.has_checkpoint:
+            self.n_segments = self.load_state()["n_segments"]
+
+        self._queue = queue.Queue()
+        self._error = None
+        self._writer = None
+
+#-----------------------------------------------------------------------------#
+
+    @property
+    def has_checkpoint(self):
+        """
+        Returns:
+            Bool (Bool): True if the store holds a checkpoint.
+        """
+
+        return os.path.exists(os.path.join(self.directory, STATE_FILE))
+
+#-----------------------------------------------------------------------------#
+
+    def clear(self):
+        """
+        Remove any previous checkpoint from the store.
+        """
+
+        self.flush()
+        for filename in glob.glob(os.path.join(self.directory, "segment_*.npz")):
+            os.remove(filename)
+        state_file = os.path.join(self.directory, STATE_FILE)
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        self.n_segments = 0
+
+#-----------------------------------------------------------------------------#
+
+    def append(self, chain, lnprob, state):
+        """
+        Queue a new chain segment and the sampler state at its end for
+        writing. Returns immediately.
+
+        Args:
+            chain (ndarray): Array of shape (n_walkers, n_steps, n_params).
+            lnprob (ndarray): Array of shape (n_walkers, n_steps).
+            state (dict): Sampler state. Must be picklable.
+        """
+
+        self._raise_writer_error()
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+        state = dict(state)
+        state["n_segments"] = self.n_segments + 1
+        self._queue.put((self.n_segments, np.array(chain), np.array(lnprob), state))
+        self.n_segments += 1
+
+#-----------------------------------------------------------------------------#
+
+    def flush(self):
+        """
+        Block until all queued checkpoints have been written.
+        """
+
+        self._queue.join()
+        self._raise_writer_error()
+
+#-----------------------------------------------------------------------------#
+
+    def load_state(self):
+        """
+        Returns:
+            state (dict): Sampler state of the last checkpoint.
+        """
+
+        with open(os.path.join(self.directory, STATE_FILE), "rb") as state_file:
+            return pickle.load(state_file)
+
+#-----------------------------------------------------------------------------#
+
+    def load_chain(self):
+        """
+        Read the chain of the last checkpoint. Segments written after it,
+        e.g. by a run that was killed, are ignored.
+
+        Returns:
+            chain (ndarray): Array of shape (n_walkers, n_steps, n_params).
+            lnprob (ndarray): Array of shape (n_walkers, n_steps).
+        """
+
+        n_segments = self.load_state()["n_segments"]
+        chains = []
+        lnprobs = []
+        for i in range(n_segments):
+            with np.load(os.path.join(self.directory, SEGMENT_FILE.format(i))) as segment:
+                chains.append(segment["chain"])
+                lnprobs.append(segment["lnprob"])
+
+        return np.concatenate(chains, axis=1), np.concatenate(lnprobs, axis=1)
+
+#-----------------------------------------------------------------------------#
+
+    def _write_loop(self):
+        while True:
+            index, chain, lnprob, state = self._queue.get()
+            try:
+                if self._error is None:
+                    np.savez(os.path.join(self.directory, SEGMENT_FILE.format(index)),
+                             chain=chain, lnprob=lnprob)
+                    state_file = os.path.join(self.directory, STATE_FILE)
+                    with open(state_file + ".tmp", "wb") as tmp_file:
+                        pickle.dump(state, tmp_file)
+                    os.replace(state_file + ".tmp", state_file)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            raise Exception("Writing a checkpoint to {0} failed: {1}".
+                            format(self.directory, self._error))
+
+#-----------------------------------------------------------------------------#
+
+def write_chain_store(p_data, directory, chunk_size=CHUNK_SIZE, compress=False,
+                      checkpoint=None):
+    """
+    Write the results of a fit as a chain store: a directory holding the
+    chain and ln(posterior) in chunks of chunk_size iterations, a JSON
+    manifest describing the model and the run, and the model itself
+    without its chain. The model, with its templates, is only needed to
+    compute model spectra; reading the chain only needs the manifest and
+    the chunks.
+
+    If the linear parameters were marginalized over, the chain of all 
+    parameters is Model.chain, with the linear parameters drawn once 
+    here, so that reading the store is only slicing.
+
+    The store is columnar: each chunk holds one array per parameter, of 
+    shape (n_walkers, n_steps), and one for ln(posterior), so reading a few
+    parameters or iterations only touches those columns and chunks (see 
+    StoredChain). By default each column of each chunk is a .npy file,
+    which is memory-mapped when read, so slicing a few walkers only reads
+    those rows. Compressed chunks are single .npz files, which are smaller
+    but cannot be memory-mapped: reading a column decompresses all of it.
+
+    The store is written under a temporary name and renamed when complete,
+    so an existing directory always holds a complete store. An existing 
+    store of the same name is replaced. The checkpoints of the run, if
+    any, are removed once the store is complete, so that a finished fit
+    is only kept in one format.
+
+    Args:
+        p_data (dict): Results, see spamm.run_spamm.spamm().
+        directory (str): Name of the store directory.
+        chunk_size (int): Number of iterations per chunk.
+        compress (Bool): If True, compress the chunks, see above.
+        checkpoint (str): Directory of the ChainStore the run was 
+            checkpointed to, or None.
+    """
+
+    import dill
+
+    model = p_data["model"]
+    chain = model.chain
+    result = getattr(model, "result", None)
+    ln_prob = result.ln_prob if result is not None else model.sampler.lnprobability
+    n_walkers, n_iterations, n_parameters = chain.shape
+
+    tmp_directory = directory.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+
+    chunks = []
+    for index, start in enumerate(range(0, n_iterations, chunk_size)):
+        stop = min(start + chunk_size, n_iterations)
+        columns = {"param_{0}".format(i): chain[:, start:stop, i] for i in range(n_parameters)}
+        columns["ln_prob"] = ln_prob[:, start:stop]
+        if compress:
+            np.savez_compressed(os.path.join(tmp_directory, CHUNK_FILE.format(index)), **columns)
+        else:
+            for column, values in columns.items():
+                np.save(os.path.join(tmp_directory, COLUMN_FILE.format(index, column)), 
+                        np.ascontiguousarray(values))
+        chunks.append([start, stop])
+
+    # The model is saved without its chain, which is in the chunks.
+    stripped = copy.copy(model)
+    stripped.sampler = None
+    stripped.result = None
+    stripped._full_chain = None
+    with gzip.open(os.path.join(tmp_directory, MODEL_FILE), "wb") as model_file:
+        model_file.write(dill.dumps({"model": stripped}))
+
+    manifest = {"format": STORE_FORMAT,
+                "n_walkers": n_walkers,
+                "n_iterations": n_iterations,
+                "parameter_names": model.model_parameter_names(),
+                "components": [{"name": c.name,
+                                "class": type(c).__name__,
+                                "parameter_names": list(c.model_parameter_names),
+                                "linear_parameter_names": list(getattr(c, "linear_parameter_names", []))}
+                               for c in model.components],
+                "marginalize_linear": bool(getattr(model, "marginalize_linear", False)),
+                "compressed": compress,
+                "chunks": chunks,
+                "converged": p_data.get("converged", True),
+                "comp_params": {k: v for k, v in p_data.get("comp_params", {}).items()
+                                if k not in ("wl", "flux", "err")},
+                "data": data_description(model.data_spectrum)}
+    if result is not None:
+        manifest.update({"backend": result.backend,
+                         "seconds": result.seconds,
+                         "acceptance_fraction": result.acceptance_fraction,
+                         "log_evidence": result.log_evidence,
+                         "log_evidence_error": result.log_evidence_error})
+    with open(os.path.join(tmp_directory, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, default=_to_json)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+    print("Saved chain store {0}".format(directory))
+
+    # Only remove a directory that holds a checkpoint.
+    if checkpoint is not None and os.path.isfile(os.path.join(checkpoint, STATE_FILE)):
+        shutil.rmtree(checkpoint)
+
+def data_description(spectrum):
+    """
+    Describe a data spectrum for a manifest: its size, wavelength range 
+    and a SHA-256 hash of the wavelengths, fluxes and errors, so that a
+    stored fit can be matched to its data without storing the data.
+
+    Args:
+        spectrum (Spectrum object): The data spectrum.
+
+    Returns:
+        description (dict): The description.
+    """
+
+    digest = hashlib.sha256()
+    wl = np.asarray(spectrum.spectral_axis, dtype=float)
+    for values in (wl, spectrum.flux, spectrum.flux_error):
+        if values is not None:
+            digest.update(np.ascontiguousarray(values, dtype=float).tobytes())
+
+    return {"n_pixels": len(wl),
+            "wavelength_range": [float(wl.min()), float(wl.max())],
+            "sha256": digest.hexdigest()}
+
+def is_chain_store(name):
+    """
+    Returns:
+        Bool (Bool): True if name is the directory of a chain store.
+    """
+
+    return os.path.isfile(os.path.join(name, MANIFEST_FILE))
+
+def _to_json(value):
+    # numpy scalars and arrays in manifests, e.g. in comp_params.
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("{0!r} cannot be written to a manifest".format(value))
+
+#-----------------------------------------------------------------------------#
+
+class StoredChain(object):
+    """
+    Read access to a chain store written by write_chain_store(). Only the
+    manifest is read when the store is opened; the chain is read lazily,
+    one column of one chunk at a time, when it is sliced, and the model is 
+    only unpickled when it is asked for.
+
+    Attributes:
+        directory (str): Directory of the store.
+        manifest (dict): The manifest.
+        parameter_names (list): Names of the parameters, i.e. of the last 
+            axis of the chain.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): Directory of the store.
+        """
+
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE), "r") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest["format"] > STORE_FORMAT:
+            raise Exception("Chain store {0} has format {1}; this version of SPAMM "
+                            "reads up to format {2}".format(directory, self.manifest["format"], 
+                                                            STORE_FORMAT))
+        self.parameter_names = self.manifest["parameter_names"]
+        self._model = None
+
+#-----------------------------------------------------------------------------#
+
+    @property
+    def shape(self):
+        """
+        Returns:
+            shape (tuple): Shape of the chain, (n_walkers, n_iterations, 
+                n_parameters).
+        """
+
+        return (self.manifest["n_walkers"], self.manifest["n_iterations"], 
+                len(self.parameter_names))
+
+    @property
+    def model(self):
+        """
+        The Model of the fit, without its chain. It is unpickled, with its
+        templates, the first time it is asked for.
+        """
+
+        if self._model is None:
+            import dill
+            with gzip.open(os.path.join(self.directory, MODEL_FILE)) as model_file:
+                self._model = dill.loads(model_file.read())["model"]
+        return self._model
+
+#-----------------------------------------------------------------------------#
+
+    def chain(self, walkers=None, iterations=None, parameters=None):
+        """
+        Read part of the chain.
+
+        Args:
+            walkers (slice, int or list): Walkers to read. Default: all.
+            iterations (slice): Iterations to read. Default: all.
+            parameters (list): Names or indices of the parameters to read. 
+                Default: all.
+
+        Returns:
+            chain (ndarray): Array of shape (n_walkers, n_steps, n_params)
+                for the selected walkers, iterations and parameters.
+        """
+
+        columns = ["param_{0}".format(i) for i in self._parameter_indices(parameters)]
+        return self._read(columns, walkers, iterations)
+
+    def ln_prob(self, walkers=None, iterations=None):
+        """
+        Read part of the ln(posterior) of the chain.
+
+        Args:
+            walkers (slice, int or list): Walkers to read. Default: all.
+            iterations (slice): Iterations to read. Default: all.
+
+        Returns:
+            ln_prob (ndarray): Array of shape (n_walkers, n_steps).
+        """
+
+        return self._read(["ln_prob"], walkers, iterations)[:, :, 0]
+
+    def samples(self, burn=0, thin=1, parameters=None):
+        """
+        The chain after burn-in, with the walkers concatenated.
+
+        Args:
+            burn (int): Number of iterations to discard.
+            thin (int): Keep every thin-th iteration.
+            parameters (list): Names or indices of the parameters. Default: all.
+
+        Returns:
+            samples (ndarray): Array of shape (n_samples, n_params).
+        """
+
+        chain = self.chain(iterations=slice(burn, None, thin), parameters=parameters)
+        return chain.reshape((-1, chain.shape[-1]))
+
+#-----------------------------------------------------------------------------#
+
+    def _parameter_indices(self, parameters):
+        if parameters is None:
+            return list(range(len(self.parameter_names)))
+        return [self.parameter_names.index(p) if isinstance(p, str) else int(p)
+                for p in parameters]
+
+    def _read(self, columns, walkers, iterations):
+        """
+        Read columns for the selected walkers and iterations, touching 
+        only the chunks that overlap the iterations. Each chunk is opened 
+        once for all the columns.
+
+        Returns:
+            values (ndarray): Array of shape (n_walkers, n_steps, n_columns).
+        """
+
+        if walkers is None:
+            walkers = slice(None)
+        elif np.ndim(walkers) == 0 and not isinstance(walkers, slice):
+            walkers = [walkers]
+        start, stop, step = (iterations or slice(None)).indices(self.manifest["n_iterations"])
+        wanted = np.arange(start, stop, step)
+
+        parts = []
+        for index, (chunk_start, chunk_stop) in enumerate(self.manifest["chunks"]):
+            selected = wanted[(wanted >= chunk_start) & (wanted < chunk_stop)]
+            if len(selected) == 0:
+                continue
+            parts.append(np.stack([values[walkers][:, selected - chunk_start]
+                                   for values in self._columns(index, columns)], axis=-1))
+
+        if not parts:
+            n_walkers = len(np.arange(self.manifest["n_walkers"])[walkers])
+            return np.empty((n_walkers, 0, len(columns)))
+        return np.concatenate(parts, axis=1)
+
+    def _columns(self, index, columns):
+        if self.manifest["compressed"]:
+            with np.load(os.path.join(self.directory, CHUNK_FILE.format(index))) as chunk:
+                return [chunk[column] for column in columns]
+        return [np.load(os.path.join(self.directory, COLUMN_FILE.format(index, column)), 
+                        mmap_mode="r") for column in columns]
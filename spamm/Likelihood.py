@@ -0,0 +1,244 @@
+#!/usr/bin/python
+
+import numpy as np
+from scipy.optimize import lsq_linear
+
+from utils.interp_matrix import interp_matrix
+
+#-----------------------------------------------------------------------------#
+
+class Likelihood(object):
+    r"""
+    Gaussian ln(likelihood) of model spectra given a data spectrum.
+        ln(L) = -0.5 \sum_n {\left[ \frac{(flux_{Obs}-flux_{model})^2}{\sigma^2}
+            + ln(2 \pi \sigma^2) \right]}
+    Everything that depends only on the data is computed once here, so that
+    each evaluation is a subtraction, a multiplication and a sum.
+
+    Pixels with a non-finite flux or error, a non-positive error, or a
+    wavelength outside of the model grid are dropped. If the model grid is
+    the data grid no interpolation is done; otherwise the model is
+    interpolated with a precomputed sparse matrix.
+
+    Attributes:
+        good (ndarray): Boolean mask of the data pixels that are used, or
+            None if all of them are.
+        interp_matrix (scipy.sparse.csr_matrix): Interpolation from the model
+            grid to the good data pixels, or None if the grids match.
+        flux (ndarray): Flux of the good data pixels.
+        inv_var (ndarray): 1/sigma^2 of the good data pixels.
+        ln_norm (float): -0.5 \sum_n ln(2 \pi \sigma^2) over the good pixels.
+        n_pix (int): Number of good pixels.
+    """
+
+    def __init__(self, data_spectrum, model_wavelengths):
+        """
+        Args:
+            data_spectrum (Spectrum object): The observed spectrum.
+            model_wavelengths (array): Wavelength grid the model fluxes
+                will be evaluated on.
+        """
+
+        wavelengths = np.asarray(data_spectrum.spectral_axis, dtype=float)
+        flux = np.asarray(data_spectrum.flux, dtype=float)
+        flux_error = np.asarray(data_spectrum.flux_error, dtype=float)
+        model_wavelengths = np.asarray(model_wavelengths, dtype=float)
+
+        good = np.isfinite(flux) & np.isfinite(flux_error) & (flux_error > 0)
+
+        same_grid = (len(model_wavelengths) == len(wavelengths) and
+                     np.array_equal(model_wavelengths, wavelengths))
+        if not same_grid:
+            good &= ((wavelengths >= model_wavelengths[0]) &
+                     (wavelengths <= model_wavelengths[-1]))
+
+        self.n_pix = int(np.count_nonzero(good))
+        if self.n_pix == 0:
+            raise Exception("The data spectrum has no usable pixels.")
+
+        if same_grid:
+            self.interp_matrix = None
+        else:
+            self.interp_matrix = interp_matrix(model_wavelengths, wavelengths[good])
+
+        self.good = None if self.n_pix == len(wavelengths) else good
+        self.flux = flux[good]
+        self.inv_var = 1. / flux_error[good]**2
+        self.ln_norm = -0.5 * np.sum(np.log(2 * np.pi * flux_error[good]**2))
+
+#-----------------------------------------------------------------------------#
+
+    def __call__(self, model_flux):
+        """
+        Args:
+            model_flux (ndarray): Model flux on the model wavelength grid,
+                either one spectrum of shape (n_pix,) or a batch of shape
+                (n_walkers, n_pix).
+
+        Returns:
+            ln_l (float or ndarray): ln(likelihood) of each model spectrum.
+                Model spectra that are not finite everywhere get -inf.
+        """
+
+        model_flux = np.asarray(model_flux, dtype=float)
+        if self.interp_matrix is not None:
+            model_flux = self.interp_matrix.dot(model_flux.T).T
+        elif self.good is not None:
+            model_flux = model_flux[..., self.good]
+
+        chi2 = np.sum((self.flux - model_flux)**2 * self.inv_var, axis=-1)
+        ln_l = self.ln_norm - 0.5 * chi2
+
+        return np.where(np.isfinite(ln_l), ln_l, -np.inf)[()]
+
+#-----------------------------------------------------------------------------#
+
+    def solve_linear(self, basis, offset, lower, upper):
+        """
+        Find the amplitudes a that maximize the likelihood of the model
+            offset + a.dot(basis)
+        within lower <= a <= upper, by weighted linear least squares. The
+        unconstrained solution is used if it is within the bounds; 
+        otherwise the bounded problem is solved with scipy's lsq_linear.
+        Basis spectra that are zero on every good pixel are not
+        constrained by the data; their amplitude is set to the bound
+        closest to zero.
+
+        Args:
+            basis (ndarray): Array of shape (n_amplitudes, n_pix) on the 
+                model wavelength grid.
+            offset (ndarray): Flux that does not depend on the amplitudes.
+            lower (array): Lower bound of each amplitude.
+            upper (array): Upper bound of each amplitude.
+
+        Returns:
+            amplitudes (ndarray): Best-fit amplitudes.
+            ln_l (float): ln(likelihood) of the best-fit model, or -inf if
+                the model is not finite.
+            fisher (ndarray): Fisher matrix basis C^-1 basis^T of the 
+                amplitudes, of shape (n_amplitudes, n_amplitudes).
+        """
+
+        basis = np.asarray(basis, dtype=float).reshape(len(lower), -1)
+        offset = np.asarray(offset, dtype=float)
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        if self.interp_matrix is not None:
+            basis = self.interp_matrix.dot(basis.T).T
+            offset = self.interp_matrix.dot(offset)
+        elif self.good is not None:
+            basis = basis[:, self.good]
+            offset = offset[self.good]
+
+        weight = np.sqrt(self.inv_var)
+        return self._solve_whitened(basis * weight, (self.flux - offset) * weight,
+                                    lower, upper)
+
+    def _solve_whitened(self, design, target, lower, upper):
+        """
+        solve_linear() for the basis and the data minus the offset on the
+        good pixels, both divided by the flux errors.
+        """
+
+        amplitudes = np.clip(0., lower, upper)
+        fisher = np.zeros((len(lower), len(lower)))
+        if not (np.all(np.isfinite(design)) and np.all(np.isfinite(target))):
+            return amplitudes, -np.inf, fisher
+
+        # Work with columns scaled to unit norm so that amplitudes of very
+        # different sizes are solved accurately.
+        design = design.T
+        scale = np.sqrt(np.sum(design**2, axis=0))
+        active = scale > 0
+
+        if np.any(active):
+            scaled = design[:, active] / scale[active]
+            lo = lower[active] * scale[active]
+            hi = upper[active] * scale[active]
+            try:
+                x = np.linalg.solve(scaled.T.dot(scaled), scaled.T.dot(target))
+            except np.linalg.LinAlgError:
+                x = np.full(len(lo), np.nan)
+            if not np.all((x >= lo) & (x <= hi)):
+                x = lsq_linear(scaled, target, bounds=(lo, hi), method="bvls").x
+            amplitudes[active] = x / scale[active]
+            fisher[np.ix_(active, active)] = design[:, active].T.dot(design[:, active])
+
+        residual = target - design.dot(amplitudes)
+        ln_l = self.ln_norm - 0.5 * np.dot(residual, residual)
+        if not np.isfinite(ln_l):
+            ln_l = -np.inf
+
+        return amplitudes, ln_l, fisher
+
+#-----------------------------------------------------------------------------#
+
+    def solve_linear_batch(self, basis, offset, lower, upper):
+        """
+        solve_linear() for a batch of models, with one normal-equation 
+        solve for all of them. Models whose unconstrained solution is out 
+        of bounds, or that have unconstrained amplitudes, are solved one at
+        a time with solve_linear().
+
+        Args:
+            basis (ndarray): Array of shape (n_models, n_amplitudes, n_pix).
+            offset (ndarray): Array of shape (n_models, n_pix).
+            lower (array): Lower bound of each amplitude.
+            upper (array): Upper bound of each amplitude.
+
+        Returns:
+            amplitudes (ndarray): Array of shape (n_models, n_amplitudes).
+            ln_l (ndarray): Array of shape (n_models,).
+            fisher (ndarray): Array of shape (n_models, n_amplitudes, 
+                n_amplitudes).
+            projection (ndarray): basis C^-1 (flux - offset) of each model,
+                of shape (n_models, n_amplitudes), so that the likelihood
+                of amplitudes a is Gaussian with precision fisher and mean
+                solving fisher.dot(mean) = projection.
+        """
+
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        basis = np.asarray(basis, dtype=float).reshape(len(offset), len(lower), -1)
+        offset = np.asarray(offset, dtype=float)
+        if self.interp_matrix is not None:
+            n_models, n_amplitudes = basis.shape[:2]
+            basis = self.interp_matrix.dot(basis.reshape(-1, basis.shape[-1]).T).T
+            basis = basis.reshape(n_models, n_amplitudes, -1)
+            offset = self.interp_matrix.dot(offset.T).T
+        elif self.good is not None:
+            basis = basis[..., self.good]
+            offset = offset[..., self.good]
+
+        weight = np.sqrt(self.inv_var)
+        design = basis * weight
+        target = (self.flux - offset) * weight
+        fisher = np.einsum("nkp,nlp->nkl", design, design)
+        projection = np.einsum("nkp,np->nk", design, target)
+        scale = np.sqrt(np.einsum("nkk->nk", fisher))
+
+        amplitudes = np.full((len(offset), len(lower)), np.nan)
+        finite = (np.all(np.isfinite(fisher), axis=(1, 2)) & 
+                  np.all(np.isfinite(projection), axis=1) & np.all(scale > 0, axis=1))
+        if np.any(finite):
+            s = scale[finite]
+            try:
+                x = np.linalg.solve(fisher[finite] / (s[:, :, np.newaxis] * s[:, np.newaxis, :]),
+                                    (projection[finite] / s)[..., np.newaxis])[..., 0] / s
+            except np.linalg.LinAlgError:
+                x = np.full(s.shape, np.nan)
+            amplitudes[finite] = x
+        inside = np.all((amplitudes >= lower) & (amplitudes <= upper), axis=1)
+
+        ln_l = np.full(len(offset), -np.inf)
+        if np.any(inside):
+            a = amplitudes[inside]
+            chi2 = (np.sum(target[inside]**2, axis=1) - 2 * np.sum(a * projection[inside], axis=1) +
+                    np.einsum("nk,nkl,nl->n", a, fisher[inside], a))
+            ln_l[inside] = self.ln_norm - 0.5 * chi2
+        for i in np.flatnonzero(~inside):
+            amplitudes[i], ln_l[i], fisher[i] = self._solve_whitened(design[i], target[i],
+                                                                     lower, upper)
+        ln_l = np.where(np.isfinite(ln_l), ln_l, -np.inf)
+
+        return amplitudes, ln_l, fisher, projection
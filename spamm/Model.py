@@ -1,24 +1,70 @@
 #!/usr/bin/python
 
 import sys
+import time
+import functools
+import multiprocessing
 import numpy as np
 from scipy.interpolate import interp1d
-import matplotlib.pyplot as plt
-from astropy import units as u
+from scipy.optimize import minimize
+from scipy.special import log_ndtr, ndtri_exp
 
-import emcee
-
-from .Spectrum import Spectrum
+from .Spectrum import Spectrum, SlimSpectrum
+from .Likelihood import Likelihood
+from .ChainStore import ChainStore
+from .SamplerBackend import get_backend, EmceeBackend, EMCEE_MAJOR_VERSION
+from utils.autocorr import integrated_time
+from utils.timing import TimingCounters
 
 iteration_count = 0
 
+# Model held by each ModelPool worker process.
+_pool_model = None
+
+# Number of samples whose linear parameters are solved for at once by 
+# Model.expand_parameters_batch(); their bases are held in memory together.
+LINEAR_BATCH_SIZE = 32
+
+# Draws of the linear parameters that fall outside of their bounds are
+# replaced by this many Gibbs sweeps, see _draw_truncated_gaussian().
+TRUNCATED_GIBBS_SWEEPS = 20
+
+# Seed of the draws of the linear parameters in Model.chain.
+LINEAR_DRAW_SEED = 0
+
 #-----------------------------------------------------------------------------#
 
 class MCMCDidNotConverge(Exception):
+    """
+    Raised by Model.run_mcmc when a convergence check was requested and 
+    the chain did not converge within n_iterations.
+    """
     pass
 
 #-----------------------------------------------------------------------------#
 
+def _profiled(name):
+    """
+    Decorator for Model methods: if Model.profile is True, count the calls
+    and wall time of the method in Model.timing under name.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not getattr(self, "profile", False):
+                return method(self, *args, **kwargs)
+            t1 = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.timing.record(name, time.perf_counter() - t1)
+        return wrapper
+
+    return decorator
+
+#-----------------------------------------------------------------------------#
+
 # TODO arg pos is not even used vv
 def sort_on_runtime(pos):
     """
@@ -73,13 +119,414 @@ def ln_posterior(new_params, *args):
     # Compare the model spectrum to the data, generate model spectrum given 
     # model parameters, and calculate the log likelihood.
     else:    
-        model_spectrum_flux = model.model_flux(params=new_params)
-        ln_likelihood = model.likelihood(model_spectrum_flux=model_spectrum_flux)
+        if model.marginalize_linear:
+            ln_likelihood = model.marginal_likelihood(params=new_params)
+        else:
+            model_spectrum_flux = model.model_flux(params=new_params)
+            ln_likelihood = model.likelihood(model_spectrum_flux=model_spectrum_flux)
     
         return ln_likelihood + ln_prior 
 
 #-----------------------------------------------------------------------------#
 
+def ln_likelihood(new_params, *args):
+    """
+    Return the logarithm of the likelihood alone, for samplers that treat
+    the prior separately (see NestedBackend). Like ln_posterior, it is
+    -inf outside of the priors.
+
+    Args:
+        new_params (ndarray): Array in the parameter space used as input
+            into sampler.
+        args: Additional arguments passed to this function
+            (i.e. the Model object).
+
+    Returns:
+        ln_likelihood (float): ln(likelihood).
+    """
+
+    count_iterations(1)
+    model = args[0]
+
+    if not np.isfinite(model.prior(params=new_params)):
+        return -np.inf
+    if model.marginalize_linear:
+        return model.marginal_likelihood(params=new_params)
+
+    model_spectrum_flux = model.model_flux(params=new_params)
+    return model.likelihood(model_spectrum_flux=model_spectrum_flux)
+
+#-----------------------------------------------------------------------------#
+
+def ln_posterior_batch(new_params, *args):
+    """
+    Return the logarithm of the posterior function for a whole ensemble of
+    walkers at once. This is the vectorized counterpart of ln_posterior.
+
+    Args:
+        new_params (ndarray): 2D array of shape (n_walkers, n_parameters).
+        args: Additional arguments passed to this function 
+            (i.e. the Model object).
+
+    Returns:
+        ln_post (ndarray): Array of shape (n_walkers,) of log-probabilities.
+    """
+
+    new_params = np.atleast_2d(new_params)
+    count_iterations(len(new_params))
+
+    model = args[0]
+
+    return _ln_posterior_batch(new_params, model)
+
+#-----------------------------------------------------------------------------#
+
+def count_iterations(n):
+    """
+    Add n posterior evaluations to the global iteration count and print 
+    the count every 20 evaluations.
+
+    Args:
+        n (int): Number of evaluations.
+    """
+
+    global iteration_count
+    previous_count = iteration_count
+    iteration_count = iteration_count + n
+    if iteration_count // 20 > previous_count // 20:
+        print("iteration count: {0}".format(iteration_count))
+
+#-----------------------------------------------------------------------------#
+
+def _ln_posterior_batch(new_params, model):
+    """
+    ln_posterior_batch without updating the iteration count.
+    """
+
+    ln_prior = model.prior_batch(params=new_params)
+    ln_post = np.full(len(new_params), -np.inf)
+
+    # Only calculate the flux of walkers that lie within the bounds of the
+    # priors.
+    in_bounds = np.isfinite(ln_prior)
+    if np.any(in_bounds) and model.marginalize_linear:
+        ln_likelihood = np.array([model.marginal_likelihood(params=p) 
+                                  for p in new_params[in_bounds]])
+        ln_post[in_bounds] = ln_likelihood + ln_prior[in_bounds]
+    elif np.any(in_bounds):
+        model_spectrum_fluxes = model.model_flux_batch(params=new_params[in_bounds])
+        ln_likelihood = model.likelihood_batch(model_spectrum_fluxes=model_spectrum_fluxes)
+        ln_post[in_bounds] = ln_likelihood + ln_prior[in_bounds]
+
+    return ln_post
+
+#-----------------------------------------------------------------------------#
+
+def _fisher_factor(fisher):
+    """
+    Cholesky factor of a Fisher matrix after scaling it to unit diagonal,
+    which keeps it well conditioned when the parameters have very
+    different sizes. Rows and columns with a zero diagonal (parameters 
+    the data do not constrain) are left out.
+
+    Args:
+        fisher (ndarray): Fisher matrix.
+
+    Returns:
+        scale (ndarray): Square root of the diagonal of fisher.
+        factor (ndarray): Lower triangular L with L L^T equal to the scaled
+            Fisher matrix of the constrained parameters, or None if it is
+            not positive definite.
+    """
+
+    scale = np.sqrt(np.clip(np.diag(fisher), 0, None))
+    active = scale > 0
+    scaled = fisher[np.ix_(active, active)] / np.outer(scale[active], scale[active])
+    try:
+        factor = np.linalg.cholesky(scaled)
+    except np.linalg.LinAlgError:
+        factor = None
+
+    return scale, factor
+
+#-----------------------------------------------------------------------------#
+
+def _truncated_normal(a, b, random_state):
+    """
+    Draw from standard normal distributions truncated to [a, b], by 
+    inverting their cumulative distributions. This is done in logs, on 
+    the side of the lower tail, so that it stays accurate far in the tails.
+
+    Args:
+        a (ndarray): Lower bounds.
+        b (ndarray): Upper bounds, with b >= a.
+        random_state (RandomState object): Generator of the draws.
+
+    Returns:
+        x (ndarray): The draws.
+    """
+
+    flip = a > 0
+    a, b = np.where(flip, -b, a), np.where(flip, -a, b)
+    ln_a = log_ndtr(a)
+    ln_b = log_ndtr(b)
+    with np.errstate(divide="ignore"):
+        ln_mass = ln_b + np.log1p(-np.exp(ln_a - ln_b))
+    x = ndtri_exp(np.logaddexp(ln_a, np.log(random_state.uniform(size=np.shape(a))) + ln_mass))
+    x = np.clip(x, a, b)
+
+    return np.where(flip, -x, x)
+
+#-----------------------------------------------------------------------------#
+
+def _draw_truncated_gaussian(start, fisher, projection, lower, upper, random_state,
+                             n_tries=10, n_sweeps=TRUNCATED_GIBBS_SWEEPS):
+    """
+    Draw one vector from each of a batch of Gaussians with precision 
+    fisher and mean solving fisher.dot(mean) = projection, truncated to
+    lower <= x <= upper. Each row is drawn from its whole Gaussian up to 
+    n_tries times until the draw is within the bounds; rows that are still
+    outside are sampled by n_sweeps Gibbs sweeps from start, drawing one
+    coordinate at a time from its truncated conditional. Coordinates with
+    zero precision, which the data do not constrain, keep their value in
+    start, as do rows whose precision is not positive definite.
+
+    Args:
+        start (ndarray): Array of shape (n, k) within the bounds, e.g. the
+            bounded best fit.
+        fisher (ndarray): Precision matrices, of shape (n, k, k).
+        projection (ndarray): Array of shape (n, k).
+        lower (ndarray): Lower bounds, of shape (k,).
+        upper (ndarray): Upper bounds, of shape (k,).
+        random_state (RandomState object): Generator of the draws.
+        n_tries (int): Number of draws from the whole Gaussians.
+        n_sweeps (int): Number of Gibbs sweeps.
+
+    Returns:
+        draws (ndarray): Array of shape (n, k).
+    """
+
+    n, k = start.shape
+    draws = np.array(start, dtype=float)
+    diagonal = np.einsum("nkk->nk", fisher)
+    active = diagonal > 0
+    if k == 0 or not np.any(active):
+        return draws
+
+    # Scale to unit diagonal, with the unconstrained coordinates decoupled.
+    scale = np.sqrt(np.where(active, diagonal, 1.))
+    scaled = fisher / (scale[:, :, np.newaxis] * scale[:, np.newaxis, :])
+    both = active[:, :, np.newaxis] & active[:, np.newaxis, :]
+    scaled = np.where(both, scaled, np.eye(k))
+    factor = np.zeros_like(scaled)
+    positive = np.ones(n, dtype=bool)
+    try:
+        factor[:] = np.linalg.cholesky(scaled)
+    except np.linalg.LinAlgError:
+        for i in range(n):
+            try:
+                factor[i] = np.linalg.cholesky(scaled[i])
+            except np.linalg.LinAlgError:
+                positive[i] = False
+                factor[i] = np.eye(k)
+    factor_t = np.swapaxes(factor, 1, 2)
+    mean = np.linalg.solve(factor, (np.where(active, projection, 0.) / scale)[..., np.newaxis])
+    mean = np.where(active, np.linalg.solve(factor_t, mean)[..., 0] / scale, draws)
+
+    pending = positive.copy()
+    for i in range(n_tries):
+        if not np.any(pending):
+            break
+        noise = random_state.normal(size=(n, k))
+        step = np.linalg.solve(factor_t, noise[..., np.newaxis])[..., 0]
+        sample = np.where(active, mean + step / scale, draws)
+        accept = pending & np.all((sample >= lower) & (sample <= upper), axis=1)
+        draws[accept] = sample[accept]
+        pending &= ~accept
+
+    rows = np.flatnonzero(pending)
+    for sweep in range(n_sweeps if len(rows) else 0):
+        for j in range(k):
+            free = rows[active[rows, j]]
+            if len(free) == 0:
+                continue
+            precision = fisher[free, j, j]
+            others = np.einsum("nk,nk->n", fisher[free, j], draws[free]) - precision * draws[free, j]
+            loc = (projection[free, j] - others) / precision
+            sigma = 1. / np.sqrt(precision)
+            value = loc + sigma * _truncated_normal((lower[j] - loc) / sigma,
+                                                    (upper[j] - loc) / sigma, random_state)
+            draws[free, j] = np.clip(value, lower[j], upper[j])
+
+    return draws
+
+#-----------------------------------------------------------------------------#
+
+class VectorizedPool(object):
+    """
+    Minimal pool object that lets emcee evaluate the whole ensemble with a 
+    single call to ln_posterior_batch instead of one call per walker.
+
+    Attributes:
+        model (Model object): The model to evaluate.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def map(self, function, iterable):
+        """
+        Evaluate the log-posterior of every position in iterable. 
+        function is the per-walker wrapper emcee passes in; it is 
+        replaced by the batched evaluation.
+        """
+
+        positions = np.array(list(iterable))
+        return list(ln_posterior_batch(positions, self.model))
+
+    def close(self):
+        """
+        Nothing to release; for compatibility with ModelPool.
+        """
+
+        pass
+
+#-----------------------------------------------------------------------------#
+
+def _init_pool_worker(model):
+    """
+    Store the model in a ModelPool worker process.
+    """
+
+    global _pool_model
+    _pool_model = model
+
+#-----------------------------------------------------------------------------#
+
+def _ln_posterior_chunk(positions):
+    """
+    Evaluate a chunk of walkers with the model of this worker process.
+    If the model is profiled, the timing counters of the chunk are 
+    returned too, to be added to those of the main process.
+    """
+
+    ln_post = _ln_posterior_batch(positions, _pool_model)
+    if getattr(_pool_model, "profile", False):
+        return ln_post, _pool_model.timing.pop()
+    return ln_post, None
+
+#-----------------------------------------------------------------------------#
+
+def _maximize_posterior(model, start, lower, upper, max_evaluations):
+    """
+    Maximize the posterior from one starting point with the bounded Powell
+    method. The search is done in coordinates scaled to the unit interval
+    within the bounds, since the parameters differ by many orders of
+    magnitude (e.g. normalizations of 1e-15 and temperatures of 1e4).
+
+    Args:
+        model (Model object): The model.
+        start (ndarray): Starting point, in the sampled parameter space.
+        lower (ndarray): Lower bounds of the sampled parameters.
+        upper (ndarray): Upper bounds of the sampled parameters.
+        max_evaluations (int): Maximum number of posterior evaluations.
+
+    Returns:
+        params (ndarray): Parameters of the maximum found.
+        ln_post (float): ln(posterior) at params.
+    """
+
+    finite = np.isfinite(lower) & np.isfinite(upper)
+    offset = np.where(finite, lower, 0.)
+    scale = np.where(finite, upper - lower, 1.)
+
+    def objective(u):
+        ln_post = _ln_posterior_batch(np.atleast_2d(offset + scale * u), model)[0]
+        return -ln_post if np.isfinite(ln_post) else np.inf
+
+    u_bounds = [(0., 1.) if f else (None, None) for f in finite]
+    result = minimize(objective, (np.asarray(start) - offset) / scale, 
+                      method="Powell", bounds=u_bounds,
+                      options={"maxfev": max_evaluations})
+    params = offset + scale * result.x
+
+    return params, _ln_posterior_batch(np.atleast_2d(params), model)[0]
+
+#-----------------------------------------------------------------------------#
+
+def _maximize_posterior_worker(args):
+    """
+    _maximize_posterior with the model of this worker process.
+    """
+
+    return _maximize_posterior(_pool_model, *args)
+
+#-----------------------------------------------------------------------------#
+
+class ModelPool(object):
+    """
+    Pool of worker processes for emcee. The model is sent to each worker 
+    once, when the pool is created; after that only walker positions and 
+    log-probabilities are passed between processes. Each step the walkers 
+    are split into one chunk per process and every chunk is evaluated with 
+    ln_posterior_batch.
+
+    Attributes:
+        processes (int): Number of worker processes.
+    """
+
+    def __init__(self, model, processes=None):
+        """
+        Args:
+            model (Model object): The model to evaluate. Its data spectrum 
+                must already be set.
+            processes (int): Number of worker processes. If None, use all 
+                available CPUs.
+        """
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = int(processes)
+        self._timing = model.timing if getattr(model, "profile", False) else None
+        self._pool = multiprocessing.Pool(processes=self.processes,
+                                          initializer=_init_pool_worker,
+                                          initargs=(model,))
+
+    def map(self, function, iterable):
+        """
+        Evaluate the log-posterior of every position in iterable. 
+        function is the per-walker wrapper emcee passes in; it is 
+        replaced by the batched evaluation.
+        """
+
+        positions = np.array(list(iterable))
+        count_iterations(len(positions))
+        chunks = [chunk for chunk in np.array_split(positions, self.processes) 
+                  if len(chunk) > 0]
+        results = self._pool.map(_ln_posterior_chunk, chunks)
+        if self._timing is not None:
+            for ln_post, timing in results:
+                self._timing.merge(timing)
+
+        return list(np.concatenate([ln_post for ln_post, timing in results]))
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+
+        self._pool.close()
+        self._pool.join()
+
+    def __getstate__(self):
+        # The workers cannot be pickled, e.g. with the sampler when the 
+        # model is saved.
+        odict = self.__dict__.copy()
+        odict["_pool"] = None
+        return odict
+
+#-----------------------------------------------------------------------------#
+
 #TODO do we need all these commented attributes??
 class Model(object):
     """
@@ -91,8 +538,27 @@ class Model(object):
         z ():
         components ():
         mpi (): 
-        sampler ():
-        model_spectrum (Spectrum object): 
+        sampler (): The sampler object of the last run_mcmc, e.g. an
+            emcee.EnsembleSampler.
+        result (SamplerResult object): Chain, ln(posterior), acceptance 
+            fractions and timing of the last run_mcmc, in the same form for
+            every sampler backend.
+        marginalize_linear (Bool): If True, the sampler only explores the
+            parameters the model flux is not proportional to, and the
+            linear parameters are marginalized over analytically; see
+            marginal_likelihood().
+        profile (Bool): If True, the calls of the components (flux, 
+            extinction, ln_priors, ...) and of model_flux, likelihood and
+            prior are timed; see timing_report().
+        timing (TimingCounters object): The timing counters.
+        autocorr_time (ndarray): Last estimate of the integrated 
+            autocorrelation time of each parameter, if convergence was 
+            checked during run_mcmc.
+        model_spectrum (SlimSpectrum object): 
+        _slim_data_spectrum (SlimSpectrum object): The data spectrum as 
+            passed to the components and the likelihood.
+        _likelihood (Likelihood object): ln(likelihood) of model fluxes given
+            the data spectrum, rebuilt whenever the data spectrum is set.
         downsample_data_if_needed (Bool):
         upsample_components_if_needed (Bool):
         print_parameters (Bool): Used for debugging.
@@ -110,18 +576,26 @@ class Model(object):
 
         self._mask = None
         self._data_spectrum = None
+        self._slim_data_spectrum = None
         
         self.z = None
         self.components = []
         self.mpi = mpi
 
         self.sampler = None
+        self.result = None
         #self.sampler_output = None
+        self.marginalize_linear = False
+        self.autocorr_time = None
+        self.profile = False
+        self.timing = TimingCounters()
+        self._full_chain = None
+        self._likelihood = None
 
         wl_init = np.arange(wavelength_start, wavelength_end, wavelength_delta)
-        self.model_spectrum = Spectrum(spectral_axis = wl_init,
-                                       flux = np.zeros(len(wl_init)),
-                                       flux_error=np.zeros(len(wl_init)))
+        self.model_spectrum = SlimSpectrum(spectral_axis = wl_init,
+                                           flux = np.zeros(len(wl_init)),
+                                           flux_error=np.zeros(len(wl_init)))
 
         # Flag to allow Model to interpolate components' wavelength grid to 
         # match data if component grid is more course than data.
@@ -181,6 +655,8 @@ class Model(object):
         """
 
         self._data_spectrum = new_data_spectrum
+        # Everything inside the fit only needs the arrays.
+        self._slim_data_spectrum = SlimSpectrum.from_spectrum(new_data_spectrum)
 
         if len(self.components) == 0:
             raise Exception("Components must be added before defining the data spectrum.")
@@ -200,7 +676,7 @@ class Model(object):
         worst_component = None # holds component with most course wavelength grid spacing
 
         for component in self.components:
-            component.initialize(data_spectrum=new_data_spectrum)
+            component.initialize(data_spectrum=self._slim_data_spectrum)
              
             if component.grid_spacing() and component.grid_spacing() > gs:
                 gs = component.grid_spacing()
@@ -239,54 +715,352 @@ class Model(object):
                 "Model class ('upsample_components_if_needed', "
                 "'downsample_data_if_needed') to override this.")
 
+        self._likelihood = Likelihood(data_spectrum=self._slim_data_spectrum,
+                                      model_wavelengths=self.model_spectrum.spectral_axis)
+
 #-----------------------------------------------------------------------------#
 
-    def run_mcmc(self, n_walkers=100, n_iterations=100):
+    def run_mcmc(self, n_walkers=100, n_iterations=100, vectorize=False,
+                 processes=None, chain_store=None, checkpoint_every=100,
+                 resume=False, check_every=None, tau_factor=50, 
+                 tau_tolerance=0.01, marginalize_linear=False, start=None,
+                 ball_size=1e-3, backend="emcee", backend_options=None):
         """
-        Run emcee MCMC.
+        Run MCMC, by default with emcee. The samples are in Model.result
+        and Model.chain, and the sampler object in Model.sampler.
     
         Args:
             n_walkers (int): Number of walkers to pass to the MCMC.
             n_iteratins (int): Number of iterations to pass to the MCMC. 
+            vectorize (Bool): If True, evaluate all walkers of each step 
+                with a single call to ln_posterior_batch.
+            processes (int): If greater than 1, split the walkers of each 
+                step across this many worker processes with ModelPool.
+            chain_store (str): If not None, directory of a ChainStore the
+                chain and sampler state are saved to while sampling.
+            checkpoint_every (int): Number of iterations between checkpoints.
+            resume (Bool): If True and chain_store holds a checkpoint,
+                continue that run until it has n_iterations iterations.
+                Otherwise any previous checkpoint is discarded.
+            check_every (int): If not None, estimate the autocorrelation 
+                time tau of every parameter each check_every iterations,
+                from the last half of the chain so that the burn-in does 
+                not bias it, and stop once that half is longer than 
+                tau_factor*tau and tau changed by less than tau_tolerance (relative) since the
+                last check. n_iterations is then the maximum number of 
+                iterations, and MCMCDidNotConverge is raised if it is 
+                reached first.
+            tau_factor (float): Required chain length in units of tau.
+            tau_tolerance (float): Required relative stability of tau.
+            marginalize_linear (Bool): If True, only sample the parameters
+                the model flux is not proportional to (see 
+                marginal_likelihood). The chain in the full parameter space
+                is then Model.chain.
+            start (array): If not None, start the walkers in a small ball 
+                around this point of the sampled parameter space, e.g. the
+                result of find_map(), instead of drawing them from the 
+                priors.
+            ball_size (float): Standard deviation of the ball, as a 
+                fraction of the prior range of each parameter.
+            backend (str or SamplerBackend): Sampler to use: "emcee" (the
+                affine-invariant ensemble sampler), "pt" (parallel 
+                tempering) or "nested" (nested sampling with dynesty), or
+                a SamplerBackend object; see SamplerBackend. vectorize, 
+                processes and MPI are only supported by backends that use
+                the model pools, and checkpoints and convergence checks 
+                only by emcee 2.
+            backend_options (dict): Passed to the constructor of the 
+                backend, e.g. {"n_temps": 4} for "pt".
         """
 
+        backend = get_backend(backend, **(backend_options or {}))
+        if not backend.uses_pool and (self.mpi or vectorize or 
+                                      (processes is not None and processes > 1)):
+            raise Exception("The {0} sampler backend does not support vectorize, "
+                            "processes or MPI.".format(backend.name))
+        step_by_step = chain_store is not None or check_every is not None
+        if step_by_step and not (isinstance(backend, EmceeBackend) and 
+                                 EMCEE_MAJOR_VERSION < 3):
+            raise Exception("Checkpoints and convergence checks need the emcee "
+                            "backend with emcee 2.")
+
+        self.marginalize_linear = marginalize_linear
+        self._full_chain = None
+        sampled = np.flatnonzero(self.sampled_parameter_mask())
+
         # Initialize walker matrix with initial parameters
         walkers_matrix = [] # must be a list, not an np.array
         for walker in range(n_walkers):
             walker_params = []
             for component in self.components:
-                walker_params = walker_params + component.initial_values(self.data_spectrum)
-            walkers_matrix.append(walker_params)
+                walker_params = walker_params + component.initial_values(self._slim_data_spectrum)
+            walkers_matrix.append([walker_params[i] for i in sampled])
+        if start is not None:
+            walkers_matrix = self._start_ball(start, n_walkers, ball_size)
 
         global iteration_count
         iteration_count = 0
+        model_pool = None
 
-        # Create MCMC sampler. To enable multiproccessing, set threads > 1.
-        # If using multiprocessing, the "lnpostfn" and "args" parameters 
-        # must be pickleable.
+        # Set up the pool the sampler evaluates the walkers of each step
+        # with. The posterior function and the model must be pickleable to
+        # be sent to other processes.
         if self.mpi:
             # Initialize the multiprocessing pool object.
             from emcee.utils import MPIPool
-            pool = MPIPool(loadbalance=True)
-            if not pool.is_master():
-                    pool.wait()
+            model_pool = MPIPool(loadbalance=True)
+            if not model_pool.is_master():
+                    model_pool.wait()
                     sys.exit(0)
-            self.sampler = emcee.EnsembleSampler(nwalkers=n_walkers, 
-                                                 dim=len(walkers_matrix[0]),
-                                                 lnpostfn=ln_posterior, 
-                                                 args=[self], pool=pool,
-                                                 runtime_sortingfn=sort_on_runtime)
-            self.sampler.run_mcmc(walkers_matrix, n_iterations)
-            pool.close()
 
+        elif processes is not None and processes > 1:
+            # Drop the previous sampler so that it is not sent to the workers.
+            self.sampler = None
+            self.result = None
+            model_pool = ModelPool(self, processes=processes)
+
+        elif vectorize:
+            model_pool = VectorizedPool(self)
+
+        self.autocorr_time = None
+        try:
+            if not step_by_step:
+                self.result = backend.run(self, walkers_matrix, n_iterations, 
+                                          pool=model_pool)
+                self.sampler = backend.sampler
+            else:
+                t1 = time.time()
+                self.sampler = backend.make_sampler(self, n_walkers, 
+                                                    len(walkers_matrix[0]), 
+                                                    pool=model_pool)
+                converged = self._run_steps(walkers_matrix, n_iterations, 
+                                            chain_store, checkpoint_every, resume,
+                                            check_every, tau_factor, tau_tolerance)
+                self.result = backend.result(time.time() - t1)
+                if not converged:
+                    raise MCMCDidNotConverge(
+                        "The chain did not converge within {0} iterations; the "
+                        "autocorrelation times are {1}".format(n_iterations, 
+                                                               self.autocorr_time))
+        finally:
+            if model_pool is not None:
+                model_pool.close()
+
+#-----------------------------------------------------------------------------#
+
+    def parameter_bounds(self):
+        """
+        Return the bounds of the priors of all parameters.
+
+        Returns:
+            lower (ndarray): Lower bound of each parameter.
+            upper (ndarray): Upper bound of each parameter.
+        """
+
+        bounds = []
+        for component in self.components:
+            bounds += component.bounds()
+        bounds = np.array(bounds, dtype=float).reshape(-1, 2)
+
+        return bounds[:, 0], bounds[:, 1]
+
+#-----------------------------------------------------------------------------#
+
+    def find_map(self, n_starts=8, processes=None, max_evaluations=2000,
+                 marginalize_linear=False):
+        """
+        Find the maximum a posteriori (MAP) parameters by running a bounded
+        optimizer (Powell's method) from n_starts points drawn from the 
+        priors, and keeping the best result. Pass the result to 
+        run_mcmc(start=...) to start the walkers close to it.
+
+        Args:
+            n_starts (int): Number of starting points.
+            processes (int): If greater than 1, run the optimizations in 
+                this many worker processes.
+            max_evaluations (int): Maximum number of posterior evaluations
+                of each optimization.
+            marginalize_linear (Bool): If True, optimize only the nonlinear
+                parameters, see run_mcmc(). This must match run_mcmc.
+
+        Returns:
+            params (ndarray): MAP parameters, in the sampled parameter space.
+            ln_post (float): ln(posterior) at the MAP.
+        """
+
+        self.marginalize_linear = marginalize_linear
+        sampled = np.flatnonzero(self.sampled_parameter_mask())
+
+        # Drawing from the priors also sets the bounds that depend on the
+        # data, e.g. norm_max.
+        starts = []
+        for i in range(n_starts):
+            start = []
+            for component in self.components:
+                start = start + component.initial_values(self._slim_data_spectrum)
+            starts.append(np.array(start)[sampled])
+
+        lower, upper = self.parameter_bounds()
+        jobs = [(start, lower[sampled], upper[sampled], max_evaluations) 
+                for start in starts]
+        if processes is not None and processes > 1:
+            pool = multiprocessing.Pool(processes=processes, initializer=_init_pool_worker,
+                                        initargs=(self,))
+            try:
+                results = pool.map(_maximize_posterior_worker, jobs)
+            finally:
+                pool.close()
+                pool.join()
         else:
-            self.sampler = emcee.EnsembleSampler(nwalkers=n_walkers, 
-                                                 dim=len(walkers_matrix[0]),
-                                                 lnpostfn=ln_posterior, args=[self],
-                                                 threads=1)
-        
-        #self.sampler_output = self.sampler.run_mcmc(walkers_matrix, n_iterations)
-        self.sampler.run_mcmc(walkers_matrix, n_iterations)
+            results = [_maximize_posterior(self, *job) for job in jobs]
+
+        params, ln_post = max(results, key=lambda result: result[1])
+        if not np.isfinite(ln_post):
+            raise Exception("None of the {0} optimizations found a point with "
+                            "finite posterior.".format(n_starts))
+
+        return params, ln_post
+
+#-----------------------------------------------------------------------------#
+
+    def _start_ball(self, start, n_walkers, ball_size):
+        """
+        Draw walker positions from a Gaussian ball around start, with a 
+        standard deviation of ball_size times the prior range of each
+        parameter (or of the parameter value if the prior is unbounded).
+        Positions outside of the priors are drawn again.
+
+        Returns:
+            walkers_matrix (list): List of n_walkers positions.
+        """
+
+        start = np.asarray(start, dtype=float)
+        sampled = self.sampled_parameter_mask()
+        if len(start) != np.count_nonzero(sampled):
+            raise Exception("start has {0} parameters, but {1} parameters are "
+                            "sampled.".format(len(start), np.count_nonzero(sampled)))
+
+        lower, upper = self.parameter_bounds()
+        width = (upper - lower)[sampled]
+        width = ball_size * np.where(np.isfinite(width), width, np.maximum(np.abs(start), 1.))
+
+        walkers_matrix = []
+        for walker in range(n_walkers):
+            for i in range(100):
+                position = start + width * np.random.normal(size=len(start))
+                if np.isfinite(self.prior(params=position)):
+                    break
+            else:
+                raise Exception("Could not draw a walker within the priors around "
+                                "start; decrease ball_size.")
+            walkers_matrix.append(position.tolist())
+
+        return walkers_matrix
+
+#-----------------------------------------------------------------------------#
+
+    def _run_steps(self, walkers_matrix, n_iterations, chain_store, 
+                   checkpoint_every, resume, check_every, tau_factor, 
+                   tau_tolerance):
+        """
+        Advance self.sampler step by step. If chain_store is not None, the 
+        new part of the chain and the sampler state are appended to a 
+        ChainStore every checkpoint_every iterations and at the end of the 
+        run. If check_every is not None, the run stops early once it has 
+        converged (see run_mcmc).
+
+        Args:
+            walkers_matrix (list): Initial walker positions.
+            n_iterations (int): Total number of iterations of the run.
+            chain_store (str): Directory of the ChainStore, or None.
+            checkpoint_every (int): Number of iterations between checkpoints.
+            resume (Bool): If True, continue from the last checkpoint in 
+                chain_store if there is one.
+            check_every (int): Number of iterations between convergence 
+                checks, or None.
+            tau_factor (float): Required chain length in units of tau.
+            tau_tolerance (float): Required relative stability of tau.
+
+        Returns:
+            converged (Bool): False if convergence was checked and not 
+                reached.
+        """
+
+        store = None if chain_store is None else ChainStore(chain_store)
+        parameter_names = self.sampled_parameter_names()
+        lnprob0 = None
+        rstate0 = None
+
+        if resume and store is not None and store.has_checkpoint:
+            state = store.load_state()
+            if (state["parameter_names"] != parameter_names or 
+                np.shape(state["pos"]) != np.shape(walkers_matrix)):
+                raise Exception("The checkpoint in {0} was made with a different "
+                                "model or number of walkers.".format(chain_store))
+            chain, lnprob = store.load_chain()
+            self.sampler._chain = chain
+            self.sampler._lnprob = lnprob
+            self.sampler.iterations = state["iterations"]
+            self.sampler.naccepted = state["naccepted"]
+            walkers_matrix = state["pos"]
+            lnprob0 = state["lnprob"]
+            rstate0 = state["rstate"]
+            print("Resuming from iteration {0}".format(state["iterations"]))
+        elif store is not None:
+            store.clear()
+
+        converged = False
+        saved = self.sampler.iterations
+        n_remaining = max(n_iterations - saved, 0)
+        try:
+            for pos, lnprob, rstate in self.sampler.sample(walkers_matrix, 
+                                                           lnprob0=lnprob0,
+                                                           rstate0=rstate0,
+                                                           iterations=n_remaining):
+                done = self.sampler.iterations
+
+                if check_every is not None and done % check_every == 0:
+                    tau = integrated_time(self.sampler._chain[:, done//2:done])
+                    converged = (np.all(tau_factor * tau < done - done//2) and 
+                                 self.autocorr_time is not None and
+                                 np.all(np.abs(self.autocorr_time - tau) < tau_tolerance * tau))
+                    self.autocorr_time = tau
+
+                if store is not None and (done % checkpoint_every == 0 or 
+                                          done == n_iterations or converged):
+                    state = {"pos": pos.copy(),
+                             "lnprob": lnprob.copy(),
+                             "rstate": rstate,
+                             "naccepted": self.sampler.naccepted.copy(),
+                             "iterations": done,
+                             "parameter_names": parameter_names}
+                    store.append(chain=self.sampler._chain[:, saved:done],
+                                 lnprob=self.sampler._lnprob[:, saved:done],
+                                 state=state)
+                    saved = done
+
+                if converged:
+                    print("Converged after {0} iterations".format(done))
+                    break
+        except BaseException as error:
+            # Write the checkpoints already queued, which is the point of
+            # checkpointing when a run fails or is interrupted. A failure of
+            # the writer is raised with the error of the run as its cause.
+            if store is not None:
+                try:
+                    store.flush()
+                except Exception as writer_error:
+                    raise writer_error from error
+            raise
+
+        # Drop the space emcee reserved for iterations that were not run.
+        self.sampler._chain = self.sampler._chain[:, :self.sampler.iterations]
+        self.sampler._lnprob = self.sampler._lnprob[:, :self.sampler.iterations]
+
+        if store is not None:
+            store.flush()
+
+        return converged or check_every is None
 
 #-----------------------------------------------------------------------------#
 
@@ -325,6 +1099,7 @@ class Model(object):
 
 #-----------------------------------------------------------------------------#
 
+    @_profiled("Model.model_flux")
     def model_flux(self, params):
         """
         Given the parameters in the model, generate a spectrum. This method is
@@ -365,6 +1140,78 @@ class Model(object):
 
         return self.model_spectrum.flux
 
+#-----------------------------------------------------------------------------#
+
+    @_profiled("Model.model_flux_batch")
+    def model_flux_batch(self, params):
+        """
+        Given a batch of parameter vectors, generate one model spectrum per 
+        row. Unlike model_flux, this does not modify self.model_spectrum.
+
+        Args:
+            params (ndarray): 2D array of shape (n_walkers, n_parameters).
+
+        Returns:
+            fluxes (ndarray): Array of shape (n_walkers, n_pix).
+        """
+
+        params = np.atleast_2d(params)
+        fluxes = np.zeros((len(params), len(self.model_spectrum.spectral_axis)))
+
+        start = 0
+        for component in self.components:
+            p = params[:, start:start+component.parameter_count]
+            start += component.parameter_count
+
+            # Add the flux of each component to the model spectra, 
+            # except for extinction
+            if component.name != "Extinction":
+                fluxes += self._timed(component.name + ".flux_batch", component.flux_batch,
+                                      spectrum=self._slim_data_spectrum, parameters=p)
+            else:
+                fluxes *= self._timed(component.name + ".extinction_batch", 
+                                      component.extinction_batch,
+                                      spectrum=self._slim_data_spectrum, params=p)
+
+        return fluxes
+
+#-----------------------------------------------------------------------------#
+
+    def _timed(self, name, function, *args, **kwargs):
+        """
+        Call function, counting its calls and wall time in self.timing 
+        under name if profile is True.
+        """
+
+        if not getattr(self, "profile", False):
+            return function(*args, **kwargs)
+        t1 = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.timing.record(name, time.perf_counter() - t1)
+
+#-----------------------------------------------------------------------------#
+
+    def timing_report(self):
+        """
+        Return the timings recorded while profile was True, for each 
+        component call (e.g. "FeForest.flux", "Extinction.extinction", 
+        "Balmer.ln_priors") and for the Model methods that call 
+        them ("Model.model_flux", "Model.likelihood", "Model.prior", ...).
+        The calls made by ModelPool workers are included; those made by
+        the worker processes of find_map are not.
+
+        Returns:
+            report (dict): For each name, the number of calls and the 
+                total, mean, median (p50) and 99th percentile (p99) wall 
+                time in seconds, sorted by decreasing total time; see 
+                TimingCounters.report().
+        """
+
+        timing = getattr(self, "timing", None)
+        return {} if timing is None else timing.report()
+
 #-----------------------------------------------------------------------------#
 
     def add_component(self, component, parameters):
@@ -376,7 +1223,8 @@ class Model(object):
             parameters (): ?
         """
 
-        component_flux = component.flux(spectrum=self.data_spectrum, parameters=parameters)
+        component_flux = self._timed(component.name + ".flux", component.flux,
+                                     spectrum=self._slim_data_spectrum, parameters=parameters)
         self.model_spectrum.flux += component_flux
 
 #-----------------------------------------------------------------------------#
@@ -390,7 +1238,8 @@ class Model(object):
             parameters (): ?
         """
 
-        extinction = component.extinction(spectrum=self.data_spectrum, params=parameters)
+        extinction = self._timed(component.name + ".extinction", component.extinction,
+                                 spectrum=self._slim_data_spectrum, params=parameters)
         extinct_spectra= np.array(self.model_spectrum.flux)*extinction
         self.model_spectrum.flux = extinct_spectra
 
@@ -414,13 +1263,323 @@ class Model(object):
 
 #-----------------------------------------------------------------------------#
 
-# TODO model_spectrum_flux is not used vvv
+    def linear_parameter_indices(self):
+        """
+        Return the indices, in the full parameter vector, of the parameters
+        the model flux is proportional to (the linear_parameter_names of
+        each component), in the order of the components' linear bases.
+
+        Returns:
+            indices (ndarray): Array of indices.
+        """
+
+        indices = []
+        start = 0
+        for c in self.components:
+            indices += [start + c.parameter_index(name) 
+                        for name in getattr(c, "linear_parameter_names", [])]
+            start += c.parameter_count
+        return np.array(indices, dtype=int)
+
+#-----------------------------------------------------------------------------#
+
+    def sampled_parameter_mask(self):
+        """
+        Return which parameters of the full parameter vector are sampled:
+        all of them, or only the nonlinear ones if marginalize_linear is
+        True.
+
+        Returns:
+            mask (ndarray): Boolean array of length total_parameter_count.
+        """
+
+        mask = np.ones(self.total_parameter_count, dtype=bool)
+        if getattr(self, "marginalize_linear", False):
+            mask[self.linear_parameter_indices()] = False
+        return mask
+
+#-----------------------------------------------------------------------------#
+
+    def sampled_parameter_names(self):
+        """
+        Return the names of the sampled parameters, i.e. of the columns of
+        self.sampler.chain.
+
+        Returns:
+            labels (list): List of parameter names.
+        """
+
+        mask = self.sampled_parameter_mask()
+        return [name for name, sampled in zip(self.model_parameter_names(), mask) 
+                if sampled]
+
+#-----------------------------------------------------------------------------#
+
+    def linear_fit(self, params):
+        """
+        Fit the linear parameters for given values of the nonlinear ones.
+        The model flux is written as offset + a.dot(basis), where the 
+        basis and the offset depend only on the nonlinear parameters, and
+        the amplitudes a are found by a bounded weighted least-squares 
+        solve (see Likelihood.solve_linear), with the bounds of the priors
+        of the linear parameters.
+
+        Args:
+            params (ndarray): Full parameter vector; the values of the 
+                linear parameters are ignored.
+
+        Returns:
+            amplitudes (ndarray): Best-fit values of the linear parameters,
+                in the order of linear_parameter_indices().
+            ln_l (float): ln(likelihood) of the best-fit model.
+            fisher (ndarray): Fisher matrix of the linear parameters.
+            lower (ndarray): Lower bounds of the linear parameters.
+            upper (ndarray): Upper bounds of the linear parameters.
+        """
+
+        spectrum = self._slim_data_spectrum
+        basis = []
+        lower = []
+        upper = []
+        offset = np.zeros(len(self.model_spectrum.spectral_axis))
+
+        start = 0
+        for component in self.components:
+            p = params[start:start+component.parameter_count]
+            start += component.parameter_count
+
+            # Extinction scales everything added before it, as in 
+            # model_flux.
+            if component.name == "Extinction":
+                extinction = self._timed(component.name + ".extinction", 
+                                         component.extinction, spectrum=spectrum, params=p)
+                offset = offset * extinction
+                basis = [b * extinction for b in basis]
+            elif component.linear_parameter_names:
+                basis.append(self._timed(component.name + ".linear_basis", 
+                                         component.linear_basis, spectrum=spectrum, 
+                                         parameters=p))
+                component_lower, component_upper = component.linear_bounds()
+                lower += component_lower
+                upper += component_upper
+            else:
+                offset = offset + self._timed(component.name + ".flux", component.flux,
+                                              spectrum=spectrum, parameters=p)
+
+        basis = np.concatenate(basis) if basis else np.zeros((0, len(offset)))
+        amplitudes, ln_l, fisher = self._timed("Likelihood.solve_linear", 
+                                               self._likelihood.solve_linear,
+                                               basis, offset, lower, upper)
+
+        return amplitudes, ln_l, fisher, np.array(lower, dtype=float), np.array(upper, dtype=float)
+
+#-----------------------------------------------------------------------------#
+
+    def linear_fit_batch(self, params):
+        """
+        linear_fit() for a batch of full parameter vectors. The bases of
+        each component are computed for all of them at once (see 
+        Component.linear_basis_batch), and the normal equations are solved
+        together (see Likelihood.solve_linear_batch).
+
+        Args:
+            params (ndarray): Array of shape (n_samples, 
+                total_parameter_count); the values of the linear parameters
+                are ignored.
+
+        Returns:
+            amplitudes (ndarray): Best-fit values of the linear parameters,
+                of shape (n_samples, n_linear).
+            ln_l (ndarray): ln(likelihood) of the best-fit models.
+            fisher (ndarray): Fisher matrices of the linear parameters, of
+                shape (n_samples, n_linear, n_linear).
+            projection (ndarray): See Likelihood.solve_linear_batch.
+            lower (ndarray): Lower bounds of the linear parameters.
+            upper (ndarray): Upper bounds of the linear parameters.
+        """
+
+        params = np.atleast_2d(params)
+        spectrum = self._slim_data_spectrum
+        basis = []
+        lower = []
+        upper = []
+        offset = np.zeros((len(params), len(self.model_spectrum.spectral_axis)))
+
+        start = 0
+        for component in self.components:
+            p = params[:, start:start+component.parameter_count]
+            start += component.parameter_count
+
+            # Extinction scales everything added before it, as in 
+            # model_flux.
+            if component.name == "Extinction":
+                extinction = self._timed(component.name + ".extinction_batch", 
+                                         component.extinction_batch, spectrum=spectrum, params=p)
+                offset = offset * extinction
+                basis = [b * extinction[:, np.newaxis] for b in basis]
+            elif component.linear_parameter_names:
+                basis.append(self._timed(component.name + ".linear_basis_batch", 
+                                         component.linear_basis_batch, spectrum=spectrum, 
+                                         parameters=p))
+                component_lower, component_upper = component.linear_bounds()
+                lower += component_lower
+                upper += component_upper
+            else:
+                offset = offset + self._timed(component.name + ".flux_batch", component.flux_batch,
+                                              spectrum=spectrum, parameters=p)
+
+        basis = np.concatenate(basis, axis=1) if basis else np.zeros((len(params), 0, offset.shape[1]))
+        amplitudes, ln_l, fisher, projection = self._timed("Likelihood.solve_linear_batch", 
+                                                           self._likelihood.solve_linear_batch,
+                                                           basis, offset, lower, upper)
+
+        return (amplitudes, ln_l, fisher, projection, 
+                np.array(lower, dtype=float), np.array(upper, dtype=float))
+
+#-----------------------------------------------------------------------------#
+
+    def expand_parameters(self, params, draw=False, random_state=None):
+        """
+        Return the full parameter vector for a vector of sampled 
+        parameters, see expand_parameters_batch().
+
+        Args:
+            params (ndarray): Sampled parameters.
+            draw (Bool): Draw the linear parameters instead of using their
+                best-fit values.
+            random_state (RandomState object): Generator of the draws. 
+                Default: the global numpy generator.
+
+        Returns:
+            full_params (ndarray): Array of length total_parameter_count.
+        """
+
+        return self.expand_parameters_batch(np.atleast_2d(params), draw=draw,
+                                            random_state=random_state)[0]
+
+    def expand_parameters_batch(self, params, draw=False, random_state=None):
+        """
+        Return the full parameter vectors for a batch of vectors of sampled
+        parameters. If marginalize_linear is False they are the same.
+        Otherwise the linear parameters are set to their best-fit values 
+        or, if draw is True, drawn from their conditional posterior given
+        the nonlinear parameters. With flat priors this is the Gaussian 
+        likelihood of the linear parameters truncated to their prior 
+        bounds, see _draw_truncated_gaussian(). The linear parameters are
+        solved for LINEAR_BATCH_SIZE samples at a time (see 
+        linear_fit_batch).
+
+        Args:
+            params (ndarray): Array of shape (n_samples, n_sampled).
+            draw (Bool): Draw the linear parameters instead of using their
+                best-fit values.
+            random_state (RandomState object): Generator of the draws. 
+                Default: the global numpy generator.
+
+        Returns:
+            full_params (ndarray): Array of shape (n_samples, 
+                total_parameter_count).
+        """
+
+        params = np.atleast_2d(params)
+        mask = self.sampled_parameter_mask()
+        if np.all(mask):
+            return np.array(params, dtype=float)
+        if random_state is None:
+            random_state = np.random
+
+        full_params = np.full((len(params), len(mask)), np.nan)
+        full_params[:, mask] = params
+        indices = self.linear_parameter_indices()
+        for start in range(0, len(params), LINEAR_BATCH_SIZE):
+            rows = slice(start, start + LINEAR_BATCH_SIZE)
+            amplitudes, ln_l, fisher, projection, lower, upper = \
+                self.linear_fit_batch(full_params[rows])
+            if draw:
+                amplitudes = _draw_truncated_gaussian(amplitudes, fisher, projection,
+                                                      lower, upper, random_state)
+            full_params[rows, indices] = amplitudes
+
+        return full_params
+
+#-----------------------------------------------------------------------------#
+
+    @_profiled("Model.marginal_likelihood")
+    def marginal_likelihood(self, params):
+        r"""
+        Calculate the ln(likelihood) marginalized over the linear 
+        parameters, for the nonlinear parameters params. With the flat 
+        priors of the linear parameters and the Laplace approximation of
+        the integral around the best fit (see linear_fit),
+            ln(L) = ln(L_best) - 0.5 ln(det(F)) + 0.5 k ln(2 \pi)
+        where F is the Fisher matrix of the k linear parameters that are
+        constrained by the data. Terms that do not depend on the 
+        parameters are dropped; the truncation of the Gaussian at the prior
+        bounds is ignored.
+
+        Args:
+            params (ndarray): Sampled (nonlinear) parameters.
+
+        Returns:
+            ln_l (float): Marginal ln(likelihood).
+        """
+
+        full_params = np.full(self.total_parameter_count, np.nan)
+        full_params[self.sampled_parameter_mask()] = params
+        amplitudes, ln_l, fisher, lower, upper = self.linear_fit(full_params)
+        if not np.isfinite(ln_l):
+            return -np.inf
+
+        scale, factor = _fisher_factor(fisher)
+        if factor is None:
+            return -np.inf
+        active = scale > 0
+        ln_det = 2 * np.sum(np.log(scale[active])) + 2 * np.sum(np.log(np.diag(factor)))
+
+        return ln_l - 0.5 * ln_det + 0.5 * np.count_nonzero(active) * np.log(2 * np.pi)
+
+#-----------------------------------------------------------------------------#
+
+    @property
+    def chain(self):
+        """
+        The chain of the sampler in the full parameter space, of shape 
+        (n_walkers, n_iterations, total_parameter_count). If the linear
+        parameters were marginalized over, they are drawn from their 
+        conditional posterior for each sample (see 
+        expand_parameters_batch); this is done once and kept. The draws of
+        iteration i are seeded with LINEAR_DRAW_SEED and i, so they do not
+        change between sessions, nor when the chain is continued.
+
+        Returns:
+            chain (ndarray): The chain.
+        """
+
+        # Models saved before sampler backends were added have no result.
+        result = getattr(self, "result", None)
+        sampled_chain = self.sampler.chain if result is None else result.chain
+        if not getattr(self, "marginalize_linear", False):
+            return sampled_chain
+
+        full_chain = getattr(self, "_full_chain", None)
+        if full_chain is None or full_chain.shape[:2] != sampled_chain.shape[:2]:
+            n_walkers, n_iterations = sampled_chain.shape[:2]
+            full_chain = np.empty((n_walkers, n_iterations, self.total_parameter_count))
+            for i in range(n_iterations):
+                random_state = np.random.RandomState([LINEAR_DRAW_SEED, i])
+                full_chain[:, i] = self.expand_parameters_batch(sampled_chain[:, i], draw=True,
+                                                                random_state=random_state)
+            self._full_chain = full_chain
+        return full_chain
+
+#-----------------------------------------------------------------------------#
+
+    @_profiled("Model.likelihood")
     def likelihood(self, model_spectrum_flux):
         """
         Calculate the ln(likelihood) of the given model spectrum.
-        The model is interpolated over the data wavelength grid.
-        ln(L) = -0.5 \sum_n {\left[ \frac{(flux_{Obs}-flux_{model})^2}{\sigma^2} 
-            + ln(2 \pi \sigma^2) \right]}
+        The model is interpolated over the data wavelength grid if the
+        grids differ. See Likelihood for the definition.
     
         Args:
             model_spectrum_flux (): The model spectrum, a numpy array of flux value.
@@ -429,23 +1588,28 @@ class Model(object):
             ln_l (float): Sum of ln(likelihood) values?
         """
 
-        # Create an interpolation function.
-        f = interp1d(self.model_spectrum.spectral_axis,
-                                 self.model_spectrum.flux)
+        return self._likelihood(model_spectrum_flux)
 
-        # It is much more efficient to not use a for loop here.
-        # interp_model_flux = [f(x) for x in self.data_spectrum.wavelength]
-        interp_model_flux = f(self.data_spectrum.spectral_axis)
+#-----------------------------------------------------------------------------#
 
-        ln_l = np.power(( (self.data_spectrum.flux - interp_model_flux) / self.data_spectrum.flux_error), 2) + np.log(2 * np.pi * np.power(self.data_spectrum.flux_error, 2))
-        #ln_l *= self.mask
-        ln_l = -0.5 * np.sum(ln_l)
-        ln_l = np.nan_to_num(ln_l)
-        
-        return ln_l
+    @_profiled("Model.likelihood_batch")
+    def likelihood_batch(self, model_spectrum_fluxes):
+        """
+        Calculate the ln(likelihood) of each of a batch of model spectra.
+        See likelihood() for the definition.
+
+        Args:
+            model_spectrum_fluxes (ndarray): Array of shape (n_walkers, n_pix).
+
+        Returns:
+            ln_l (ndarray): Array of shape (n_walkers,).
+        """
+
+        return self._likelihood(model_spectrum_fluxes)
 
 #-----------------------------------------------------------------------------#
 
+    @_profiled("Model.prior")
     def prior(self, params):
         """
         Calculate the ln(priors) for all components in the model.
@@ -457,14 +1621,75 @@ class Model(object):
             ln_p (float): Sum of ln(prior) values?
         """
 
+        if getattr(self, "marginalize_linear", False):
+            return self._nonlinear_prior(params)
+
         # Make a copy since we'll delete elements.
         p = np.copy(params)
 
         ln_p = 0
         for component in self.components:
-            ln_p += sum(component.ln_priors(params=p[0:component.parameter_count]))
+            ln_p += sum(self._timed(component.name + ".ln_priors", component.ln_priors,
+                                    params=p[0:component.parameter_count]))
 
             # Remove the parameters for this component from the list.
             p = p[component.parameter_count:]
 
         return ln_p
+
+#-----------------------------------------------------------------------------#
+
+    def prior_batch(self, params):
+        """
+        Calculate the ln(priors) for each of a batch of parameter vectors,
+        a component at a time (see Component.ln_priors_batch()). As in 
+        prior(), only the priors of the sampled parameters are included.
+
+        Args:
+            params (ndarray): 2D array of shape (n_walkers, n_parameters).
+
+        Returns:
+            ln_p (ndarray): Array of shape (n_walkers,).
+        """
+
+        params = np.atleast_2d(params)
+        mask = self.sampled_parameter_mask()
+        p = np.full((len(params), len(mask)), np.nan)
+        p[:, mask] = params
+
+        ln_p = np.zeros(len(params))
+        start = 0
+        for component in self.components:
+            stop = start + component.parameter_count
+            ln_priors = self._timed(component.name + ".ln_priors_batch",
+                                    component.ln_priors_batch, params=p[:, start:stop])
+            ln_p += np.sum(ln_priors[:, mask[start:stop]], axis=1)
+            start = stop
+
+        return ln_p
+
+#-----------------------------------------------------------------------------#
+
+    def _nonlinear_prior(self, params):
+        """
+        ln(prior) of the sampled parameters when the linear parameters are
+        marginalized over. The priors of the linear parameters are the 
+        bounds of the least-squares solve instead.
+        """
+
+        mask = self.sampled_parameter_mask()
+        p = np.full(len(mask), np.nan)
+        p[mask] = params
+
+        ln_p = 0
+        start = 0
+        for component in self.components:
+            ln_priors = np.asarray(self._timed(component.name + ".ln_priors", 
+                                               component.ln_priors,
+                                               params=p[start:start+component.parameter_count]),
+                                   dtype=float)
+            ln_p += np.sum(ln_priors[mask[start:start+component.parameter_count]])
+            start += component.parameter_count
+
+        return ln_p
+
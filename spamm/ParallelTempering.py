@@ -0,0 +1,331 @@
+#!/usr/bin/python
+
+import numpy as np
+
+#-----------------------------------------------------------------------------#
+
+def default_ladder(n_temps, n_dim, t_max=None):
+    """
+    Inverse temperatures of a geometric ladder from T=1 to T=t_max.
+
+    Args:
+        n_temps (int): Number of temperatures.
+        n_dim (int): Number of sampled parameters.
+        t_max (float): Highest temperature. If None, neighbouring
+            temperatures differ by a factor exp(2.38/sqrt(n_dim)), the
+            spacing that keeps the swap acceptance roughly constant for a
+            Gaussian posterior; np.inf makes the hottest chain sample the
+            prior.
+
+    Returns:
+        betas (ndarray): Inverse temperatures, decreasing from 1.
+    """
+
+    if n_temps == 1:
+        return np.ones(1)
+    if t_max is None:
+        t_max = np.exp(2.38 / np.sqrt(n_dim) * (n_temps - 1))
+    if np.isinf(t_max):
+        return np.append(default_ladder(n_temps - 1, n_dim), 0.)
+
+    return np.geomspace(1., 1. / t_max, n_temps)
+
+#-----------------------------------------------------------------------------#
+
+class ParallelTemperingSampler(object):
+    """
+    Parallel-tempering affine-invariant ensemble sampler.
+
+    One ensemble of walkers is kept at each inverse temperature beta and
+    samples prior * likelihood**beta with the stretch move of emcee. The
+    proposals of half the walkers of every temperature are evaluated
+    together, so a whole step of the ladder is a single call to
+    ln_posterior_map (e.g. one map over a ModelPool). After each step,
+    walkers of neighbouring temperatures swap positions, which lets the
+    cold (beta=1) chain jump between modes found by the hot chains.
+
+    If adapt is True the temperatures are adjusted during the first
+    burn_fraction of the run so that the swap acceptance is the same
+    between all neighbouring temperatures (Vousden, Farr & Mandel 2016);
+    the first and the last temperature are kept fixed. The ladder is fixed
+    afterwards, and only those iterations are used to estimate the
+    evidence by thermodynamic integration.
+
+    Attributes:
+        betas (ndarray): Inverse temperatures, decreasing from 1.
+        chain (ndarray): Positions, of shape (n_temps, n_walkers,
+            n_iterations, n_dim).
+        ln_likelihood (ndarray): ln(likelihood) of each position, of shape
+            (n_temps, n_walkers, n_iterations).
+        ln_prior (ndarray): ln(prior) of each position.
+        betas_history (ndarray): Inverse temperatures at each iteration, of
+            shape (n_iterations, n_temps).
+        naccepted (ndarray): Accepted stretch moves, of shape (n_temps,
+            n_walkers).
+        nswap_accepted (ndarray): Accepted swaps between temperatures i and
+            i+1, of shape (n_temps - 1,).
+        iterations (int): Number of iterations run.
+        adapted_iterations (int): Number of iterations with an adaptive
+            ladder.
+    """
+
+    def __init__(self, betas, n_walkers, n_dim, adapt=True, burn_fraction=0.5,
+                 adaptation_lag=1000, adaptation_time=100, a=2.):
+        """
+        Args:
+            betas (array): Inverse temperatures, decreasing from 1.
+            n_walkers (int): Number of walkers at each temperature; must be
+                even.
+            n_dim (int): Number of parameters.
+            adapt (Bool): If True, adapt the ladder during the burn-in.
+            burn_fraction (float): Fraction of the run used to adapt the
+                ladder and left out of the evidence.
+            adaptation_lag (float): Number of iterations over which the
+                adaptation decays.
+            adaptation_time (float): Time scale, in iterations, of the
+                adaptation.
+            a (float): Scale of the stretch move.
+        """
+
+        self.betas = np.array(betas, dtype=float)
+        assert self.betas[0] == 1. and np.all(np.diff(self.betas) < 0), \
+            "betas must decrease from 1"
+        assert n_walkers % 2 == 0 and n_walkers >= 2 * n_dim, \
+            "The number of walkers must be even and at least twice the number of parameters"
+
+        self.n_walkers = n_walkers
+        self.n_dim = n_dim
+        self.adapt = adapt
+        self.burn_fraction = burn_fraction
+        self.adaptation_lag = adaptation_lag
+        self.adaptation_time = adaptation_time
+        self.a = a
+
+        n_temps = len(self.betas)
+        self.chain = np.empty((n_temps, n_walkers, 0, n_dim))
+        self.ln_likelihood = np.empty((n_temps, n_walkers, 0))
+        self.ln_prior = np.empty((n_temps, n_walkers, 0))
+        self.betas_history = np.empty((0, n_temps))
+        self.naccepted = np.zeros((n_temps, n_walkers))
+        self.nswap_accepted = np.zeros(n_temps - 1)
+        self.iterations = 0
+        self.adapted_iterations = 0
+
+#-----------------------------------------------------------------------------#
+
+    @property
+    def acceptance_fraction(self):
+        """
+        Returns:
+            ndarray (ndarray): Acceptance fraction of the stretch moves of
+                each walker, of shape (n_temps, n_walkers).
+        """
+
+        return self.naccepted / max(self.iterations, 1)
+
+    @property
+    def swap_acceptance_fraction(self):
+        """
+        Returns:
+            ndarray (ndarray): Fraction of the proposed swaps between
+                temperatures i and i+1 that were accepted.
+        """
+
+        return self.nswap_accepted / max(self.iterations * self.n_walkers, 1)
+
+#-----------------------------------------------------------------------------#
+
+    def run(self, p0, n_iterations, ln_prior, ln_posterior_map):
+        """
+        Run the sampler.
+
+        Args:
+            p0 (array): Initial positions, of shape (n_temps, n_walkers,
+                n_dim). They must have a finite posterior.
+            n_iterations (int): Number of iterations.
+            ln_prior (function): Maps an array of positions, of shape
+                (n, n_dim), to their ln(prior).
+            ln_posterior_map (function): Maps a list of positions to their
+                ln(posterior), e.g. Pool.map with ln_posterior.
+
+        Returns:
+            positions (ndarray): The final positions.
+        """
+
+        n_temps = len(self.betas)
+        positions = np.array(p0, dtype=float).reshape(n_temps, self.n_walkers, self.n_dim)
+        ln_l, ln_p = self._evaluate(positions.reshape(-1, self.n_dim),
+                                    ln_prior, ln_posterior_map)
+        ln_l = ln_l.reshape(n_temps, self.n_walkers)
+        ln_p = ln_p.reshape(n_temps, self.n_walkers)
+        if not np.all(np.isfinite(ln_l + ln_p)):
+            raise Exception("All initial positions must have a finite posterior.")
+
+        adapt_iterations = int(self.burn_fraction * n_iterations) if self.adapt else 0
+        chain = np.empty((n_temps, self.n_walkers, n_iterations, self.n_dim))
+        chain_ln_l = np.empty((n_temps, self.n_walkers, n_iterations))
+        chain_ln_p = np.empty((n_temps, self.n_walkers, n_iterations))
+        betas_history = np.empty((n_iterations, n_temps))
+        half = self.n_walkers // 2
+        walkers = np.arange(self.n_walkers)
+
+        for i in range(n_iterations):
+            for active, inactive in ((walkers[:half], walkers[half:]),
+                                     (walkers[half:], walkers[:half])):
+                # Stretch move, within each temperature.
+                z = ((self.a - 1.) * np.random.random((n_temps, half)) + 1.)**2 / self.a
+                partners = inactive[np.random.randint(half, size=(n_temps, half))]
+                others = np.take_along_axis(positions, partners[:, :, np.newaxis], axis=1)
+                proposal = others + z[:, :, np.newaxis] * (positions[:, active] - others)
+
+                new_ln_l, new_ln_p = self._evaluate(proposal.reshape(-1, self.n_dim),
+                                                    ln_prior, ln_posterior_map)
+                new_ln_l = new_ln_l.reshape(n_temps, half)
+                new_ln_p = new_ln_p.reshape(n_temps, half)
+                ln_ratio = ((self.n_dim - 1.) * np.log(z) +
+                            self._tempered(new_ln_l, new_ln_p) -
+                            self._tempered(ln_l[:, active], ln_p[:, active]))
+                accept = np.log(np.random.random((n_temps, half))) < ln_ratio
+
+                temps, index = np.nonzero(accept)
+                positions[temps, active[index]] = proposal[temps, index]
+                ln_l[temps, active[index]] = new_ln_l[temps, index]
+                ln_p[temps, active[index]] = new_ln_p[temps, index]
+                self.naccepted[temps, active[index]] += 1
+
+            swap_fraction = self._swap(positions, ln_l, ln_p)
+            self.nswap_accepted += swap_fraction * self.n_walkers
+            if self.iterations < adapt_iterations:
+                self._adapt_ladder(swap_fraction)
+                self.adapted_iterations = self.iterations + 1
+
+            chain[:, :, i] = positions
+            chain_ln_l[:, :, i] = ln_l
+            chain_ln_p[:, :, i] = ln_p
+            betas_history[i] = self.betas
+            self.iterations += 1
+
+        self.chain = np.concatenate((self.chain, chain), axis=2)
+        self.ln_likelihood = np.concatenate((self.ln_likelihood, chain_ln_l), axis=2)
+        self.ln_prior = np.concatenate((self.ln_prior, chain_ln_p), axis=2)
+        self.betas_history = np.concatenate((self.betas_history, betas_history))
+
+        return positions
+
+#-----------------------------------------------------------------------------#
+
+    def _evaluate(self, positions, ln_prior, ln_posterior_map):
+        """
+        ln(likelihood) and ln(prior) of positions. Only positions inside
+        the priors are passed to ln_posterior_map.
+        """
+
+        ln_p = np.asarray(ln_prior(positions), dtype=float)
+        ln_l = np.full(len(positions), -np.inf)
+        inside = np.flatnonzero(np.isfinite(ln_p))
+        if len(inside) > 0:
+            ln_post = np.array(list(ln_posterior_map([positions[j] for j in inside])),
+                               dtype=float)
+            ln_l[inside] = ln_post - ln_p[inside]
+
+        return ln_l, ln_p
+
+    def _tempered(self, ln_l, ln_p):
+        """
+        ln(prior * likelihood**beta), -inf wherever either is -inf.
+        """
+
+        finite = np.isfinite(ln_l) & np.isfinite(ln_p)
+        betas = self.betas[:, np.newaxis]
+        return np.where(finite, betas * np.where(finite, ln_l, 0.) + ln_p, -np.inf)
+
+#-----------------------------------------------------------------------------#
+
+    def _swap(self, positions, ln_l, ln_p):
+        """
+        Propose to swap each walker with a random walker of the next
+        temperature, from the hottest pair down, and accept with the
+        Metropolis probability. Modifies the arrays in place.
+
+        Returns:
+            fraction (ndarray): Fraction of the swaps between temperatures
+                i and i+1 that were accepted.
+        """
+
+        n_temps = len(self.betas)
+        fraction = np.zeros(n_temps - 1)
+        for i in range(n_temps - 1, 0, -1):
+            cold = np.random.permutation(self.n_walkers)
+            hot = np.random.permutation(self.n_walkers)
+            ln_ratio = (self.betas[i-1] - self.betas[i]) * (ln_l[i, hot] - ln_l[i-1, cold])
+            accept = np.log(np.random.random(self.n_walkers)) < ln_ratio
+            fraction[i-1] = np.mean(accept)
+
+            cold = cold[accept]
+            hot = hot[accept]
+            for values in (positions, ln_l, ln_p):
+                values[i-1, cold], values[i, hot] = values[i, hot].copy(), values[i-1, cold].copy()
+
+        return fraction
+
+    def _adapt_ladder(self, swap_fraction):
+        """
+        Move the inner temperatures towards equal swap acceptance between
+        all neighbouring temperatures. The log of the spacing between two
+        temperatures grows with the difference between the acceptance of
+        the swaps at its two ends; the steps decay over adaptation_lag
+        iterations.
+        """
+
+        if len(self.betas) < 3:
+            return
+
+        decay = self.adaptation_lag / (self.iterations + self.adaptation_lag)
+        kappa = decay / self.adaptation_time
+        d_log_spacing = kappa * (swap_fraction[:-1] - swap_fraction[1:])
+        spacing = np.diff(1. / self.betas[:-1]) * np.exp(d_log_spacing)
+        self.betas[1:-1] = 1. / (1. / self.betas[0] + np.cumsum(spacing))
+
+#-----------------------------------------------------------------------------#
+
+    def log_evidence(self):
+        """
+        Estimate ln(evidence) by thermodynamic integration,
+            ln Z = integral from 0 to 1 of <ln L>_beta d(beta),
+        using the iterations after the ladder stopped adapting (or after
+        burn_fraction of the run). Geometric ladders are integrated with 
+        the trapezoidal rule in ln(beta), i.e. for beta * <ln L>, which 
+        follows <ln L> ~ -n_dim / (2 beta) of a Gaussian posterior much
+        better than trapezoids in beta. The integral needs <ln L> at 
+        beta=0, i.e. over the prior, so the hottest beta must be 0 (see 
+        default_ladder with t_max=np.inf); otherwise the part of the 
+        integral beyond the ladder is unknown and no estimate is returned. The error is the difference from the same
+        estimate with every other temperature.
+
+        Returns:
+            log_evidence (float): ln(evidence), or None if the hottest
+                beta is not 0.
+            log_evidence_error (float): Estimate of its error, or None.
+        """
+
+        if self.betas[-1] != 0:
+            return None, None
+
+        start = max(self.adapted_iterations, int(self.burn_fraction * self.iterations))
+        start = min(start, self.iterations - 1)
+        mean_ln_l = np.mean(self.ln_likelihood[:, :, start:], axis=(1, 2))
+
+        def integrate(betas, mean_ln_l):
+            # Trapezoids in ln(beta) for beta * <ln L>, down to the coldest
+            # of the hot betas, and in beta from there to 0.
+            f = betas[:-1] * mean_ln_l[:-1]
+            body = np.sum(0.5 * (f[1:] + f[:-1]) * -np.diff(np.log(betas[:-1])))
+            return body + 0.5 * (mean_ln_l[-2] + mean_ln_l[-1]) * betas[-2]
+
+        log_evidence = integrate(self.betas, mean_ln_l)
+        coarse = np.arange(0, len(self.betas), 2)
+        if coarse[-1] != len(self.betas) - 1:
+            coarse = np.append(coarse, len(self.betas) - 1)
+        log_evidence_coarse = integrate(self.betas[coarse], mean_ln_l[coarse])
+
+        return log_evidence, np.abs(log_evidence - log_evidence_coarse)
@@ -0,0 +1,363 @@
+#!/usr/bin/python
+
+import time
+import numpy as np
+
+import emcee
+
+from .ParallelTempering import ParallelTemperingSampler, default_ladder
+
+# Major version of the installed emcee; its API changed in version 3.
+EMCEE_MAJOR_VERSION = int(emcee.__version__.split(".")[0])
+
+#-----------------------------------------------------------------------------#
+
+class SamplerResult(object):
+    """
+    The output of a sampler backend, in the same form for every backend.
+
+    Attributes:
+        chain (ndarray): Samples, of shape (n_walkers, n_steps, n_dim), in
+            the sampled parameter space. Backends without walkers (nested
+            sampling) return a single "walker" of equally weighted samples.
+        ln_prob (ndarray): ln(posterior) of each sample, of shape
+            (n_walkers, n_steps).
+        acceptance_fraction (ndarray): Acceptance fraction of each walker.
+        seconds (float): Wall-clock time spent sampling.
+        backend (str): Name of the backend that produced the result.
+        log_evidence (float): ln(evidence), if the backend estimates it.
+        log_evidence_error (float): Uncertainty of log_evidence.
+    """
+
+    def __init__(self, chain, ln_prob, acceptance_fraction, seconds, backend,
+                 log_evidence=None, log_evidence_error=None):
+        self.chain = chain
+        self.ln_prob = ln_prob
+        self.acceptance_fraction = acceptance_fraction
+        self.seconds = seconds
+        self.backend = backend
+        self.log_evidence = log_evidence
+        self.log_evidence_error = log_evidence_error
+
+#-----------------------------------------------------------------------------#
+
+class SamplerBackend(object):
+    """
+    Base class of the samplers Model.run_mcmc can use. A backend draws
+    samples of the posterior of a Model and returns them as a
+    SamplerResult; the underlying sampler object is kept as
+    SamplerBackend.sampler.
+
+    Attributes:
+        name (str): Name of the backend, see get_backend().
+        uses_pool (Bool): True if the backend evaluates the posterior
+            through the pools of Model.run_mcmc (ModelPool, VectorizedPool
+            or MPIPool), which map ln_posterior over walker positions.
+        sampler (): The underlying sampler, set by run().
+    """
+
+    name = None
+    uses_pool = False
+
+    def __init__(self):
+        self.sampler = None
+
+    def run(self, model, walkers_matrix, n_iterations, pool=None):
+        """
+        Sample the posterior of model.
+
+        Args:
+            model (Model object): The model. Its sampled parameter space is
+                given by Model.sampled_parameter_mask().
+            walkers_matrix (list): Initial walker positions.
+            n_iterations (int): Number of iterations.
+            pool (): Pool to evaluate ln_posterior with, if uses_pool.
+
+        Returns:
+            result (SamplerResult object): The samples.
+        """
+
+        raise NotImplementedError
+
+#-----------------------------------------------------------------------------#
+
+class EmceeBackend(SamplerBackend):
+    """
+    Affine-invariant ensemble sampler of emcee, version 2 or 3.
+
+    With emcee 2 this is the EnsembleSampler SPAMM has always used, and it
+    also supports checkpoints and convergence checks (Model._run_steps).
+    With emcee 3 custom moves can be given, e.g.
+    [(emcee.moves.DEMove(), 0.8), (emcee.moves.DESnookerMove(), 0.2)].
+    """
+
+    name = "emcee"
+    uses_pool = True
+
+    def __init__(self, moves=None):
+        """
+        Args:
+            moves (): emcee 3 moves, passed to EnsembleSampler.
+        """
+
+        super(EmceeBackend, self).__init__()
+        if moves is not None and EMCEE_MAJOR_VERSION < 3:
+            raise Exception("Custom moves need emcee 3, but emcee {0} is "
+                            "installed.".format(emcee.__version__))
+        self.moves = moves
+
+    def make_sampler(self, model, n_walkers, n_dim, pool=None):
+        """
+        Create self.sampler without running it. Its random numbers are 
+        drawn from a generator seeded by numpy's global one.
+        """
+
+        from .Model import ln_posterior
+
+        if EMCEE_MAJOR_VERSION >= 3:
+            self.sampler = emcee.EnsembleSampler(n_walkers, n_dim, ln_posterior,
+                                                 args=[model], pool=pool,
+                                                 moves=self.moves)
+        else:
+            self.sampler = emcee.EnsembleSampler(nwalkers=n_walkers, dim=n_dim,
+                                                 lnpostfn=ln_posterior,
+                                                 args=[model], pool=pool)
+
+        # emcee seeds its generator from the operating system; seed it from
+        # numpy's global generator instead, so that np.random.seed() makes
+        # runs reproducible (and a resumed run continue the same chain).
+        seed = np.random.randint(2**32, dtype=np.uint64)
+        self.sampler.random_state = np.random.RandomState(seed).get_state()
+
+        return self.sampler
+
+    def run(self, model, walkers_matrix, n_iterations, pool=None):
+        t1 = time.time()
+        self.make_sampler(model, len(walkers_matrix), len(walkers_matrix[0]), pool)
+        self.sampler.run_mcmc(walkers_matrix, n_iterations)
+
+        return self.result(time.time() - t1)
+
+    def result(self, seconds):
+        """
+        Collect the SamplerResult of self.sampler.
+        """
+
+        if EMCEE_MAJOR_VERSION >= 3:
+            chain = np.swapaxes(self.sampler.get_chain(), 0, 1)
+            ln_prob = self.sampler.get_log_prob().T
+        else:
+            chain = self.sampler.chain
+            ln_prob = self.sampler.lnprobability
+
+        return SamplerResult(chain=chain, ln_prob=ln_prob,
+                             acceptance_fraction=self.sampler.acceptance_fraction,
+                             seconds=seconds, backend=self.name)
+
+#-----------------------------------------------------------------------------#
+
+class PTBackend(SamplerBackend):
+    """
+    Parallel-tempering ensemble sampler, see ParallelTemperingSampler.
+    n_temps ensembles of walkers sample the posterior with the likelihood
+    raised to the powers betas and swap positions between neighbouring
+    temperatures, so that the cold chain can move between the modes of
+    multimodal posteriors. Every step evaluates the proposals of all the
+    temperatures with one map over the pool of run_mcmc. The chain is the
+    one at beta=1, and the evidence is estimated by thermodynamic
+    integration over the temperatures.
+    """
+
+    name = "pt"
+    uses_pool = True
+
+    def __init__(self, n_temps=8, betas=None, t_max=np.inf, adapt=True,
+                 burn_fraction=0.5, adaptation_lag=1000, adaptation_time=100):
+        """
+        Args:
+            n_temps (int): Number of temperatures.
+            betas (array): Inverse temperatures, decreasing from 1. If None,
+                a geometric ladder up to t_max is used, see default_ladder().
+            t_max (float): Highest temperature of the default ladder. The
+                default, np.inf, makes the hottest chain sample the prior,
+                which is needed to estimate the evidence; with a finite 
+                t_max, or betas that do not end at 0, log_evidence is None.
+            adapt (Bool): If True, adjust the temperatures during the first
+                burn_fraction of the run to equalize the swap acceptance.
+            burn_fraction (float): Fraction of the run used to adapt the
+                ladder, and left out of the evidence.
+            adaptation_lag (float): Number of iterations over which the
+                adaptation decays.
+            adaptation_time (float): Time scale, in iterations, of the
+                adaptation.
+        """
+
+        super(PTBackend, self).__init__()
+        self.n_temps = n_temps if betas is None else len(betas)
+        self.betas = betas
+        self.t_max = t_max
+        self.adapt = adapt
+        self.burn_fraction = burn_fraction
+        self.adaptation_lag = adaptation_lag
+        self.adaptation_time = adaptation_time
+
+    def run(self, model, walkers_matrix, n_iterations, pool=None):
+        t1 = time.time()
+        walkers_matrix = np.asarray(walkers_matrix, dtype=float)
+        n_walkers, n_dim = walkers_matrix.shape
+        betas = self.betas
+        if betas is None:
+            betas = default_ladder(self.n_temps, n_dim, t_max=self.t_max)
+
+        self.sampler = ParallelTemperingSampler(betas, n_walkers, n_dim,
+                                                adapt=self.adapt,
+                                                burn_fraction=self.burn_fraction,
+                                                adaptation_lag=self.adaptation_lag,
+                                                adaptation_time=self.adaptation_time)
+        posterior = _PosteriorFunction(model)
+        if pool is None:
+            ln_posterior_map = lambda positions: [posterior(p) for p in positions]
+        else:
+            ln_posterior_map = lambda positions: pool.map(posterior, positions)
+        p0 = np.repeat(walkers_matrix[np.newaxis], self.n_temps, axis=0)
+        self.sampler.run(p0, n_iterations, model.prior_batch, ln_posterior_map)
+
+        log_evidence, log_evidence_error = self.sampler.log_evidence()
+        sampler = self.sampler
+        return SamplerResult(chain=sampler.chain[0],
+                             ln_prob=sampler.ln_likelihood[0] + sampler.ln_prior[0],
+                             acceptance_fraction=sampler.acceptance_fraction[0],
+                             seconds=time.time() - t1, backend=self.name,
+                             log_evidence=log_evidence,
+                             log_evidence_error=log_evidence_error)
+
+#-----------------------------------------------------------------------------#
+
+class NestedBackend(SamplerBackend):
+    """
+    Nested sampling with dynesty. The live points are drawn from the
+    priors, which must all be bounded, so the initial walker positions are
+    not used, and the run stops when the remaining evidence is below dlogz
+    rather than after n_iterations. The weighted samples are resampled to
+    equal weights and returned as a single walker.
+    """
+
+    name = "nested"
+
+    def __init__(self, n_live=500, dlogz=0.1, **sampler_kwargs):
+        """
+        Args:
+            n_live (int): Number of live points.
+            dlogz (float): Stopping criterion on the remaining ln(evidence).
+            sampler_kwargs: Passed to dynesty.NestedSampler, e.g. bound or
+                sample.
+        """
+
+        super(NestedBackend, self).__init__()
+        self.n_live = n_live
+        self.dlogz = dlogz
+        self.sampler_kwargs = sampler_kwargs
+
+    def run(self, model, walkers_matrix, n_iterations, pool=None):
+        try:
+            import dynesty
+        except ImportError:
+            raise Exception("The nested backend needs dynesty, which is not "
+                            "installed.")
+        from .Model import ln_likelihood
+
+        t1 = time.time()
+        lower, upper = model.parameter_bounds()
+        sampled = model.sampled_parameter_mask()
+        lower = lower[sampled]
+        upper = upper[sampled]
+        if not (np.all(np.isfinite(lower)) and np.all(np.isfinite(upper))):
+            raise Exception("Nested sampling needs bounded priors for all the "
+                            "sampled parameters.")
+
+        self.sampler = dynesty.NestedSampler(ln_likelihood, _unit_cube_to_box,
+                                             len(lower), logl_args=[model],
+                                             ptform_args=[lower, upper],
+                                             nlive=self.n_live, **self.sampler_kwargs)
+        self.sampler.run_nested(dlogz=self.dlogz, print_progress=False)
+        results = self.sampler.results
+
+        weights = np.exp(results.logwt - results.logz[-1])
+        index = _resample_equal(weights / np.sum(weights))
+        samples = results.samples[index]
+        ln_prob = results.logl[index] + np.array([model.prior(params=p) for p in samples])
+
+        return SamplerResult(chain=samples[np.newaxis], ln_prob=ln_prob[np.newaxis],
+                             acceptance_fraction=np.array([results.eff / 100.]),
+                             seconds=time.time() - t1, backend=self.name,
+                             log_evidence=results.logz[-1],
+                             log_evidence_error=results.logzerr[-1])
+
+#-----------------------------------------------------------------------------#
+
+class _PosteriorFunction(object):
+    """
+    ln_posterior of a model, as a picklable function of the position only,
+    for pools that send the function to other processes (MPIPool).
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, params):
+        from .Model import ln_posterior
+        return ln_posterior(params, self.model)
+
+#-----------------------------------------------------------------------------#
+
+def _unit_cube_to_box(u, lower, upper):
+    """
+    Prior transform of NestedBackend: uniform priors between lower and
+    upper.
+    """
+
+    return lower + u * (upper - lower)
+
+#-----------------------------------------------------------------------------#
+
+def _resample_equal(weights):
+    """
+    Systematic resampling: indices of len(weights) samples drawn with
+    probabilities weights (which sum to 1), in random order.
+    """
+
+    n = len(weights)
+    positions = (np.random.random() + np.arange(n)) / n
+    cumulative = np.cumsum(weights)
+    cumulative[-1] = 1.
+    index = np.searchsorted(cumulative, positions)
+
+    return np.random.permutation(index)
+
+#-----------------------------------------------------------------------------#
+
+# Backends by name, for get_backend().
+BACKENDS = {EmceeBackend.name: EmceeBackend,
+            PTBackend.name: PTBackend,
+            NestedBackend.name: NestedBackend}
+
+def get_backend(backend="emcee", **options):
+    """
+    Return a sampler backend.
+
+    Args:
+        backend (str or SamplerBackend): Name of the backend (see
+            BACKENDS), or a backend, which is returned as it is.
+        options: Passed to the constructor of the backend.
+
+    Returns:
+        backend (SamplerBackend object): The backend.
+    """
+
+    if isinstance(backend, SamplerBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise Exception("Unknown sampler backend {0!r}; choose one of {1}".
+                        format(backend, sorted(BACKENDS)))
+
+    return BACKENDS[backend](**options)
@@ -4,30 +4,55 @@ import os
 import dill
 import gzip
 import numpy as np
-import statistics
 
+from utils.streaming_stats import StreamingStats
 from spamm.Model import Model
+from spamm.ChainStore import CHUNK_SIZE, StoredChain, is_chain_store
 
 #-----------------------------------------------------------------------------#
 
 #class Samples(Model):
 class Samples(object):
+    """
+    The posterior samples of one or more fits and their summary statistics
+    (means, medians, modes and fullest histogram bins).
+
+    With streaming=True the samples are never all held in memory: the 
+    chains are read a chunk at a time into a StreamingStats, so any number
+    of chain stores can be summarised in bounded memory. Pickle files are
+    read whole, one at a time, so memory is then bounded by the largest
+    fit. The medians come from quantile sketches (rank error of about 
+    0.5%), samples is None, and models is only the model of the first fit.
+    """
+
     def __init__(self, pickle_files, outdir=None, gif=False, last=False, 
-                 step=100, burn=50, histbins=100):
+                 step=100, burn=50, histbins=100, streaming=False):
         self.pname = pickle_files
         self.gif = gif
         self.last = last
         self.step = step
         self.burn = burn
         self.histbins = histbins
+        self.streaming = streaming
          
-        self.models, self.samples, self.params, self.model_name = get_samples(pickle_files, burn)
-        try:
-            self.model = self.models[0]
-        except TypeError:
-            self.model = self.models
-        self.total_parameter_count = self.model.total_parameter_count
-        self.model_parameter_names = self.model.model_parameter_names()
+        if streaming:
+            self.models, self.stats, self.params, self.model_name = \
+                stream_samples(pickle_files, burn, histbins)
+            self.samples = None
+        else:
+            self.models, self.samples, self.params, self.model_name = get_samples(pickle_files, burn)
+            self.stats = None
+        first = self.models[0] if isinstance(self.models, list) else self.models
+        if isinstance(first, StoredChain):
+            # The model is only read from the store if a plot needs it.
+            self.store = first
+            self._model = None
+            self.model_parameter_names = self.store.parameter_names
+        else:
+            self.store = None
+            self._model = first
+            self.model_parameter_names = self._model.model_parameter_names()
+        self.total_parameter_count = len(self.model_parameter_names)
         self._get_stats()
         
         if outdir is None:
@@ -36,23 +61,24 @@ class Samples(object):
                 outdir = "."
         self.outdir = outdir
 
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.store.model
+        return self._model
+
     def _get_stats(self):
-        self.means = []
-        self.medians = []
-        self.modes = []
-        self.maxs = []
-        for i in range(self.model.total_parameter_count):
-            chain = self.samples[:,i]
-            hist, bins = np.histogram(chain, self.histbins)
-            binsize = bins[1]-bins[0]
-
-            # Calculate maximum, median, average, and mode
-            maxind = np.argmax(hist)
-            max_bin = bins[maxind]
-            self.maxs.append(max_bin + binsize/2.)
-            self.medians.append(np.median(chain))
-            self.means.append(np.average(chain))
-            self.modes.append(statistics.mode(chain))
+        # The modes are those of the smoothed histograms: the chains are
+        # continuous, so values are essentially never repeated.
+        if self.stats is None:
+            self.stats = StreamingStats(self.total_parameter_count, n_bins=self.histbins)
+            self.stats.update(self.samples)
+            self.medians = list(np.median(self.samples, axis=0))
+        else:
+            self.medians = list(self.stats.median)
+        self.means = list(self.stats.mean)
+        self.maxs = list(self.stats.max_bin())
+        self.modes = list(self.stats.mode())
 
 #-----------------------------------------------------------------------------#
 
@@ -68,18 +94,13 @@ def get_samples(pname, burn=50):
     """ 
 
     if isinstance(pname, str):
-        model_name = os.path.basename(pname).split(".")[0]
-        model, params = read_pickle(pname)
-        assert burn < np.shape(model.sampler.chain)[1], \
-            "Chain burn value, {}, must be smaller than number of iterations, {}.\nRerun with lower burn value or more iterations".format(burn, np.shape(model.sampler.chain)[1]) 
-        samples = model.sampler.chain[:, burn:, :].reshape((-1, model.total_parameter_count))
-        allmodels = model
+        model_name = os.path.basename(pname.rstrip(os.sep)).split(".")[0]
+        allmodels, samples, params = read_samples(pname, burn)
     else:
         allmodels = []
         allsamples = []
         for pfile in pname:
-            model, params = read_pickle(pfile)
-            sample = model.sampler.chain[:, burn:, :].reshape((-1, model.total_parameter_count))
+            model, sample, params = read_samples(pfile, burn)
             allsamples.append(sample)
             allmodels.append(model)
         samples = np.concatenate(tuple(allsamples))
@@ -89,6 +110,94 @@ def get_samples(pname, burn=50):
 
 #-----------------------------------------------------------------------------#
 
+def read_samples(pname, burn=50):
+    """
+    Read the chain of one fit after burn-in, with the walkers concatenated.
+
+    Args:
+        pname (str): A chain store (see spamm.ChainStore.write_chain_store)
+            or a pickle file written by older versions of SPAMM.
+        burn (int): Number of iterations to discard.
+
+    Returns:
+        model (StoredChain or Model object): The store, which gives the
+            model when asked for it, or the unpickled model.
+        samples (ndarray): Array of shape (n_samples, n_parameters).
+        params (dict): The comp_params of the fit.
+    """
+
+    if is_chain_store(pname):
+        model = StoredChain(pname)
+        params = model.manifest["comp_params"]
+        n_iterations = model.shape[1]
+    else:
+        model, params = read_pickle(pname)
+        n_iterations = np.shape(model.chain)[1]
+    assert burn < n_iterations, \
+        "Chain burn value, {}, must be smaller than number of iterations, {}.\nRerun with lower burn value or more iterations".format(burn, n_iterations) 
+
+    if isinstance(model, StoredChain):
+        samples = model.samples(burn)
+    else:
+        samples = model.chain[:, burn:, :].reshape((-1, model.total_parameter_count))
+
+    return model, samples, params
+
+#-----------------------------------------------------------------------------#
+
+def stream_samples(pname, burn=50, histbins=100, chunk_iterations=CHUNK_SIZE):
+    """
+    Summarise the chains of one or more fits after burn-in without holding
+    them all in memory. Chain stores are read chunk_iterations iterations 
+    at a time, so memory is bounded whatever their size. A pickle file 
+    holds the whole model, so it is unpickled with its whole chain; only 
+    one is held at a time, and memory is bounded by the largest of them.
+
+    Args:
+        pname (str or list): A chain store or pickle file, or a list of them.
+        burn (int): Number of iterations to discard from each chain.
+        histbins (int): Number of bins of the histograms.
+        chunk_iterations (int): Number of iterations read at a time.
+
+    Returns:
+        model (StoredChain or Model object): See read_samples(), for the
+            first fit.
+        stats (StreamingStats object): Statistics of all the samples.
+        params (dict): The comp_params of the last fit.
+        model_name (str): Name of the fit, as for get_samples().
+    """
+
+    stats = None
+    first = None
+    for pfile in ([pname] if isinstance(pname, str) else pname):
+        if is_chain_store(pfile):
+            model = StoredChain(pfile)
+            params = model.manifest["comp_params"]
+            n_walkers, n_iterations, n_parameters = model.shape
+            read = lambda start, stop: model.chain(iterations=slice(start, stop))
+        else:
+            model, params = read_pickle(pfile)
+            chain = model.chain
+            n_walkers, n_iterations, n_parameters = chain.shape
+            read = lambda start, stop: chain[:, start:stop]
+        assert burn < n_iterations, \
+            "Chain burn value, {}, must be smaller than number of iterations, {}.\nRerun with lower burn value or more iterations".format(burn, n_iterations) 
+
+        if stats is None:
+            first = model
+            stats = StreamingStats(n_parameters, n_bins=histbins)
+        for start in range(burn, n_iterations, chunk_iterations):
+            stats.update(read(start, start + chunk_iterations).reshape((-1, n_parameters)))
+        model = chain = None
+
+    if isinstance(pname, str):
+        model_name = os.path.basename(pname.rstrip(os.sep)).split(".")[0]
+    else:
+        model_name = "concat_{}".format(stats.count)
+
+    return first, stats, params, model_name
+
+#-----------------------------------------------------------------------------#
 
 def read_pickle(pname):
     try:
@@ -11,8 +11,9 @@ from astropy.units import Quantity
 from astropy.nddata import NDUncertainty, StdDevUncertainty
 
 from utils.parse_pars import parse_pars
-FLUX_UNIT = parse_pars()["global"]["flux_unit"]
-WL_UNIT = parse_pars()["global"]["wl_unit"]
+GLOBAL_PARS = parse_pars()["global"]
+FLUX_UNIT = GLOBAL_PARS["flux_unit"]
+WL_UNIT = GLOBAL_PARS["wl_unit"]
 
 #-----------------------------------------------------------------------------#
 
@@ -72,7 +73,7 @@ class Spectrum(Spectrum1D):
         self._spectral_axis_unit = spectral_axis_unit
 
     def __getstate__(self):
-        odict = self.__dict__
+        odict = self.__dict__.copy()
         del odict["_wcs"]
         return odict
 
@@ -128,3 +129,101 @@ class Spectrum(Spectrum1D):
         self._norm_wavelength_flux = None
 
 #TODO need to add log_grid_spacing, spectrum binning
+
+#-----------------------------------------------------------------------------#
+
+class SlimSpectrum(object):
+    '''
+    Unit-free spectrum holding only NumPy arrays, for use inside the fit
+    where a Spectrum's units, WCS and uncertainty object are never needed.
+    It has the attributes of Spectrum that components use (spectral_axis,
+    flux, flux_error, norm_wavelength, norm_wavelength_flux, grid_spacing),
+    costs almost nothing to build and pickles to little more than its
+    arrays.
+
+    Conversions to and from Spectrum do not copy the arrays.
+
+    Args:
+        spectral_axis (array-like): Wavelength values.
+        flux (array-like): Flux values.
+        flux_error (array-like, optional): Error on `flux` values.
+        spectral_axis_unit (:obj:`astropy.units.Unit`, optional) : Wavelength unit
+        flux_unit (:obj:`astropy.units.Unit`, optional) : Flux unit. 
+    '''
+
+    __slots__ = ("_spectral_axis", "_flux", "flux_error", "spectral_axis_unit",
+                 "flux_unit", "_norm_wavelength", "_norm_wavelength_flux")
+
+    def __init__(self, spectral_axis, flux, flux_error=None, 
+                 spectral_axis_unit=WL_UNIT, flux_unit=FLUX_UNIT):
+        self._spectral_axis = np.asarray(spectral_axis)
+        self._flux = np.asarray(flux)
+        self.flux_error = None if flux_error is None else np.asarray(flux_error)
+        self.spectral_axis_unit = spectral_axis_unit
+        self.flux_unit = flux_unit
+        self._norm_wavelength = None
+        self._norm_wavelength_flux = None
+
+    @classmethod
+    def from_spectrum(cls, spectrum):
+        ''' Return a SlimSpectrum sharing the arrays of a Spectrum. '''
+        if isinstance(spectrum, SlimSpectrum):
+            return spectrum
+        return cls(spectral_axis=spectrum.spectral_axis, flux=spectrum.flux,
+                   flux_error=spectrum.flux_error,
+                   spectral_axis_unit=spectrum._spectral_axis_unit,
+                   flux_unit=spectrum.flux_unit)
+
+    def to_spectrum(self):
+        ''' Return a Spectrum whose unit-less arrays are those of this object. '''
+        flux_error = self.flux_error
+        if flux_error is None:
+            flux_error = np.zeros_like(self._flux)
+        return Spectrum(spectral_axis=self._spectral_axis, flux=self._flux,
+                        flux_error=flux_error, 
+                        spectral_axis_unit=self.spectral_axis_unit,
+                        flux_unit=self.flux_unit)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def norm_wavelength(self):
+        if self._norm_wavelength is None:
+            self._norm_wavelength = np.median(self._spectral_axis)
+        return self._norm_wavelength
+
+    @property
+    def norm_wavelength_flux(self):
+        ''' Returns the flux at the normalization wavelength. '''
+        if self._norm_wavelength_flux is None:
+            self._norm_wavelength_flux = np.interp(self.norm_wavelength,
+                                                   self._spectral_axis, self._flux)
+        return self._norm_wavelength_flux
+
+    def grid_spacing(self):
+        ''' Return the spacing of the wavelength grid in Ångstroms. Does not support variable grid spacing. '''
+        return self._spectral_axis[1] - self._spectral_axis[0]
+
+    @property
+    def spectral_axis(self):
+        return self._spectral_axis
+
+    @spectral_axis.setter
+    def spectral_axis(self, new_wl):
+        self._spectral_axis = np.asarray(new_wl)
+        self._norm_wavelength = None
+        self._norm_wavelength_flux = None
+
+    @property
+    def flux(self):
+        return self._flux
+
+    @flux.setter
+    def flux(self, new_flux):
+        self._flux = np.asarray(new_flux)
+        self._norm_wavelength_flux = None
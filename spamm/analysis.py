@@ -456,7 +456,7 @@ def hist2d(x, y, *args, **kwargs):
     color = kwargs.pop("color", "k")
     plot_datapoints = kwargs.get("plot_datapoints", True)
 
-    cmap = cm.get_cmap("gray")
+    cmap = plt.get_cmap("gray")
     cmap._init()
     cmap._lut[:-3, :-1] = 0.
     cmap._lut[:-3, -1] = np.linspace(1, 0, cmap.N)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+from utils.parse_pars import parse_pars
+from utils.read_spectrum import read_spectrum
+from spamm.Spectrum import Spectrum
+from spamm.ChainStore import write_chain_store
+from spamm.run_spamm import ACCEPTED_COMPS, build_components, fit_spectrum, \
+                            parse_comps
+
+SUMMARY_FILE = "summary.jsonl"
+
+# Components and fit settings of a worker process, set by _init_worker.
+_worker_components = None
+_worker_fit_kwargs = None
+
+#-----------------------------------------------------------------------------#
+
+def read_catalog(catalog):
+    """
+    List the spectra of a survey.
+
+    Args:
+        catalog (str): Either a directory, in which case every file in it is
+            a spectrum at z=0, or a text file with one spectrum per line:
+            the file name, optionally followed by the redshift. Relative
+            file names are relative to the catalog. Blank lines and lines
+            starting with "#" are ignored.
+
+    Returns:
+        spectra (list): List of (file name, redshift) tuples.
+    """
+
+    if os.path.isdir(catalog):
+        return [(os.path.join(catalog, filename), 0.)
+                for filename in sorted(os.listdir(catalog))
+                if not filename.startswith(".")]
+
+    spectra = []
+    catalog_dir = os.path.dirname(os.path.abspath(catalog))
+    with open(catalog, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            filename = os.path.join(catalog_dir, parts[0])
+            z = float(parts[1]) if len(parts) > 1 else 0.
+            spectra.append((filename, z))
+
+    return spectra
+
+#-----------------------------------------------------------------------------#
+
+def result_name(filename):
+    """
+    Name of the output chain store of a spectrum, e.g. spec-1234.chain for
+    spec-1234.fits.gz.
+    """
+
+    name = os.path.basename(filename)
+    for ext in (".gz", ".fits", ".fit", ".txt", ".dat", ".csv"):
+        if name.lower().endswith(ext):
+            name = name[:-len(ext)]
+
+    return name + ".chain"
+
+#-----------------------------------------------------------------------------#
+
+def _init_worker(complist, par_file, broken_pl, fit_kwargs):
+    """
+    Read the parameters and build the components of a worker process.
+    This is where the templates are loaded, once per worker.
+    """
+
+    global _worker_components, _worker_fit_kwargs
+    pars = parse_pars() if par_file is None else parse_pars(par_file)
+    _worker_components = build_components(complist, pars, broken_pl=broken_pl)
+    _worker_fit_kwargs = fit_kwargs
+
+#-----------------------------------------------------------------------------#
+
+def _fit_one(job):
+    """
+    Fit one spectrum in a worker process and write its chain store.
+    Errors are reported in the returned summary instead of stopping the
+    whole batch.
+    """
+
+    filename, z, pname, components = job
+    t1 = time.time()
+    summary = {"spectrum": filename, "z": z, "output": pname}
+    try:
+        wl, flux, flux_error = read_spectrum(filename, z=z)
+        spectrum = Spectrum(spectral_axis=wl, flux=flux, flux_error=flux_error)
+        model, converged = fit_spectrum(spectrum, _worker_components,
+                                        **_worker_fit_kwargs)
+        p_data = {"model": model,
+                  "comp_params": {"wl": wl, "flux": flux, "err": flux_error,
+                                  "components": components},
+                  "converged": converged}
+        write_chain_store(p_data, pname)
+        summary["converged"] = converged
+        summary["acceptance_fraction"] = float(np.mean(model.result.acceptance_fraction))
+        if model.profile:
+            summary["timing"] = model.timing_report()
+    except Exception as e:
+        summary["error"] = "{0}: {1}".format(type(e).__name__, e)
+    summary["seconds"] = time.time() - t1
+
+    return summary
+
+#-----------------------------------------------------------------------------#
+
+def batch(complist, catalog, outdir, processes=None, par_file=None,
+          n_walkers=30, n_iterations=500, check_every=None, broken_pl=False,
+          overwrite=False, marginalize_linear=False, map_starts=None,
+          backend="emcee", profile=False):
+    """
+    Fit every spectrum of a catalog with a pool of worker processes.
+
+    Each worker builds the components, and so reads the templates, once
+    and reuses them for all the spectra it fits. Each spectrum is fit in a
+    single process. Results are written as soon as each fit finishes: one
+    chain store per spectrum, in the format written by spamm(), plus one
+    line per spectrum in outdir/summary.jsonl. Spectra whose chain store
+    already exists are skipped unless overwrite is True, so an interrupted
+    batch can simply be started again.
+
+    Args:
+        complist (list): Component names, see spamm().
+        catalog (str): Directory or catalog file, see read_catalog().
+        outdir (str): Output directory.
+        processes (int): Number of worker processes. If None, use all
+            available CPUs.
+        par_file (str): Location of parameters file.
+        n_walkers (int): Number of walkers, or chains, to use in emcee.
+        n_iterations (int): Number of iterations for each walker/chain.
+        check_every (int): If not None, stop each fit early once it has
+            converged, see Model.run_mcmc().
+        broken_pl (Bool): True if a broken power law should be used.
+        overwrite (Bool): If True, refit spectra that already have results.
+        marginalize_linear (Bool): If True, marginalize over the 
+            normalizations instead of sampling them, see Model.run_mcmc().
+        map_starts (int): If not None, start the walkers of each fit around
+            the result of Model.find_map() with this many starting points.
+        backend (str): Sampler backend, see Model.run_mcmc(). Backends 
+            other than "emcee" evaluate the walkers one at a time.
+        profile (Bool): If True, add the timing report of each fit (see
+            Model.timing_report()) to its line of the summary.
+
+    Returns:
+        summaries (list): One summary dict per fitted spectrum, in the
+            order the fits finished.
+    """
+
+    complist = [x.upper() for x in complist]
+    components = {k:(True if k in complist else False) for k in ACCEPTED_COMPS}
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    jobs = []
+    for filename, z in read_catalog(catalog):
+        pname = os.path.join(outdir, result_name(filename))
+        if overwrite or not os.path.exists(pname):
+            jobs.append((filename, z, pname, components))
+    print("Fitting {0} spectra".format(len(jobs)))
+
+    fit_kwargs = {"n_walkers": n_walkers,
+                  "n_iterations": n_iterations,
+                  "check_every": check_every,
+                  "checkpoint_every": None,
+                  "vectorize": backend == "emcee",
+                  "marginalize_linear": marginalize_linear,
+                  "map_starts": map_starts,
+                  "backend": backend,
+                  "profile": profile}
+
+    summaries = []
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                initargs=(complist, par_file, broken_pl, fit_kwargs))
+    try:
+        with open(os.path.join(outdir, SUMMARY_FILE), "a") as summary_file:
+            for summary in pool.imap_unordered(_fit_one, jobs):
+                summary_file.write(json.dumps(summary) + "\n")
+                summary_file.flush()
+                summaries.append(summary)
+                print("{0}/{1} {2}: {3}".format(len(summaries), len(jobs),
+                      summary["spectrum"], summary.get("error", "done")))
+    finally:
+        pool.close()
+        pool.join()
+
+    return summaries
+
+#-----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("catalog", type=str,
+                        help="Directory of spectra, or file listing spectra and redshifts")
+    parser.add_argument("outdir", type=str, help="Output directory")
+    parser.add_argument("--comp", nargs="*",
+                        help="List of components to use: PL, FE, HOST, BC, BPC or *_EXT")
+    parser.add_argument("--processes", dest="processes", default=None, type=int,
+                        help="Number of worker processes")
+    parser.add_argument("--n_walkers", dest="n_walkers", default=30, type=int,
+                        help="Number of walkers")
+    parser.add_argument("--n_iterations", dest="n_iterations", default=500, type=int,
+                        help="Number of iterations per walker")
+    parser.add_argument("--check_every", dest="check_every", default=None, type=int,
+                        help="Iterations between convergence checks")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Refit spectra that already have results")
+    parser.add_argument("--marginalize_linear", action="store_true",
+                        help="Marginalize over the normalizations instead of sampling them")
+    parser.add_argument("--map_starts", dest="map_starts", default=None, type=int,
+                        help="Start the walkers at the MAP found from this many starting points")
+    parser.add_argument("--backend", dest="backend", default="emcee",
+                        help="Sampler backend: emcee, pt or nested")
+    parser.add_argument("--profile", action="store_true",
+                        help="Add the timings of each fit to the summary")
+    args = parser.parse_args()
+
+    batch(complist=parse_comps(args.comp), catalog=args.catalog,
+          outdir=args.outdir, processes=args.processes,
+          n_walkers=args.n_walkers, n_iterations=args.n_iterations,
+          check_every=args.check_every, overwrite=args.overwrite,
+          marginalize_linear=args.marginalize_linear, map_starts=args.map_starts,
+          backend=args.backend, profile=args.profile)
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+'''
+Time the flux of each component (the extinction curve for the reddening
+law) as a function of the number of pixels of the spectrum, and of the
+number of templates for the Fe and host galaxy components.
+
+    python spamm/benchmarks/bench_components.py [--output FILE] [--quick]
+
+Each call uses different parameters drawn from the priors, so the caches
+of broadened templates only help as much as they would while sampling.
+'''
+
+import os
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from common import benchmark_pars, make_model, initial_parameters, time_calls, \
+                   write_templates, write_results, print_result
+
+# Benchmarked components: names for build_components() and a label. The
+# last component is timed; the reddening law needs a component to redden.
+COMPONENTS = [(["PL"], "Nuclear"),
+              (["FE"], "FeForest"),
+              (["HOST"], "HostGalaxy"),
+              (["BC"], "BalmerContinuum"),
+              (["BPC"], "BalmerPseudoContinuum"),
+              (["BC", "BPC"], "Balmer"),
+              (["PL", "CALZETTI_EXT"], "Extinction")]
+
+PIXELS = [1000, 10000, 50000, 200000]
+QUICK_PIXELS = [1000, 10000]
+TEMPLATES = [1, 3, 10, 30]
+QUICK_TEMPLATES = [1, 3]
+
+# Number of pixels of the template-count benchmarks.
+TEMPLATE_PIXELS = 18000
+
+# Number of parameter vectors each benchmark cycles over.
+N_INPUTS = 20
+
+#-----------------------------------------------------------------------------#
+
+def time_component_flux(complist, n_pixels, pars=None):
+    '''
+    Time the flux (or extinction) of the last component of complist.
+
+    Returns:
+        timing (dict): See time_calls().
+    '''
+
+    model, truth = make_model(complist, n_pixels, pars=pars)
+    component = model.components[-1]
+    spectrum = model._slim_data_spectrum
+    start = sum(c.parameter_count for c in model.components[:-1])
+    inputs = [np.array(initial_parameters(model))[start:] for i in range(N_INPUTS)]
+
+    if component.name == "Extinction":
+        function = lambda i: component.extinction(spectrum=spectrum, params=inputs[i])
+    else:
+        function = lambda i: component.flux(spectrum=spectrum, parameters=inputs[i])
+
+    return time_calls(function, n_inputs=N_INPUTS)
+
+#-----------------------------------------------------------------------------#
+
+def run(quick=False):
+    '''
+    Run the benchmarks.
+
+    Args:
+        quick (Bool): If True, only use the smaller sizes.
+
+    Returns:
+        results (list): One dict per benchmark.
+    '''
+
+    results = []
+    for n_pixels in (QUICK_PIXELS if quick else PIXELS):
+        for complist, name in COMPONENTS:
+            result = {"benchmark": "component_flux", "component": name,
+                      "n_pixels": n_pixels}
+            result.update(time_component_flux(complist, n_pixels))
+            print_result(result)
+            results.append(result)
+
+    directory = tempfile.mkdtemp(prefix="spamm_bench_")
+    try:
+        for n_templates in (QUICK_TEMPLATES if quick else TEMPLATES):
+            pars = benchmark_pars(
+                fe_templates=write_templates(os.path.join(directory, "fe_{0}".format(n_templates)),
+                                             "fe", n_templates),
+                hg_models=write_templates(os.path.join(directory, "host_{0}".format(n_templates)),
+                                          "host", n_templates))
+            for key, name in (("FE", "FeForest"), ("HOST", "HostGalaxy")):
+                result = {"benchmark": "component_flux_templates",
+                          "component": name, "n_pixels": TEMPLATE_PIXELS,
+                          "n_templates": n_templates}
+                result.update(time_component_flux([key], TEMPLATE_PIXELS, pars=pars))
+                print_result(result)
+                results.append(result)
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+#-----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", dest="output", default="bench_components.json",
+                        help="Output JSON file")
+    parser.add_argument("--quick", action="store_true",
+                        help="Only run the smaller sizes")
+    args = parser.parse_args()
+
+    write_results(run(quick=args.quick), args.output)
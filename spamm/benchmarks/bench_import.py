@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+
+'''
+Measure how long it takes a fresh Python process to import the modules a
+fitting process needs, and check that it stays within a time budget and
+does not load the plotting stack or optional backends. Batch runs start
+many short-lived worker processes, so this is paid over and over.
+
+    python spamm/benchmarks/bench_import.py [--budget SECONDS] [--repeat N]
+
+The exit status is 1 if the budget is exceeded or a forbidden module is
+imported.
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# Top directory of the repository, which holds spamm/ and utils/.
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules imported by fitting processes.
+MODULES = ["spamm.Model", "spamm.run_spamm", "spamm.batch"]
+
+# Modules that fitting processes must not import.
+FORBIDDEN = ["matplotlib", "pyfftw", "dynesty", "spamm.analysis"]
+
+# Default budget for the slowest module, in seconds, including the import
+# of numpy, scipy, astropy and emcee.
+IMPORT_BUDGET = 1.5
+
+CODE = '''
+import sys, json, time
+t = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - t
+print(json.dumps({{"seconds": seconds,
+                  "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+'''
+
+#-----------------------------------------------------------------------------#
+
+def time_import(module, repeat=5):
+    '''
+    Import module in repeat fresh interpreters.
+
+    Args:
+        module (str): Name of the module to import.
+        repeat (int): Number of interpreters to start.
+
+    Returns:
+        seconds (float): Median import time.
+        loaded (list): Forbidden modules that were imported.
+    '''
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT] + [p for p in
+                        env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    times = []
+    loaded = []
+    for i in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", CODE.format(module=module, forbidden=FORBIDDEN)],
+            env=env, universal_newlines=True)
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result["seconds"])
+        loaded = result["loaded"]
+
+    return statistics.median(times), loaded
+
+#-----------------------------------------------------------------------------#
+
+def main(budget=IMPORT_BUDGET, repeat=5):
+    failed = False
+    for module in MODULES:
+        seconds, loaded = time_import(module, repeat=repeat)
+        status = "ok"
+        if seconds > budget:
+            status = "over budget"
+            failed = True
+        if loaded:
+            status = "imports {0}".format(", ".join(loaded))
+            failed = True
+        print("{0:20s} {1:7.3f} s  {2}".format(module, seconds, status))
+
+    print("budget {0:.3f} s: {1}".format(budget, "FAILED" if failed else "passed"))
+    return 1 if failed else 0
+
+#-----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", dest="budget", type=float, default=IMPORT_BUDGET,
+                        help="Maximum median import time in seconds")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=5,
+                        help="Number of fresh interpreters per module")
+    args = parser.parse_args()
+
+    sys.exit(main(budget=args.budget, repeat=args.repeat))
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+
+'''
+Time ln_posterior for the standard combinations of components: one
+walker at a time (ln_posterior), a whole ensemble at once
+(ln_posterior_batch), and with the normalizations marginalized over.
+
+    python spamm/benchmarks/bench_posterior.py [--output FILE] [--quick]
+'''
+
+import argparse
+
+import numpy as np
+
+from common import make_model, initial_parameters, time_calls, write_results, \
+                   print_result
+from spamm.Model import ln_posterior, ln_posterior_batch
+
+# As in examples/test_spamm.py, BC is the Balmer continuum together with
+# the pseudo-continuum of high order Balmer lines.
+COMBINATIONS = [["PL"],
+                ["PL", "FE"],
+                ["PL", "HOST"],
+                ["PL", "BC", "BPC"],
+                ["PL", "FE", "HOST"],
+                ["PL", "FE", "HOST", "BC", "BPC"],
+                ["PL", "FE", "HOST", "BC", "BPC", "CALZETTI_EXT"]]
+QUICK_COMBINATIONS = COMBINATIONS[:2]
+
+# The wavelength grid of examples/test_spamm.py: 1000-10000 A every 0.5 A.
+N_PIXELS = 18000
+
+# Number of walkers of the batch benchmark, and of positions cycled over.
+N_WALKERS = 32
+
+#-----------------------------------------------------------------------------#
+
+def time_posterior(complist, mode, n_pixels=N_PIXELS):
+    '''
+    Time the posterior of a combination of components.
+
+    Args:
+        complist (list): Component names.
+        mode (str): "serial", "batch" or "marginal".
+        n_pixels (int): Number of pixels of the spectrum.
+
+    Returns:
+        timing (dict): See time_calls(); for "batch" the times are per
+            ensemble of N_WALKERS walkers.
+    '''
+
+    model, truth = make_model(complist, n_pixels)
+    model.marginalize_linear = mode == "marginal"
+    mask = model.sampled_parameter_mask()
+    positions = np.array([initial_parameters(model) for i in range(N_WALKERS)])[:, mask]
+
+    if mode == "batch":
+        function = lambda i: ln_posterior_batch(positions, model)
+        return time_calls(function)
+
+    function = lambda i: ln_posterior(positions[i], model)
+    return time_calls(function, n_inputs=N_WALKERS)
+
+#-----------------------------------------------------------------------------#
+
+def run(quick=False):
+    '''
+    Run the benchmarks.
+
+    Args:
+        quick (Bool): If True, only use the simplest combinations.
+
+    Returns:
+        results (list): One dict per benchmark.
+    '''
+
+    results = []
+    for complist in (QUICK_COMBINATIONS if quick else COMBINATIONS):
+        for mode in ("serial", "batch", "marginal"):
+            result = {"benchmark": "ln_posterior", "components": "+".join(complist),
+                      "mode": mode, "n_pixels": N_PIXELS}
+            if mode == "batch":
+                result["n_walkers"] = N_WALKERS
+            result.update(time_posterior(complist, mode))
+            print_result(result)
+            results.append(result)
+
+    return results
+
+#-----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", dest="output", default="bench_posterior.json",
+                        help="Output JSON file")
+    parser.add_argument("--quick", action="store_true",
+                        help="Only run the simplest combinations")
+    args = parser.parse_args()
+
+    write_results(run(quick=args.quick), args.output)
@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+
+'''
+Time the post-processing of a fit: reading it into Samples (including
+the summary statistics), from a chain store, streamed from it, and from
+a pickle file as written by older versions, and making the plots of
+analysis.py.
+
+    python spamm/benchmarks/bench_postprocess.py [--output FILE] [--quick]
+
+The fit is synthetic: a chain of Gaussian scatter around the parameters
+of the data spectrum, so that no MCMC has to be run.
+'''
+
+import os
+import io
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+
+from common import make_model, time_calls, write_results, print_result
+from spamm.SamplerBackend import SamplerResult
+from spamm.run_spamm import write_pickle
+from spamm.ChainStore import write_chain_store
+from spamm.Samples import Samples
+from spamm import analysis
+
+COMPONENTS = ["PL", "FE", "HOST"]
+N_PIXELS = 18000
+N_WALKERS = 32
+N_ITERATIONS = 500
+QUICK_ITERATIONS = 100
+
+#-----------------------------------------------------------------------------#
+
+def write_fit(directory, n_iterations):
+    '''
+    Write a fit with a synthetic chain as a chain store, the format of
+    spamm.run_spamm.spamm(), and as a pickle file.
+
+    Returns:
+        store (str): Name of the chain store.
+        pname (str): Name of the pickle file.
+    '''
+
+    model, truth = make_model(COMPONENTS, N_PIXELS)
+    scatter = 0.01 * np.abs(truth) * np.random.normal(size=(N_WALKERS, n_iterations, len(truth)))
+    chain = truth + scatter
+    model.result = SamplerResult(chain=chain, ln_prob=np.zeros(chain.shape[:2]),
+                                 acceptance_fraction=np.full(N_WALKERS, 0.3),
+                                 seconds=0., backend="emcee")
+
+    p_data = {"model": model, "comp_params": {}, "converged": True}
+    store = os.path.join(directory, "model_bench.chain")
+    pname = os.path.join(directory, "model_bench.pickle.gz")
+    with contextlib.redirect_stdout(io.StringIO()):
+        write_chain_store(p_data, store)
+        write_pickle(p_data, pname)
+
+    return store, pname
+
+#-----------------------------------------------------------------------------#
+
+def run(quick=False):
+    '''
+    Run the benchmarks.
+
+    Args:
+        quick (Bool): If True, use a shorter chain.
+
+    Returns:
+        results (list): One dict per benchmark.
+    '''
+
+    n_iterations = QUICK_ITERATIONS if quick else N_ITERATIONS
+    directory = tempfile.mkdtemp(prefix="spamm_bench_")
+    try:
+        store, pname = write_fit(directory, n_iterations)
+        S = Samples(store, outdir=directory)
+        steps = [("Samples", lambda i: Samples(store, outdir=directory)),
+                 ("Samples_pickle", lambda i: Samples(pname, outdir=directory)),
+                 ("Samples_streaming", lambda i: Samples(store, outdir=directory, streaming=True)),
+                 ("corner", lambda i: analysis.corner(S.samples, labels=S.model_parameter_names)),
+                 ("plot_chains", lambda i: analysis.plot_chains(S.samples, labels=S.model_parameter_names)),
+                 ("plot_posteriors", lambda i: analysis.plot_posteriors(S.samples,
+                                               labels=S.model_parameter_names, boxes=20,
+                                               params=S.params)),
+                 ("plot_posteriors_pdf", lambda i: analysis.plot_posteriors_pdf(S)),
+                 ("plot_best_models", lambda i: analysis.plot_best_models(S)),
+                 ("make_plots_from_pickle", lambda i: analysis.make_plots_from_pickle(store, directory))]
+
+        results = []
+        for name, function in steps:
+            def step(i, function=function):
+                function(i)
+                matplotlib.pyplot.close("all")
+            result = {"benchmark": "postprocess", "step": name,
+                      "n_samples": N_WALKERS * n_iterations,
+                      "n_parameters": S.total_parameter_count}
+            result.update(time_calls(step, max_repeat=5))
+            print_result(result)
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+#-----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", dest="output", default="bench_postprocess.json",
+                        help="Output JSON file")
+    parser.add_argument("--quick", action="store_true",
+                        help="Use a shorter chain")
+    args = parser.parse_args()
+
+    write_results(run(quick=args.quick), args.output)
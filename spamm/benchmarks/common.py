@@ -0,0 +1,249 @@
+#! /usr/bin/env python
+
+'''
+Helpers shared by the benchmarks: synthetic inputs, timing and the JSON
+output with the metadata of the machine.
+
+The inputs are made the way examples/test_spamm.py makes them: the data
+spectrum is the sum of the fluxes of the components for parameters drawn
+from their priors, with 5% errors. The Fe and host galaxy templates are
+those in Data/, or synthetic templates written to a temporary directory
+when more templates are needed, so nothing has to be downloaded.
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import datetime
+import contextlib
+import subprocess
+import statistics
+import multiprocessing
+
+import numpy as np
+
+# Top directory of the repository, which holds spamm/, utils/ and Data/.
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from utils.parse_pars import parse_pars
+from spamm.Spectrum import Spectrum
+from spamm.Model import Model
+from spamm.run_spamm import build_components
+
+# Wavelength range of all the benchmark spectra, in Angstroms.
+WL_MIN = 1000.
+WL_MAX = 10000.
+
+# Minimum time spent on each benchmark, and maximum number of calls.
+MIN_TIME = 0.5
+MAX_REPEAT = 200
+
+#-----------------------------------------------------------------------------#
+
+def machine_metadata():
+    '''
+    Description of the machine and software the benchmarks ran on.
+
+    Returns:
+        metadata (dict): Host, platform, CPU, versions of Python and of the
+            main dependencies, git commit of the tree and the time (UTC).
+    '''
+
+    import scipy
+    import emcee
+    import astropy
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL,
+                                         universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "emcee": emcee.__version__,
+            "astropy": astropy.__version__,
+            "git_commit": commit}
+
+#-----------------------------------------------------------------------------#
+
+def time_calls(function, n_inputs=1, min_time=MIN_TIME, max_repeat=MAX_REPEAT):
+    '''
+    Time function(i) for i = 0, 1, ..., cycling over n_inputs inputs,
+    until min_time has passed or max_repeat calls were made. The first
+    call is made before timing starts. Output printed by function (e.g.
+    the iteration count of ln_posterior) is discarded.
+
+    Args:
+        function (callable): Function of the call number.
+        n_inputs (int): Number of different inputs function cycles over.
+        min_time (float): Minimum total time, in seconds.
+        max_repeat (int): Maximum number of timed calls.
+
+    Returns:
+        timing (dict): Number of calls, and the minimum, median and mean
+            time per call in seconds.
+    '''
+
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(0)
+        start = time.perf_counter()
+        while len(times) < max_repeat and (not times or time.perf_counter() - start < min_time):
+            t1 = time.perf_counter()
+            function((len(times) + 1) % n_inputs)
+            times.append(time.perf_counter() - t1)
+
+    return {"repeat": len(times),
+            "min_seconds": min(times),
+            "median_seconds": statistics.median(times),
+            "mean_seconds": statistics.mean(times)}
+
+#-----------------------------------------------------------------------------#
+
+def benchmark_pars(fe_templates=None, hg_models=None):
+    '''
+    SPAMM parameters with absolute template directories, so that the
+    benchmarks can run from any directory.
+
+    Args:
+        fe_templates (str): Directory of Fe templates. Defaults to Data/FeModels.
+        hg_models (str): Directory of host galaxy templates. Defaults to
+            Data/HostModels.
+
+    Returns:
+        pars (dict): Parameters, see parse_pars().
+    '''
+
+    pars = parse_pars()
+    pars["fe_forest"]["fe_templates"] = fe_templates or os.path.join(ROOT, "Data", "FeModels")
+    pars["host_galaxy"]["hg_models"] = hg_models or os.path.join(ROOT, "Data", "HostModels")
+    return pars
+
+#-----------------------------------------------------------------------------#
+
+def write_templates(directory, kind, n_templates, seed=0):
+    '''
+    Write synthetic templates in the format of those in Data/.
+
+    Fe templates are forests of Gaussian emission lines between 1075 and
+    7535 A on a 0.5 A grid. Host galaxy templates are stellar-like
+    continua with absorption lines between 1150 and 25000 A on a 5 A grid.
+
+    Args:
+        directory (str): Output directory; it is created if needed.
+        kind (str): "fe" or "host".
+        n_templates (int): Number of templates.
+        seed (int): Seed of the random numbers.
+
+    Returns:
+        directory (str): The output directory.
+    '''
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    rng = np.random.RandomState(seed)
+
+    for i in range(n_templates):
+        if kind == "fe":
+            wl = np.arange(1075., 7535., 0.5)
+            flux = np.zeros(len(wl))
+            for center in rng.uniform(wl[0], wl[-1], 300):
+                flux += rng.uniform(0.1, 1.) * np.exp(-0.5 * ((wl - center) / rng.uniform(2., 8.))**2)
+            flux *= 1e-14 / flux.max()
+            filename = "Fe_model_synthetic_{0:03d}.dat".format(i)
+        elif kind == "host":
+            wl = np.arange(1150., 25000., 5.)
+            temperature = rng.uniform(3500., 12000.)
+            flux = 1. / (wl**5 * (np.exp(1.439e8 / (wl * temperature)) - 1.))
+            for center in rng.uniform(3000., 9000., 40):
+                flux *= 1. - 0.3 * rng.uniform() * np.exp(-0.5 * ((wl - center) / 5.)**2)
+            flux *= 6e-8 / flux.max()
+            filename = "host_model_synthetic_{0:03d}.ascii".format(i)
+        else:
+            raise Exception("Unknown template kind {0!r}".format(kind))
+        np.savetxt(os.path.join(directory, filename), np.column_stack((wl, flux)))
+
+    return directory
+
+#-----------------------------------------------------------------------------#
+
+def make_model(complist, n_pixels, pars=None, seed=0):
+    '''
+    Build a model of the named components and a synthetic data spectrum
+    on n_pixels pixels between WL_MIN and WL_MAX, as in test_spamm.py: the
+    sum of the component fluxes for parameters drawn from the priors, with
+    5% errors.
+
+    Args:
+        complist (list): Component names, see spamm.run_spamm.spamm().
+        n_pixels (int): Number of pixels of the spectrum.
+        pars (dict): SPAMM parameters. Defaults to benchmark_pars().
+        seed (int): Seed of the random numbers.
+
+    Returns:
+        model (Model object): The model, with its data spectrum set.
+        truth (ndarray): The parameters of the data spectrum.
+    '''
+
+    np.random.seed(seed)
+    pars = benchmark_pars() if pars is None else pars
+    wl = np.linspace(WL_MIN, WL_MAX, n_pixels)
+    flux = 1e-15 * (wl / 5000.)**-1.5
+
+    # First pass: initialize the components on a placeholder spectrum to
+    # draw their parameters and compute the data flux.
+    model = Model()
+    model.print_parameters = False
+    model.components = build_components(complist, pars)
+    model.data_spectrum = Spectrum(spectral_axis=wl, flux=flux, flux_error=0.05 * flux)
+    truth = np.array(initial_parameters(model))
+    flux = model.model_flux(truth)
+    flux = np.where(flux > 0, flux, 1e-20)
+
+    model.data_spectrum = Spectrum(spectral_axis=wl, flux=flux, flux_error=0.05 * flux)
+
+    return model, truth
+
+def initial_parameters(model):
+    ''' One parameter vector of model drawn from the priors. '''
+
+    params = []
+    for component in model.components:
+        params += component.initial_values(model._slim_data_spectrum)
+    return params
+
+#-----------------------------------------------------------------------------#
+
+def write_results(results, filename):
+    '''
+    Write benchmark results and the machine metadata to a JSON file.
+
+    Args:
+        results (list): One dict per benchmark.
+        filename (str): Output file.
+    '''
+
+    with open(filename, "w") as f:
+        json.dump({"metadata": machine_metadata(), "results": results}, f, indent=1)
+    print("Saved {0}".format(filename))
+
+def print_result(result):
+    ''' Print one benchmark result on one line. '''
+
+    keys = [k for k in result if not k.endswith("_seconds") and k != "repeat"]
+    label = " ".join("{0}={1}".format(k, result[k]) for k in keys)
+    print("{0:70s} {1:10.3f} ms".format(label, 1e3 * result["median_seconds"]))
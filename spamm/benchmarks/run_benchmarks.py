@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+
+'''
+Run the component, posterior and post-processing benchmarks and write
+all the results, with the metadata of the machine, to one JSON file.
+
+    python spamm/benchmarks/run_benchmarks.py [--output FILE] [--quick]
+        [--only components posterior postprocess]
+
+The import-time check is separate, see bench_import.py.
+'''
+
+import argparse
+
+from common import write_results
+import bench_components
+import bench_posterior
+import bench_postprocess
+
+SUITES = {"components": bench_components,
+          "posterior": bench_posterior,
+          "postprocess": bench_postprocess}
+
+#-----------------------------------------------------------------------------#
+
+def main(output, quick=False, only=None):
+    results = []
+    for name, suite in SUITES.items():
+        if only and name not in only:
+            continue
+        print("== {0}".format(name))
+        results += suite.run(quick=quick)
+
+    write_results(results, output)
+
+#-----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", dest="output", default="benchmarks.json",
+                        help="Output JSON file")
+    parser.add_argument("--quick", action="store_true",
+                        help="Only run the smaller sizes")
+    parser.add_argument("--only", nargs="*", choices=sorted(SUITES),
+                        help="Suites to run")
+    args = parser.parse_args()
+
+    main(args.output, quick=args.quick, only=args.only)
@@ -1,12 +1,10 @@
 #!/usr/bin/python
 
+import os
 import sys
 import numpy as np
 from .ComponentBase import Component
-from scipy.interpolate import interp1d
-from scipy.integrate import simps
-from scipy.fftpack.helper import next_fast_len
-import matplotlib.pyplot as plt
+from scipy.fft import next_fast_len
 from astropy.constants import c, h, k_B, Ryd
 from astropy.modeling.blackbody import blackbody_lambda
 
@@ -14,7 +12,7 @@ from astropy.modeling.blackbody import blackbody_lambda
 from utils.rebin_spec import rebin_spec
 #from utils.fftwconvolve_1d import fftwconvolve_1d
 from utils.find_nearest_index import find_nearest_index
-from utils.parse_pars import parse_pars
+from utils.parse_pars import parse_pars, DEFAULT_PARS
 #import line_profiler
 
 # Constants are in cgs.  
@@ -25,6 +23,83 @@ R = Ryd.to("1/Angstrom")
 E0 = 2.179e-11
 balmer_edge = 3646 # Angstroms
 
+# Storey & Hummer (1995) case B recombination coefficients, stored as one 
+# scipy interp2d object per line from n=50 down to n=3.
+# The file is in Data/ at the top of the source tree.
+RECOMB_COEFF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                                 "..", "..", "Data", "SH95recombcoeff", 
+                                 "coeff.interpers.pickle")
+SH95_MIN_LINE = 3
+SH95_MAX_LINE = 50
+
+# Dense recombination coefficient tables, loaded once per process.
+_recomb_coeff_tables = {}
+
+#-----------------------------------------------------------------------------#
+
+def recombination_table(filename=RECOMB_COEFF_FILE):
+    """
+    Load the Storey & Hummer (1995) recombination coefficients into a dense
+    table. The file is only read the first time it is requested.
+
+    Args:
+        filename (str): Pickle of the per-line coefficient interpolators.
+
+    Returns:
+        n_e_grid (array): Electron densities of the table.
+        T_grid (array): Electron temperatures of the table.
+        table (array): Coefficients of shape (n_line, n_e, T), where row i 
+            is the line with upper level n = i + SH95_MIN_LINE.
+    """
+
+    if filename not in _recomb_coeff_tables:
+        import pickle
+        from scipy.interpolate import bisplev
+
+        with open(filename, 'rb') as pickle_file:
+            coeff = pickle.load(pickle_file, encoding="latin1")
+
+        # All interpolators are linear splines on the same grid, so 
+        # evaluating them at the grid nodes recovers the tabulated values.
+        n_e_grid = np.asarray(coeff[0].x, dtype=float)
+        T_grid = np.asarray(coeff[0].y, dtype=float)
+        table = np.array([bisplev(n_e_grid, T_grid, coef_interp.tck) 
+                          for coef_interp in coeff[::-1]])
+        _recomb_coeff_tables[filename] = (n_e_grid, T_grid, table)
+
+    return _recomb_coeff_tables[filename]
+
+#-----------------------------------------------------------------------------#
+
+def bilinear_interp(table, x_grid, y_grid, x, y):
+    """
+    Bilinear interpolation in the last two axes of table. Points outside
+    the grid take the value at the nearest edge, as the original interp2d
+    interpolators did.
+
+    Args:
+        table (array): Array of shape (..., len(x_grid), len(y_grid)).
+        x_grid (array): Increasing coordinates of the second-to-last axis.
+        y_grid (array): Increasing coordinates of the last axis.
+        x (float or array): Coordinates to interpolate at.
+        y (float or array): Coordinates to interpolate at, same shape as x.
+
+    Returns:
+        array (array): Array of shape table.shape[:-2] + np.shape(x).
+    """
+
+    x = np.clip(x, x_grid[0], x_grid[-1])
+    y = np.clip(y, y_grid[0], y_grid[-1])
+    i = np.clip(np.searchsorted(x_grid, x, side="right") - 1, 0, len(x_grid) - 2)
+    j = np.clip(np.searchsorted(y_grid, y, side="right") - 1, 0, len(y_grid) - 2)
+    tx = (x - x_grid[i]) / (x_grid[i+1] - x_grid[i])
+    ty = (y - y_grid[j]) / (y_grid[j+1] - y_grid[j])
+
+    return (table[..., i, j] * (1 - tx) * (1 - ty) + 
+            table[..., i+1, j] * tx * (1 - ty) + 
+            table[..., i, j+1] * (1 - tx) * ty + 
+            table[..., i+1, j+1] * tx * ty)
+
 class BalmerCombined(Component):
 
     """
@@ -56,6 +131,7 @@ class BalmerCombined(Component):
         self.model_parameter_names.append("bc_lwidth")
         self.model_parameter_names.append("bc_logNe")
 #        self.model_parameter_names.append("lscale")
+        self.linear_parameter_names = ["bc_norm"]
         
         self._norm_wavelength =  None
         
@@ -195,6 +271,20 @@ class BalmerCombined(Component):
 
         return ln_priors
         
+#-----------------------------------------------------------------------------#
+
+    def bounds(self):
+        """
+        Prior bounds of the parameters, in the order of model_parameter_names.
+        """
+
+        return [(self.normalization_min, self.normalization_max),
+                (self.Te_min, self.Te_max),
+                (self.tauBE_min, self.tauBE_max),
+                (self.loffset_min, self.loffset_max),
+                (self.lwidth_min, self.lwidth_max),
+                (self.logNe_min, self.logNe_max)]
+
 #-----------------------------------------------------------------------------#
     
     #TODO add convolution function to utils
@@ -278,22 +368,18 @@ class BalmerCombined(Component):
         Estimate relative intensity values for lines 3-400 using from 
         Kovacevic et al 2014.
         """ 
-        import pickle
-        
-        maxline = int(line_orders.max())
-        minline = int(line_orders.min())
-        flux_ratios = np.zeros(maxline-minline+1)
-        n = np.arange(minline,maxline+1)
-    
-        coeff = pickle.load(open('../Data/SH95recombcoeff/coeff.interpers.pickle','rb'),
-                            encoding="latin1")
-        coef_use = [coef_interp(n_e, T) for coef_interp in coeff] 
-    
-        for i in n:
-            if i <=50:
-                flux_ratios[i-minline] = coef_use[-i+2]
-            else:
-                flux_ratios[i-minline] = flux_ratios[i-minline-1]*np.exp(E0*(1./i**2-1./(i-1)**2)/(k.value*T))
+        n_e_grid, T_grid, table = recombination_table()
+
+        n = np.arange(int(line_orders.min()), int(line_orders.max())+1)
+        T = np.asarray(T, dtype=float)
+        coef_use = bilinear_interp(table, n_e_grid, T_grid, n_e, T)
+
+        # Lines above n=50 are extrapolated from n=50 with the Boltzmann 
+        # factor between successive levels. The product of those factors 
+        # telescopes to a single exponential.
+        flux_ratios = coef_use[np.minimum(n, SH95_MAX_LINE) - SH95_MIN_LINE]
+        delta_E = E0*(1./np.maximum(n, SH95_MAX_LINE)**2 - 1./SH95_MAX_LINE**2)
+        flux_ratios = flux_ratios * np.exp(delta_E.reshape(delta_E.shape + (1,)*T.ndim)/(k.value*T))
         return flux_ratios
     
 #-----------------------------------------------------------------------------#
@@ -308,34 +394,111 @@ class BalmerCombined(Component):
             width (int or float): Width of emission line. 
         """
 
+        sp_wavel = np.asarray(sp_wavel)
         line_orders = np.arange(self.inputpars["bc_lines_min"],self.inputpars["bc_lines_max"]) 
         lcenter =  self.balmerseries(line_orders)
     
         lcenter -= shift*lcenter
-        LL = sp_wavel - lcenter.reshape(lcenter.size, 1) #(is this simply x-x0)
-        lwidth =  width*lcenter.reshape(lcenter.size,1)
+        lwidth =  width*lcenter
+        lflux = self.balmer_ratio(n_e,line_orders,T)
+
+        # Each line is only evaluated on the pixels within bc_line_window 
+        # widths of its centre. The neglected wings are below exp(-N^2) of 
+        # the peak for gaussian lines and 1/(1+N^2) for lorentzian lines.
+        # If no window is set, every line covers the whole grid.
+        window = self.inputpars.get("bc_line_window", 
+                                    DEFAULT_PARS["balmer_continuum"]["bc_line_window"])
+        if window:
+            first = np.searchsorted(sp_wavel, lcenter - window*lwidth, side="left")
+            last = np.searchsorted(sp_wavel, lcenter + window*lwidth, side="right")
+        else:
+            first = np.zeros(lcenter.size, dtype=int)
+            last = np.full(lcenter.size, len(sp_wavel))
+        n_pix = last - first
+
+        # Flatten the (line, pixel) pairs of all windows.
+        line_index = np.repeat(np.arange(lcenter.size), n_pix)
+        pix_index = np.arange(n_pix.sum()) + np.repeat(first - (np.cumsum(n_pix) - n_pix), n_pix)
+
+        LL = sp_wavel[pix_index] - lcenter[line_index] #(is this simply x-x0)
+        pix_lwidth = lwidth[line_index]
         ltype = self.inputpars["bc_line_type"]
         if ltype == "gaussian":
-            lines = np.exp(- LL**2 /lwidth**2)
+            lines = np.exp(- LL**2 /pix_lwidth**2)
         elif ltype == "lorentzian":
-            lines = lwidth / (LL**2 + lwidth**2)
+            lines = pix_lwidth / (LL**2 + pix_lwidth**2)
         else:
             raise ValueError("Variable 'ltype' ({0}) must be 'gaussian' or 'lorentzian'".
                              format(ltype))
     
-        lflux = self.balmer_ratio(n_e,line_orders,T)
-
-        scale = np.repeat(lflux.reshape(lflux.size,1),lines.shape[1],axis=1)
-
-
-        lines *= scale
+        lines *= lflux[line_index]
     
-        balmer_lines = np.sum(lines,axis = 0)
+        balmer_lines = np.bincount(pix_index, weights=lines, minlength=len(sp_wavel))
     
         return balmer_lines
     
+#-----------------------------------------------------------------------------#
+
+    def makelines_fft(self, sp_wavel, T, n_e, shift, width):
+        """
+        Same as makelines, but built in log wavelength space. The width of
+        every line is proportional to its centre, so in ln(lambda) all lines
+        share one profile and the line series is a weighted comb of delta 
+        functions convolved with that profile. The comb is deposited on a 
+        uniform ln(lambda) grid, convolved with one FFT using the analytic
+        transform of the profile, and interpolated back to sp_wavel.
+        The profiles are accurate to first order in the line width.
+
+        Args:
+            sp_wavel (array): Wavelengths at which to evaluate the line fluxes.
+            T (int or float): Electron temperature.
+            n_e (float): Electron density.
+            shift (int or float): Offset from expected Balmer wavelengths.
+            width (int or float): Width of emission line. 
+        """
+
+        ln_wave = np.log(sp_wavel)
+        line_orders = np.arange(self.inputpars["bc_lines_min"],self.inputpars["bc_lines_max"]) 
+        lcenter =  self.balmerseries(line_orders)
+        lcenter -= shift*lcenter
+        lflux = self.balmer_ratio(n_e,line_orders,T)
+
+        ltype = self.inputpars["bc_line_type"]
+        if ltype == "gaussian":
+            weights = lflux
+        elif ltype == "lorentzian":
+            # lwidth/(LL^2 + lwidth^2) = (1/lcenter) * width/(dlnl^2 + width^2)
+            weights = lflux / lcenter
+        else:
+            raise ValueError("Variable 'ltype' ({0}) must be 'gaussian' or 'lorentzian'".
+                             format(ltype))
+
+        # Uniform ln(lambda) grid at the finest sampling of the data, padded
+        # so that the wings of the lines do not wrap around.
+        window = self.inputpars.get("bc_line_window", 
+                                    DEFAULT_PARS["balmer_continuum"]["bc_line_window"])
+        pad = window*width if window else ln_wave[-1] - ln_wave[0]
+        dx = np.min(np.diff(ln_wave))
+        x0 = ln_wave[0] - pad
+        n_grid = next_fast_len(int(np.ceil((ln_wave[-1] - ln_wave[0] + 2*pad)/dx)) + 2, real=True)
+
+        # Deposit the line fluxes on the two nearest grid points.
+        pos = (np.log(lcenter) - x0)/dx
+        index = np.floor(pos).astype(int)
+        frac = pos - index
+        inside = (index >= 0) & (index < n_grid - 1)
+        comb = np.bincount(index[inside], weights=weights[inside]*(1 - frac[inside]), minlength=n_grid) + \
+               np.bincount(index[inside] + 1, weights=weights[inside]*frac[inside], minlength=n_grid)
+
+        freq = np.fft.rfftfreq(n_grid, d=dx)
+        if ltype == "gaussian":
+            transfer = width*np.sqrt(np.pi)*np.exp(-(np.pi*width*freq)**2)
+        else:
+            transfer = np.pi*np.exp(-2*np.pi*width*freq)
+        balmer_lines = np.fft.irfft(np.fft.rfft(comb)*transfer/dx, n_grid)
+
+        return np.interp(ln_wave, x0 + dx*np.arange(n_grid), balmer_lines)
 
-       
 #-----------------------------------------------------------------------------#
     
     def BpC_flux(self, spectrum=None, parameters=None):
@@ -374,7 +537,13 @@ class BalmerCombined(Component):
         edge_wl = balmer_edge*(1 - loffset/c_kms.value)
         
         n_e =10.**logNe
-        bpc_flux = self.makelines(spectrum.spectral_axis,
+        method = self.inputpars.get("bc_line_method", 
+                                    DEFAULT_PARS["balmer_continuum"]["bc_line_method"])
+        if method == "fft":
+            makelines = self.makelines_fft
+        else:
+            makelines = self.makelines
+        bpc_flux = makelines(spectrum.spectral_axis,
                  Te,n_e,
                  loffset/c_kms.value,lwidth/c_kms.value)
                  
@@ -8,6 +8,8 @@ import numpy as np
 import sys
 
 from utils.parse_pars import parse_pars
+from utils.interp_matrix import interp_matrix
+from utils.rebin_spec import rebin_matrix
 PARS = parse_pars()
 
 #-----------------------------------------------------------------------------#
@@ -32,6 +34,9 @@ class Component(ABC):
         self.data_wavelength_grid = None
         self.interpolated_flux = None # based on data, defined in initialize()
 
+        # Parameters the flux is proportional to, see linear_basis().
+        self.linear_parameter_names = []
+
     def parameter_index(self, parameter_name):
         ''' '''
         for idx, pname in enumerate(self.model_parameter_names):
@@ -83,6 +88,100 @@ class Component(ABC):
     def flux(self, wavelengths=None, parameters=None):
         pass
 
+    def flux_batch(self, spectrum, parameters):
+        '''
+        Returns the flux of this component for a batch of parameter vectors.
+
+        The default implementation calls flux() once per row; subclasses
+        should override this with a vectorized implementation.
+
+        @param spectrum Spectrum defining the wavelength grid.
+        @param parameters 2D array of shape (n_walkers, parameter_count).
+        @return Array of shape (n_walkers, n_pix).
+        '''
+        parameters = np.atleast_2d(parameters)
+        return np.array([self.flux(spectrum=spectrum, parameters=p) for p in parameters])
+
+    def ln_priors_batch(self, params):
+        '''
+        Returns the ln of all of the priors for a batch of parameter vectors.
+
+        Subclasses that override bounds() have flat priors within those
+        bounds, so these are evaluated for all rows at once; otherwise
+        ln_priors() is called once per row.
+
+        @param params 2D array of shape (n_walkers, parameter_count).
+        @return Array of shape (n_walkers, parameter_count).
+        '''
+        params = np.atleast_2d(params)
+        if type(self).bounds is Component.bounds:
+            return np.array([self.ln_priors(params=p) for p in params], dtype=float)
+        lower, upper = np.array(self.bounds(), dtype=float).reshape(-1, 2).T
+        return np.where((lower < params) & (params < upper), 0., -np.inf)
+
+    def bounds(self):
+        '''
+        Prior bounds of the parameters. Subclasses with bounded priors
+        should override this; the default is unbounded.
+
+        @return List of (min, max) tuples, in the order of model_parameter_names.
+        '''
+        return [(-np.inf, np.inf)] * len(self.model_parameter_names)
+
+    def linear_bounds(self):
+        '''
+        Prior bounds of the linear parameters.
+
+        @return Lists of the lower and upper bounds, in the order of
+            linear_parameter_names.
+        '''
+        bounds = self.bounds()
+        pairs = [bounds[self.parameter_index(name)] for name in self.linear_parameter_names]
+        return [lower for lower, upper in pairs], [upper for lower, upper in pairs]
+
+    def linear_basis(self, spectrum, parameters):
+        '''
+        Returns the flux of this component for a unit value of each of its
+        linear parameters (see linear_parameter_names) and the given values
+        of the other parameters, so that the flux is the dot product of the
+        values of the linear parameters with the basis. The values of the
+        linear parameters in parameters are ignored.
+
+        The default implementation calls flux() once per linear parameter,
+        with that parameter set to 1 and the other linear parameters to 0.
+
+        @param spectrum Spectrum defining the wavelength grid.
+        @param parameters 1D array of all parameters of this component.
+        @return Array of shape (len(linear_parameter_names), n_pix).
+        '''
+        parameters = np.array(parameters, dtype=float)
+        indices = [self.parameter_index(name) for name in self.linear_parameter_names]
+        basis = []
+        for index in indices:
+            parameters[indices] = 0.
+            parameters[index] = 1.
+            basis.append(self.flux(spectrum=spectrum, parameters=parameters))
+        return np.array(basis).reshape(len(indices), len(spectrum.spectral_axis))
+
+    def linear_basis_batch(self, spectrum, parameters):
+        '''
+        linear_basis() for a batch of parameter vectors, with one call of
+        flux_batch() per linear parameter.
+
+        @param spectrum Spectrum defining the wavelength grid.
+        @param parameters 2D array of shape (n_walkers, parameter_count).
+        @return Array of shape (n_walkers, len(linear_parameter_names), n_pix).
+        '''
+        parameters = np.array(np.atleast_2d(parameters), dtype=float)
+        indices = [self.parameter_index(name) for name in self.linear_parameter_names]
+        basis = []
+        for index in indices:
+            parameters[:, indices] = 0.
+            parameters[:, index] = 1.
+            basis.append(self.flux_batch(spectrum=spectrum, parameters=parameters))
+        return np.stack(basis, axis=1).reshape(len(parameters), len(indices),
+                                               len(spectrum.spectral_axis))
+
     def grid_spacing(self):
         ''' Return the spacing of the wavelength grid in Ångstroms. Does not support variable grid spacing. '''
         if self.is_analytic:
@@ -116,4 +215,23 @@ class Component(ABC):
             return True
         else:
             return False
+
+    def resampling_matrix(self, wavelengths, new_wavelengths, zero_outside=False):
+        '''
+        Sparse operator that resamples flux from one wavelength grid onto
+        another, by linear interpolation or, if rebin_spec is set, by
+        flux-conserving rebinning (see fast_interp). Components build these
+        once per template in initialize() so that resampling a broadened
+        template is a single sparse product.
+
+        @param wavelengths Increasing grid the flux is sampled on.
+        @param new_wavelengths Increasing grid to resample onto.
+        @param zero_outside If True, interpolated flux is zero outside of
+            wavelengths instead of being clamped to the end values.
+        @return scipy.sparse.csr_matrix of shape (len(new_wavelengths), len(wavelengths)).
+        '''
+        if self.fast_interp:
+            return interp_matrix(wavelengths, new_wavelengths, zero_outside=zero_outside)
+        else:
+            return rebin_matrix(wavelengths, new_wavelengths)
         
@@ -1,26 +1,20 @@
 #!/usr/bin/python
 
-import re
-import sys
 import numpy as np
-import pyfftw 
-from scipy import signal
-from astropy.convolution import Gaussian1DKernel, convolve
-import warnings
 from astropy.constants import c
 import glob
 import os
-import math
 
 from utils.runningmeanfast import runningMeanFast
-from utils.gaussian_kernel import gaussian_kernel
-from utils.fftwconvolve_1d import fftwconvolve_1d
-from utils.find_nearest_index import find_nearest
-from utils.parse_pars import parse_pars
+from utils.parse_pars import parse_pars, DEFAULT_PARS
 from utils.rebin_spec import rebin_spec
+from utils.interp_matrix import interp_weights
+from utils.gaussian_broaden import template_ffts, gaussian_broaden, PAD_SIGMA
+from utils.lru_cache import LRUCache
+from utils.template_library import load_template_library
 
 from .ComponentBase import Component
-from ..Spectrum import Spectrum
+from ..Spectrum import SlimSpectrum
 
 #-----------------------------------------------------------------------------#
 
@@ -57,6 +51,7 @@ class FeComponent(Component):
         self.load_templates()
         self.model_parameter_names = ["fe_norm_{0}".format(x) for x in range(1, len(self.fe_templ)+1)]
         self.model_parameter_names.append("fe_width") 
+        self.linear_parameter_names = self.model_parameter_names[:-1]
         self.interp_fe = []
         self.interp_fe_norm_flux = []
         self.name = "FeForest"
@@ -73,22 +68,19 @@ class FeComponent(Component):
 #-----------------------------------------------------------------------------#
 
     def load_templates(self):
-        """Read in all of the Fe templates."""
+        """
+        Read in all of the Fe templates. The text files are only parsed the
+        first time; after that they are memory-mapped from a binary copy 
+        (see utils.template_library).
+        """
 
         # Sort the templates alphabetically.
         template_list = sorted(glob.glob(os.path.join(self.inputpars["fe_templates"], "*")))
         assert len(template_list) != 0, \
         "No Fe templates found in specified diretory {0}".format(self.inputpars["fe_templates"])
 
-        self.fe_templ = []
-
-        for template_filename in template_list:
-            with open(template_filename) as template_file:
-                wavelengths, flux = np.loadtxt(template_filename, unpack=True)
-                flux = np.where(flux<0, 1e-19, flux)
-                fe = Spectrum(spectral_axis=wavelengths, flux=flux, flux_error=flux)
-
-                self.fe_templ.append(fe)
+        # Negative fluxes are replaced by 1e-19.
+        self.fe_templ = load_template_library(template_list, negative_flux=1e-19)
 
 #-----------------------------------------------------------------------------#
 
@@ -166,6 +158,8 @@ class FeComponent(Component):
         # so rebin to equal log bins
         # log_fe.wavelength is in log space but flux is not
         self.log_fe = []
+        self.interp_fe = []
+        self.interp_fe_norm_flux = []
 
         nw = data_spectrum.norm_wavelength
 
@@ -186,8 +180,7 @@ class FeComponent(Component):
                                          log_fe_wl)
 
             
-            log_fe_spectrum = Spectrum(spectral_axis=log_fe_wl, flux=log_fe_flux, 
-                                       flux_error=log_fe_flux)
+            log_fe_spectrum = SlimSpectrum(spectral_axis=log_fe_wl, flux=log_fe_flux)
             self.log_fe.append(log_fe_spectrum)
 #            self.interp_fe.append(Spectrum.bin_spectrum(template.spectral_axis,
 #                                                              template.flux,
@@ -213,6 +206,31 @@ class FeComponent(Component):
                                                    left=0,
                                                    right=0))
 
+        # Precompute the FFTs of the log-binned templates. The zero padding
+        # must cover the widest kernel allowed by the prior so that flux 
+        # does not wrap around between the ends of a template, to at least
+        # PAD_SIGMA standard deviations.
+        self.log_fe_bin_size = np.array([log_fe.spectral_axis[2] - log_fe.spectral_axis[1]
+                                         for log_fe in self.log_fe])
+        pad = np.ceil(max(self.inputpars["fe_kernel_size_sigma"], PAD_SIGMA) * \
+                      max(self.kernel_sigma(self.width_max)))
+        self.log_fe_fft, self.log_fe_nfft = template_ffts([log_fe.flux for log_fe in self.log_fe], pad)
+
+        # Resampling the broadened templates from their log grids onto the
+        # data and finding their flux at the normalization wavelength do not
+        # depend on the parameters, so precompute the operators.
+        log_wavelengths = np.log(data_spectrum.spectral_axis)
+        self.resample_plans = [self.resampling_matrix(log_fe.spectral_axis, log_wavelengths,
+                                                      zero_outside=True)
+                               for log_fe in self.log_fe]
+        self.norm_index, self.norm_weight = interp_weights(data_spectrum.spectral_axis,
+            [np.median(template.spectral_axis) for template in self.fe_templ])
+
+        # Broadened templates only change when the kernel width changes by a
+        # whole pixel, so cache them on the data grid.
+        self.template_cache = LRUCache(self.inputpars.get("fe_cache_size", 
+                                                          DEFAULT_PARS["fe_forest"]["fe_cache_size"]))
+
 #-----------------------------------------------------------------------------#
 
     def ln_priors(self, params):
@@ -249,13 +267,125 @@ class FeComponent(Component):
 
         return ln_priors
 
+#-----------------------------------------------------------------------------#
+
+    def bounds(self):
+        """
+        Prior bounds of the parameters.
+
+        Returns:
+            bounds (list): (min, max) of each parameter, in the order of 
+                model_parameter_names.
+        """
+
+        return [(self.norm_min, self.norm_max)]*len(self.fe_templ) + \
+               [(self.width_min, self.width_max)]
+
+#-----------------------------------------------------------------------------#
+
+    def linear_basis(self, spectrum, parameters):
+        """
+        Returns the broadened templates, the flux for unit normalizations.
+
+        Args:
+            spectrum (Spectrum object):
+            parameters (): Parameters of the component; only fe_width is used.
+
+        Returns:
+            templates (ndarray): Array of shape (n_templates, n_pix).
+        """
+
+        return self.broadened_templates(spectrum, parameters[self.parameter_index("fe_width")])
+
+#-----------------------------------------------------------------------------#
+
+    def kernel_sigma(self, width):
+        """
+        Returns the width of the broadening kernel in pixels of each of the
+        log-binned templates.
+
+        Args:
+            width (float): FWHM of the iron lines (km/s).
+
+        Returns:
+            sigma_norm (ndarray): Kernel standard deviation for each template.
+        """
+
+        # Want to smooth and convolve in log space, since 
+        # d(log(lambda)) ~ dv/c and we can broaden based on a constant 
+        # velocity width. Compare smoothing (v/c) to bin size, and that 
+        # tells you how many bins wide your Gaussian to convolve over is
+        # sigma_conv is the width to broaden over, as given in Eqn 1 
+        # of Vestergaard and Wilkes 2001 
+        # (essentially the first line below this)
+        c_kms = c.to("km/s").value
+        sigma_conv = np.sqrt(width**2 - self.templ_width**2) / \
+                     (c_kms * 2.*np.sqrt(2.*np.log(2.)))
+
+        return np.ceil(sigma_conv / self.log_fe_bin_size)
+
+#-----------------------------------------------------------------------------#
+
+    def broadened_templates(self, spectrum, width):
+        """
+        Returns every template broadened to the given FWHM, resampled onto
+        the wavelength grid of spectrum and scaled to unit flux at the 
+        template normalization wavelength.
+
+        Args:
+            spectrum (Spectrum object): 
+            width (float): FWHM of the iron lines (km/s).
+
+        Returns:
+            templates (ndarray): Array of shape (n_templates, n_pix).
+        """
+
+        sigma_norm = self.kernel_sigma(width)
+        templates = np.zeros((len(self.fe_templ), len(spectrum.spectral_axis)))
+
+        missing = []
+        for i in range(len(self.fe_templ)):
+            cached = self.template_cache.get((i, sigma_norm[i]))
+            if cached is None:
+                missing.append(i)
+            else:
+                templates[i] = cached
+        if not missing:
+            return templates
+
+        # Convolve the remaining templates (in log space) with their gaussian 
+        # broadening kernels at once.
+        # NOTE: log_fe.spectral_axis is in log space, but flux is not!
+        log_conv_fe = gaussian_broaden(self.log_fe_fft[missing], sigma_norm[missing],
+                                       self.log_fe_nfft)
+
+        for log_conv, i in zip(log_conv_fe, missing):
+            # Shift spectrum back into linear space, rebinned onto the log
+            # wavelengths of the data; the flux is zero outside of the
+            # template.
+            # NOTE: spectrum must be on the grid given to initialize().
+            conv_fe_flux = self.resample_plans[i].dot(log_conv[:len(self.log_fe[i].flux)])
+
+            # Flux at the median wavelength of the template.
+            lo = self.norm_index[i]
+            conv_fe_norm_flux = conv_fe_flux[lo] + self.norm_weight[i] * \
+                                (conv_fe_flux[lo+1] - conv_fe_flux[lo])
+
+            # Find NaN errors early from dividing by zero.
+#TODO check below syntax vv
+            conv_fe_norm_flux = np.nan_to_num(conv_fe_norm_flux)
+
+            templates[i] = conv_fe_flux / conv_fe_norm_flux
+            self.template_cache.put((i, sigma_norm[i]), templates[i].copy())
+        return templates
+
 #-----------------------------------------------------------------------------#
 
     def flux(self, spectrum, parameters):
         """
         Returns the flux for this component for a given wavelength grid
         and parameters.  The parameters should be a list of length 
-        (2 x Number of templates)
+        (Number of templates + 1)
         
         Args:                                                                          
             spectrum (Spectrum object):                                                
@@ -265,71 +395,40 @@ class FeComponent(Component):
             flux_arrays (): ?                                                          
         """
 
-        # The next two parameters are lists of size len(self.fe_templ)
-        norm_wl = spectrum.norm_wavelength
-        c_kms = c.to("km/s").value
-        log_norm_wl = np.log(norm_wl)
         width = parameters[self.parameter_index("fe_width")]
-        self.flux_arrays = np.zeros(len(spectrum.spectral_axis)) 
-        for i in range(len(self.fe_templ)):	
-            norm_i = parameters[i]
-        
-            # Want to smooth and convolve in log space, since 
-            # d(log(lambda)) ~ dv/c and we can broaden based on a constant 
-            # velocity width. Compare smoothing (v/c) to bin size, and that 
-            # tells you how many bins wide your Gaussian to convolve over is
-            # sigma_conv is the width to broaden over, as given in Eqn 1 
-            # of Vestergaard and Wilkes 2001 
-            # (essentially the first line below this)
-            # NOTE: log_fe.spectral_axis is in log space, but flux is not!
-            sigma_conv = np.sqrt(width**2 - self.templ_width**2) / \
-                         (c_kms * 2.*np.sqrt(2.*np.log(2.)))
-
-            bin_size = self.log_fe[i].spectral_axis[2] - self.log_fe[i].spectral_axis[1]
-#TODO cross-check with Spectrum ^^
-            sigma_norm = np.ceil(sigma_conv / bin_size)
-            sigma_size = self.inputpars["fe_kernel_size_sigma"] * sigma_norm
-            kernel = signal.gaussian(sigma_size, sigma_norm) / \
-                     (np.sqrt(2 * math.pi) * sigma_norm)
-            
-#            # Convolve flux (in log space) with gaussian broadening kernel
-#            # Check to see if length of array is even. 
-#            # If it is odd, remove last index
-#            # fftwconvolution only works on even size arrays
-#            if len(self.log_fe[i].flux) % 2 != 0:
-#                self.log_fe[i].flux = self.log_fe[i].flux[:-1]
-#                self.log_fe[i].spectral_axis = self.log_fe[i].spectral_axis[:-1]
-#            log_conv_fe_flux = fftwconvolve_1d(self.log_fe[i].flux, kernel)
-        
-            log_conv_fe_flux = np.convolve(self.log_fe[i].flux, kernel,mode="same")
-#TODO need to check Spectrum.bin_spectrum()
-            # Shift spectrum back into linear space.
-            # the left and right statements just set the flux value 
-            # to zero if the specified log_norm_wl is outside the 
-            #bounds of self.log_fe[i].spectral_axis
-#            conv_fe = Spectrum.bin_spectrum(self.log_fe[i].spectral_axis,
-#                                                         log_conv_fe_flux,
-#                                                         np.log(spectrum.spectral_axis))
-            # log(convolute template flux) rebinned onto log space of data spectrum WL.
-            if self.fast_interp:
-                conv_fe_flux = np.interp(np.log(spectrum.spectral_axis),
-                                         self.log_fe[i].spectral_axis,
-                                         log_conv_fe_flux,
-                                         left=0,
-                                         right=0)
-            else:
-                conv_fe_flux = rebin_spec(self.log_fe[i].spectral_axis,
-                                     log_conv_fe_flux,
-                                     np.log(spectrum.spectral_axis))
-            
-            conv_fe_nw = np.median(self.fe_templ[i].spectral_axis)
-            conv_fe_norm_flux = np.interp(conv_fe_nw, spectrum.spectral_axis, conv_fe_flux) 
-            spectrum_norm_flux = np.interp(conv_fe_nw, spectrum.spectral_axis, spectrum.flux) 
+        norms = np.asarray(parameters[:len(self.fe_templ)])
 
-            # Find NaN errors early from dividing by zero.
-#TODO check below syntax vv
-            conv_fe_norm_flux = np.nan_to_num(conv_fe_norm_flux)
-
-            # Scale normalization parameter to flux in template
-            self.flux_arrays += (norm_i / conv_fe_norm_flux) * conv_fe_flux
+        # Scale normalization parameter to flux in template
+        self.flux_arrays = np.dot(norms, self.broadened_templates(spectrum, width))
         return self.flux_arrays
+
+#-----------------------------------------------------------------------------#
+
+    def flux_batch(self, spectrum, parameters):
+        """
+        Returns the flux for this component for a batch of parameter vectors.
+        The broadened templates are computed once per distinct kernel.
+
+        Args:
+            spectrum (Spectrum object):
+            parameters (ndarray): 2D array of shape (n_walkers, n_templates + 1).
+
+        Returns:
+            flux_arrays (ndarray): Array of shape (n_walkers, n_pix).
+        """
+
+        parameters = np.atleast_2d(parameters)
+        widths = parameters[:, self.parameter_index("fe_width")]
+        norms = parameters[:, :len(self.fe_templ)]
+
+        # Walkers whose kernels round to the same widths in pixels share
+        # their broadened templates, so group on the kernels themselves.
+        _, first, inverse = np.unique(self.kernel_sigma(widths[:, None]), axis=0,
+                                      return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+
+        flux_arrays = np.zeros((len(parameters), len(spectrum.spectral_axis)))
+        for j, row in enumerate(first):
+            rows = inverse == j
+            flux_arrays[rows] = np.dot(norms[rows], self.broadened_templates(spectrum, widths[row]))
+        return flux_arrays
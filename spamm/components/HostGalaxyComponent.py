@@ -1,28 +1,20 @@
 #!/usr/bin/python
 
-import re
-import sys
 import numpy as np
-import scipy.interpolate
-import numpy as np
-import scipy.integrate
-from scipy import signal
-from astropy.convolution import Gaussian1DKernel, convolve
-import warnings
-import math
 from astropy.constants import c
 import glob
 import os
 
 from utils.runningmeanfast import runningMeanFast
-from utils.gaussian_kernel import gaussian_kernel
-from utils.fftwconvolve_1d import fftwconvolve_1d
-from utils.find_nearest_index import find_nearest
-from utils.parse_pars import parse_pars
+from utils.parse_pars import parse_pars, DEFAULT_PARS
 from utils.rebin_spec import rebin_spec
+from utils.interp_matrix import interp_weights
+from utils.gaussian_broaden import template_ffts, gaussian_broaden, PAD_SIGMA
+from utils.lru_cache import LRUCache
+from utils.template_library import load_template_library
 
 from .ComponentBase import Component
-from ..Spectrum import Spectrum
+from ..Spectrum import SlimSpectrum
 
 #-----------------------------------------------------------------------------#
 
@@ -36,7 +28,7 @@ class HostGalaxyComponent(Component):
         stellar line dispersion: \f$ \sig_* \f$
 
     Attributes:
-        host_gal (list): List of Spectrum objects for each template file.
+        host_gal (list): List of Template objects for each template file.
         interp_host (list): 
         interp_norm_flux (list):
 #TODO should name be in Component?
@@ -58,6 +50,7 @@ class HostGalaxyComponent(Component):
         self.load_templates()
         self.model_parameter_names = ["hg_norm_{}".format(x) for x in range(1, len(self.host_gal)+1)]
         self.model_parameter_names.append("hg_stellar_disp")
+        self.linear_parameter_names = self.model_parameter_names[:-1]
         self.interp_host = [] 
         self.interp_host_norm_flux = []
         self.name = "HostGalaxy"
@@ -88,20 +81,18 @@ class HostGalaxyComponent(Component):
 #-----------------------------------------------------------------------------#
 
     def load_templates(self):
-        """Read in all of the host galaxy models."""
+        """
+        Read in all of the host galaxy models. The text files are only 
+        parsed the first time; after that they are memory-mapped from a 
+        binary copy (see utils.template_library).
+        """
 
-        template_list = glob.glob(os.path.join(self.inputpars["hg_models"], "*"))
+        template_list = sorted(glob.glob(os.path.join(self.inputpars["hg_models"], "*")))
         assert len(template_list) != 0, \
         "No host galaxy templates found in specified diretory {0}".format(self.inputpars["hg_models"])
     
-        self.host_gal = []
-    
-        for template_filename in template_list:
-            with open(template_filename) as template_file:
-                wavelengths, flux = np.loadtxt(template_filename, unpack=True)
-                flux = np.where(flux<0, 1e-19, flux)
-                host = Spectrum(spectral_axis=wavelengths, flux=flux, flux_error=flux)
-                self.host_gal.append(host)
+        # Negative fluxes are replaced by 1e-19.
+        self.host_gal = load_template_library(template_list, negative_flux=1e-19)
 
 #-----------------------------------------------------------------------------#
 
@@ -166,6 +157,8 @@ class HostGalaxyComponent(Component):
         # velocity space, so rebin to equal log bins
         # log_host.wavelength is in log space but flux is not
         self.log_host = []
+        self.interp_host = []
+        self.interp_host_norm_flux = []
 
         nw = data_spectrum.norm_wavelength
 
@@ -184,7 +177,7 @@ class HostGalaxyComponent(Component):
                                            template.flux, 
                                            log_host_wl)
 
-            log_host_spectrum = Spectrum(spectral_axis=log_host_wl, flux=log_host_flux, flux_error=log_host_flux)
+            log_host_spectrum = SlimSpectrum(spectral_axis=log_host_wl, flux=log_host_flux)
             self.log_host.append(log_host_spectrum)
             
             if self.fast_interp:
@@ -205,6 +198,30 @@ class HostGalaxyComponent(Component):
                                                         left=0,
                                                         right=0))
 
+        # Precompute the FFTs of the log-binned templates. The zero padding
+        # must cover the widest kernel allowed by the prior so that flux 
+        # does not wrap around between the ends of a template, to at least
+        # PAD_SIGMA standard deviations.
+        self.log_host_bin_size = np.array([log_host.spectral_axis[2] - log_host.spectral_axis[1]
+                                           for log_host in self.log_host])
+        pad = np.ceil(max(self.inputpars["hg_kernel_size_sigma"], PAD_SIGMA) * \
+                      max(self.kernel_sigma(self.stellar_disp_max)))
+        self.log_host_fft, self.log_host_nfft = template_ffts([log_host.flux for log_host in self.log_host], pad)
+
+        # Resampling the broadened templates from their log grids onto the
+        # data and finding their flux at the normalization wavelength do not
+        # depend on the parameters, so precompute the operators.
+        log_wavelengths = np.log(data_spectrum.spectral_axis)
+        self.resample_plans = [self.resampling_matrix(log_host.spectral_axis, log_wavelengths)
+                               for log_host in self.log_host]
+        self.norm_index, self.norm_weight = interp_weights(data_spectrum.spectral_axis,
+            [np.median(template.spectral_axis) for template in self.host_gal])
+
+        # Broadened templates only change when the kernel width changes by a
+        # whole pixel, so cache them on the data grid.
+        self.template_cache = LRUCache(self.inputpars.get("hg_cache_size", 
+                                                          DEFAULT_PARS["host_galaxy"]["hg_cache_size"]))
+
 #-----------------------------------------------------------------------------#
 
     def ln_priors(self, params):
@@ -251,92 +268,171 @@ class HostGalaxyComponent(Component):
 
 #-----------------------------------------------------------------------------#
 
-    def flux(self, spectrum, parameters):
+    def bounds(self):
         """
-        Returns the flux for this component for a given wavelength grid
-        and parameters. Will use the initial parameters if none are specified.
+        Prior bounds of the parameters.
+
+        Returns:
+            bounds (list): (min, max) of each parameter, in the order of 
+                model_parameter_names.
+        """
+
+        return [(self.norm_min, self.norm_max)]*len(self.host_gal) + \
+               [(self.stellar_disp_min, self.stellar_disp_max)]
+
+#-----------------------------------------------------------------------------#
+
+    def linear_basis(self, spectrum, parameters):
+        """
+        Returns the broadened templates, the flux for unit normalizations.
+
+        Args:
+            spectrum (Spectrum object):
+            parameters (): Parameters of the component; only hg_stellar_disp
+                is used.
+
+        Returns: 
+            templates (ndarray): Array of shape (n_templates, n_pix).
+        """
+
+        return self.broadened_templates(spectrum, parameters[self.parameter_index("hg_stellar_disp")])
+
+#-----------------------------------------------------------------------------#
+
+    def kernel_sigma(self, stellar_disp):
+        """
+        Returns the width of the broadening kernel in pixels of each of the
+        log-binned templates.
+
+        Args:
+            stellar_disp (float): Stellar velocity dispersion (km/s).
+
+        Returns: 
+            sigma_norm (ndarray): Kernel standard deviation for each template.
+        """
+
+        # Want to smooth and convolve in log space, since 
+        # d(log(lambda)) ~ dv/c and we can broaden based on a constant 
+        # velocity width. Compare smoothing (v/c) to bin size, and that 
+        # tells you how many bins wide your Gaussian to convolve over is
+        # sigma_conv is the width to broaden over, as given in Eqn 1 
+        # of Vestergaard and Wilkes 2001 
+        # (essentially the first line below this)
+        c_kms = c.to("km/s").value
+        sigma_conv = np.sqrt(stellar_disp**2 - self.templ_stellar_disp**2) /\
+                             (c_kms * 2.*np.sqrt(2.*np.log(2.)))
+
+        return np.ceil(sigma_conv / self.log_host_bin_size)
+
+#-----------------------------------------------------------------------------#
+
+    def broadened_templates(self, spectrum, stellar_disp):
+        """
+        Returns every template broadened to the given stellar velocity
+        dispersion, resampled onto the wavelength grid of spectrum and scaled 
+        to unit flux at the template normalization wavelength.
 
         Args:
             spectrum (Spectrum object): 
-            parameters (): ?
+            stellar_disp (float): Stellar velocity dispersion (km/s).
 
         Returns: 
-            flux_arrays (): ?
+            templates (ndarray): Array of shape (n_templates, n_pix).
         """
-        
+
         #Convolve to increase the velocity dispersion. Need to
         #consider it as an excess dispersion above that which
         #is intrinsic to the template. For the moment, the
         #implicit assumption is that each template has an
         #intrinsic velocity dispersion = 0 km/s.
-        
-        # The next two parameters are lists of size len(self.host_gal)
-        norm_wl = spectrum.norm_wavelength
-        c_kms = c.to("km/s").value
-        log_norm_wl = np.log(norm_wl)
-# TODO, check on handling of dispersions
-        stellar_disp = parameters[self.parameter_index("hg_stellar_disp")]
-        self.flux_arrays = np.zeros(len(spectrum.spectral_axis))
+        sigma_norm = self.kernel_sigma(stellar_disp)
+        templates = np.zeros((len(self.host_gal), len(spectrum.spectral_axis)))
 
-            
+        missing = []
         for i in range(len(self.host_gal)):
-            norm_i = parameters[i]
-            # Want to smooth and convolve in log space, since 
-            # d(log(lambda)) ~ dv/c and we can broaden based on a constant 
-            # velocity width. Compare smoothing (v/c) to bin size, and that 
-            # tells you how many bins wide your Gaussian to convolve over is
-            # sigma_conv is the width to broaden over, as given in Eqn 1 
-            # of Vestergaard and Wilkes 2001 
-            # (essentially the first line below this)
-            # NOTE: log_host.spectral_axis is in log space, but flux is not!
-            sigma_conv = np.sqrt(stellar_disp**2 - self.templ_stellar_disp**2) /\
-                                 (c_kms * 2.*np.sqrt(2.*np.log(2.)))
-           
-            bin_size = self.log_host[i].spectral_axis[2] - self.log_host[i].spectral_axis[1]
-#TODO cross-check with Spectrum ^^
-            sigma_norm = np.ceil(sigma_conv / bin_size)
-            sigma_size = self.inputpars["hg_kernel_size_sigma"] * sigma_norm
-            kernel = signal.gaussian(sigma_size, sigma_norm) / \
-                     (np.sqrt(2 * math.pi) * sigma_norm)
-
-#            # Check to see if length of array is even. 
-#            # If it is odd, remove last index
-#            # fftwconvolution only works on even size arrays
-#            if len(self.log_host[i].flux) % 2 != 0: 
-#                self.log_host[i].flux = self.log_host[i].flux[:-1]
-#                self.log_host[i].spectral_axis = self.log_host[i].spectral_axis[:-1]
-#            # Convolve flux (in log space) with gaussian broadening kernel
-#            log_conv_host_flux = fftwconvolve_1d(self.log_host[i].flux, kernel)
-
-            log_conv_host_flux = np.convolve(self.log_host[i].flux, kernel, mode="same")
-#TODO need to check Spectrum.bin_spectrum()
-#            # Shift spectrum back into linear space.
-#            # the left and right statements just set the flux value 
-#            # to zero if the specified log_norm_wl is outside the 
-#            #bounds of self.log_host[i].spectral_axis
-#            conv_host = Spectrum.bin_spectrum(self.log_host[i].spectral_axis,
-#                                                         log_conv_host_flux,
-#                                                         np.log(spectrum.spectral_axis))
-#            conv_host_norm_flux = conv_host.norm_wavelength_flux
-
-            if self.fast_interp:
-                conv_host_flux = np.interp(np.log(spectrum.spectral_axis),
-                                           self.log_host[i].spectral_axis,
-                                           log_conv_host_flux)
+            cached = self.template_cache.get((i, sigma_norm[i]))
+            if cached is None:
+                missing.append(i)
             else:
-                conv_host_flux = rebin_spec(self.log_host[i].spectral_axis,
-                                            log_conv_host_flux,
-                                            np.log(spectrum.spectral_axis))
-            conv_host_nw = np.median(self.host_gal[i].spectral_axis)
-            conv_host_norm_flux = np.interp(conv_host_nw, spectrum.spectral_axis, conv_host_flux)
-            spectrum_norm_flux = np.interp(conv_host_nw, spectrum.spectral_axis, spectrum.flux)
+                templates[i] = cached
+        if not missing:
+            return templates
+
+        # NOTE: log_host.spectral_axis is in log space, but flux is not!
+        log_conv_host = gaussian_broaden(self.log_host_fft[missing], sigma_norm[missing],
+                                         self.log_host_nfft)
+
+        for log_conv, i in zip(log_conv_host, missing):
+            # Rebin onto the log wavelengths of the data.
+            # NOTE: spectrum must be on the grid given to initialize().
+            conv_host_flux = self.resample_plans[i].dot(log_conv[:len(self.log_host[i].flux)])
+
+            # Flux at the median wavelength of the template.
+            lo = self.norm_index[i]
+            conv_host_norm_flux = conv_host_flux[lo] + self.norm_weight[i] * \
+                                  (conv_host_flux[lo+1] - conv_host_flux[lo])
             
             # Find NaN errors early from dividing by zero.
 #TODO check below syntax vv
             conv_host_norm_flux = np.nan_to_num(conv_host_norm_flux)
             
-            # Scale normalization parameter to flux in template
-            self.flux_arrays += (norm_i / conv_host_norm_flux) * conv_host_flux
+            templates[i] = conv_host_flux / conv_host_norm_flux
+            self.template_cache.put((i, sigma_norm[i]), templates[i].copy())
+
+        return templates
+
+#-----------------------------------------------------------------------------#
+
+    def flux(self, spectrum, parameters):
+        """
+        Returns the flux for this component for a given wavelength grid
+        and parameters. Will use the initial parameters if none are specified.
+
+        Args:
+            spectrum (Spectrum object): 
+            parameters (): ?
+
+        Returns: 
+            flux_arrays (): ?
+        """
+        
+# TODO, check on handling of dispersions
+        stellar_disp = parameters[self.parameter_index("hg_stellar_disp")]
+        norms = np.asarray(parameters[:len(self.host_gal)])
+
+        # Scale normalization parameter to flux in template
+        self.flux_arrays = np.dot(norms, self.broadened_templates(spectrum, stellar_disp))
 
         return self.flux_arrays
 
+#-----------------------------------------------------------------------------#
+
+    def flux_batch(self, spectrum, parameters):
+        """
+        Returns the flux for this component for a batch of parameter vectors.
+        The broadened templates are computed once per distinct kernel.
+
+        Args:
+            spectrum (Spectrum object):
+            parameters (ndarray): 2D array of shape (n_walkers, n_templates + 1).
+
+        Returns:
+            flux_arrays (ndarray): Array of shape (n_walkers, n_pix).
+        """
+
+        parameters = np.atleast_2d(parameters)
+        dispersions = parameters[:, self.parameter_index("hg_stellar_disp")]
+        norms = parameters[:, :len(self.host_gal)]
+
+        # Walkers whose kernels round to the same widths in pixels share
+        # their broadened templates, so group on the kernels themselves.
+        _, first, inverse = np.unique(self.kernel_sigma(dispersions[:, None]), axis=0,
+                                      return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+
+        flux_arrays = np.zeros((len(parameters), len(spectrum.spectral_axis)))
+        for j, row in enumerate(first):
+            rows = inverse == j
+            flux_arrays[rows] = np.dot(norms[rows], self.broadened_templates(spectrum, dispersions[row]))
+        return flux_arrays
+
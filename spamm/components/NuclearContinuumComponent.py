@@ -56,6 +56,7 @@ class NuclearContinuumComponent(Component):
             self.model_parameter_names.append("norm_PL")
             self.model_parameter_names.append("slope1")
             self.model_parameter_names.append("slope2")
+        self.linear_parameter_names = ["norm_PL"]
 
         self.norm_min = self.inputpars["pl_norm_min"]
         self.norm_max = self.inputpars["pl_norm_max"]
@@ -171,6 +172,27 @@ class NuclearContinuumComponent(Component):
 
         return ln_priors
 
+#-----------------------------------------------------------------------------#
+
+    def bounds(self):
+        """
+        Prior bounds of the parameters.
+
+        Returns:
+            bounds (list): (min, max) of each parameter, in the order of 
+                model_parameter_names.
+        """
+
+        bounds = []
+        if self.broken_pl:
+            bounds.append((self.wave_break_min, self.wave_break_max))
+        bounds.append((self.norm_min, self.norm_max))
+        bounds.append((self.slope_min, self.slope_max))
+        if self.broken_pl:
+            bounds.append((self.slope_min, self.slope_max))
+
+        return bounds
+
 #-----------------------------------------------------------------------------#
 
     def flux(self, spectrum, parameters=None):
@@ -199,3 +221,35 @@ class NuclearContinuumComponent(Component):
             PL = BrokenPowerLaw1D(norm, x_break, slope1, slope2)
         flux = PL(spectrum.spectral_axis)
         return flux
+
+#-----------------------------------------------------------------------------#
+
+    def flux_batch(self, spectrum, parameters):
+        """
+        Compute the flux for this component for a batch of parameter vectors.
+        This evaluates the same power law as flux() with NumPy broadcasting
+        instead of one astropy model per walker.
+
+        Args:
+            spectrum (Spectrum object): ?
+            parameters (ndarray): 2D array of shape (n_walkers, n_parameters).
+
+        Return:
+            flux (ndarray): Array of shape (n_walkers, n_pix).
+        """
+
+        parameters = np.atleast_2d(parameters)
+        assert parameters.shape[1] == len(self.model_parameter_names), \
+            "The wrong number of indices were provided: {0}".format(parameters.shape)
+
+        wavelengths = np.asarray(spectrum.spectral_axis)
+        norm = parameters[:, self.parameter_index("norm_PL"), np.newaxis]
+        slope1 = parameters[:, self.parameter_index("slope1"), np.newaxis]
+        if not self.broken_pl:
+            flux = norm * (wavelengths / spectrum.norm_wavelength)**(-slope1)
+        else:
+            x_break = parameters[:, self.parameter_index("wave_break"), np.newaxis]
+            slope2 = parameters[:, self.parameter_index("slope2"), np.newaxis]
+            slope = np.where(wavelengths < x_break, slope1, slope2)
+            flux = norm * (wavelengths / x_break)**(-slope)
+        return flux
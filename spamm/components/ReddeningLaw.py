@@ -4,26 +4,24 @@ import sys
 import numpy as np
 from .ComponentBase import Component
 
+def Calzetti_k(wavelengths):
+    '''Calzetti et al. 2000 starburst reddening curve k(lambda). Zero outside 0.12-2.2 micrometres.'''
+    wavelengths_um = np.asarray(wavelengths, dtype=float)/10000.
+    k = np.zeros(len(wavelengths_um))
+    Rv = 4.05
+    blue = (wavelengths_um >= 0.12) & (wavelengths_um < 0.63)
+    red = (wavelengths_um >= 0.63) & (wavelengths_um <= 2.2)
+    k[blue] = 2.659*(-1.857+1.040/wavelengths_um[blue])+4.05
+    k[red] = 2.659*(-2.156+1.509/wavelengths_um[red]-0.198/wavelengths_um[red]**2+0.11/wavelengths_um[red]**3)+4.05
+    return k
+
 def Calzetti_ext(spectrum=None, parameters=None):
     if spectrum is None:
         raise Exception("Need a data spectrum")
-    ext= [1.]*len(spectrum.spectral_axis)
-    Rv = 4.05
-    for j in range(len(spectrum.spectral_axis)):
-        wavelengths_um = spectrum.spectral_axis[j]/10000.
-        if (wavelengths_um >= 0.12) & (wavelengths_um < 0.63):
-            k = 2.659*(-1.857+1.040/wavelengths_um)+4.05
-            ext[j] = pow(10,-0.4*parameters[0]*k)
-        if (wavelengths_um >= 0.63) & (wavelengths_um <= 2.2):
-            k = 2.659*(-2.156+1.509/wavelengths_um-0.198/pow(wavelengths_um,2)+0.11/pow(wavelengths_um,3))+4.05
-            ext[j] = pow(10,-0.4*parameters[0]*k)
-    return ext
+    return pow(10,-0.4*parameters[0]*Calzetti_k(spectrum.spectral_axis))
     
-def LMC_Fitzpatrick_ext(spectrum=None, parameters=None): #Fitzpatrick 1986
-    '''Large Magellanic Cloud extinction curve defined in Fitzpatrick 1986'''
-    if spectrum is None:
-        raise Exception("Need a data spectrum")
-    ext= [1.]*len(spectrum.spectral_axis)
+def LMC_Fitzpatrick_k(wavelengths): #Fitzpatrick 1986
+    '''Large Magellanic Cloud reddening curve k(lambda) defined in Fitzpatrick 1986'''
     C1 = -0.69
     C2 = 0.89 #micrometres
     C3 = 2.55 #micrometres^-2
@@ -31,78 +29,68 @@ def LMC_Fitzpatrick_ext(spectrum=None, parameters=None): #Fitzpatrick 1986
     gamma = 0.994 #micrometres^-1
     Rv = 3.1
     
-    for j in range(len(spectrum.spectral_axis)):
-        wavelengths_um = spectrum.spectral_axis[j]/10000.
-        x = pow(wavelengths_um,-1)
-        x2 = pow(x,2)
-        D = x2/(pow(x2-pow(x_0,2),2)+x2*pow(gamma,2))
-        F = 0.5392*pow((x-5.9),2)+0.05644*pow((x-5.9),3)
-        if (x >= 5.9):
-            C4 = 0.50 #micrometres^-1 
-        else:
-            C4 =0.0
-        k = C1+Rv+C2*x+C3*x*D+C4*F
-        ext[j] = pow(10,-0.4*parameters[0]*k)
-    return ext
-    
-def MW_Seaton_ext(spectrum=None, parameters=None): #Seaton 1979
-    '''Milky Way extinction curve defined in Seaton 1979'''
+    wavelengths_um = np.asarray(wavelengths, dtype=float)/10000.
+    x = 1./wavelengths_um
+    x2 = x**2
+    D = x2/((x2-x_0**2)**2+x2*gamma**2)
+    F = 0.5392*(x-5.9)**2+0.05644*(x-5.9)**3
+    C4 = np.where(x >= 5.9, 0.50, 0.0) #micrometres^-1 
+    return C1+Rv+C2*x+C3*x*D+C4*F
+
+def LMC_Fitzpatrick_ext(spectrum=None, parameters=None): #Fitzpatrick 1986
+    '''Large Magellanic Cloud extinction curve defined in Fitzpatrick 1986'''
     if spectrum is None:
         raise Exception("Need a data spectrum")
-    ext= [1.]*len(spectrum.spectral_axis)
+    return pow(10,-0.4*parameters[0]*LMC_Fitzpatrick_k(spectrum.spectral_axis))
+    
+def MW_Seaton_k(wavelengths): #Seaton 1979
+    '''Milky Way reddening curve k(lambda) defined in Seaton 1979'''
     C1 = -0.38
     C2 = 0.74 #micrometres
     C3 = 3.96 #micrometres^-2
-    C4 = 0.26 #micrometres^-1
     x_0 = 4.595 #micrometres^-1
     gamma = 1.051 #micrometres^-1
     Rv = 3.1
-    for j in range(len(spectrum.spectral_axis)):
-        wavelengths_um = spectrum.spectral_axis[j]/10000.
-        x = pow(wavelengths_um,-1)
-        x2 = pow(x,2)
-        D = x2/(pow(x2-pow(x_0,2),2)+x2*pow(gamma,2))
-        F = 0.5392*pow((x-5.9),2)+0.05644*pow((x-5.9),3)
-        if (x >= 5.9):
-            C4 = 0.26 #micrometres^-1 
-        else:
-            C4 =0.0
-        k = C1+Rv+C2*x+C3*x*D+C4*F
-        ext[j] = pow(10,-0.4*parameters[0]*k)
-    return ext
-    
-def SMC_Gordon_ext(spectrum=None, parameters=None): #Gordon 2003
-    '''Small Magellanic Cloud extinction curve defined in Gordon 2003'''
+
+    wavelengths_um = np.asarray(wavelengths, dtype=float)/10000.
+    x = 1./wavelengths_um
+    x2 = x**2
+    D = x2/((x2-x_0**2)**2+x2*gamma**2)
+    F = 0.5392*(x-5.9)**2+0.05644*(x-5.9)**3
+    C4 = np.where(x >= 5.9, 0.26, 0.0) #micrometres^-1 
+    return C1+Rv+C2*x+C3*x*D+C4*F
+
+def MW_Seaton_ext(spectrum=None, parameters=None): #Seaton 1979
+    '''Milky Way extinction curve defined in Seaton 1979'''
     if spectrum is None:
         raise Exception("Need a data spectrum")
-    ext= [1.]*len(spectrum.spectral_axis)
+    return pow(10,-0.4*parameters[0]*MW_Seaton_k(spectrum.spectral_axis))
+    
+def SMC_Gordon_k(wavelengths): #Gordon 2003
+    '''Small Magellanic Cloud reddening curve k(lambda) defined in Gordon 2003'''
     C1 = -4.96
     C2 = 2.26 #micrometres
     C3 = 0.39 #micrometres^-2
-    C4 = 0.46 #micrometres^-1
     x_0 = 4.6 #micrometres^-1
     gamma = 1.0 #micrometres^-1
     Rv = 2.74
-    for j in range(len(spectrum.spectral_axis)):
-        wavelengths_um = spectrum.spectral_axis[j]/10000.
-        x = pow(wavelengths_um,-1)
-        x2 = pow(x,2)
-        D = x2/(pow(x2-pow(x_0,2),2)+x2*pow(gamma,2))
-        F = 0.5392*pow((x-5.9),2)+0.05644*pow((x-5.9),3)
-        if (x >= 5.9):
-            C4 = 0.26 #micrometres^-1 
-        else:
-            C4 =0.0
-        k = C1+Rv+C2*x+C3*x*D+C4*F
-        ext[j] = pow(10,-0.4*parameters[0]*k)
-    return np.array(ext)
-    
-def AGN_Gaskell_ext(spectrum=None, parameters=None): #Gaskell and Benker 2007
-    '''Active galactic nuclei extinction curve defined in Gaskell and Benker 2007.
-            Much flatter than galactic extinction curves.'''
+
+    wavelengths_um = np.asarray(wavelengths, dtype=float)/10000.
+    x = 1./wavelengths_um
+    x2 = x**2
+    D = x2/((x2-x_0**2)**2+x2*gamma**2)
+    F = 0.5392*(x-5.9)**2+0.05644*(x-5.9)**3
+    C4 = np.where(x >= 5.9, 0.26, 0.0) #micrometres^-1 
+    return C1+Rv+C2*x+C3*x*D+C4*F
+
+def SMC_Gordon_ext(spectrum=None, parameters=None): #Gordon 2003
+    '''Small Magellanic Cloud extinction curve defined in Gordon 2003'''
     if spectrum is None:
         raise Exception("Need a data spectrum")
-    ext = [1.]*len(spectrum.spectral_axis)
+    return pow(10,-0.4*parameters[0]*SMC_Gordon_k(spectrum.spectral_axis))
+    
+def AGN_Gaskell_k(wavelengths): #Gaskell and Benker 2007
+    '''Active galactic nuclei reddening curve k(lambda) defined in Gaskell and Benker 2007.'''
     A = 0.000843
     B = -0.02496
     C = 0.2919
@@ -110,17 +98,16 @@ def AGN_Gaskell_ext(spectrum=None, parameters=None): #Gaskell and Benker 2007
     E = 6.83
     F = -7.92
     Rv = 5.0
-    #for j in range(len(spectrum.spectral_axis)):
-    #    wavelengths_um = spectrum.spectral_axis[j]/10000.
-    #    x = pow(wavelengths_um,-1)
-    #    if (x>=1.5) & (x<8):
-    #        k = A*pow(x,5)+B*pow(x,4)+C*pow(x,3)+D*pow(x,2)+E*x+F+Rv
-    #        ext[j] = pow(10,-0.4*parameters[0]*k)
-    wavelengths_um = np.array(spectrum.spectral_axis/10000.)
-    x = pow(wavelengths_um,-1)
-    k = A*x**5+B*x**4+C*x**3+D*x**2+E*x+F+Rv
-    ext = pow(10,-0.4*parameters[0]*k)
-    return ext#np.array(ext)
+    wavelengths_um = np.asarray(wavelengths, dtype=float)/10000.
+    x = 1./wavelengths_um
+    return A*x**5+B*x**4+C*x**3+D*x**2+E*x+F+Rv
+
+def AGN_Gaskell_ext(spectrum=None, parameters=None): #Gaskell and Benker 2007
+    '''Active galactic nuclei extinction curve defined in Gaskell and Benker 2007.
+            Much flatter than galactic extinction curves.'''
+    if spectrum is None:
+        raise Exception("Need a data spectrum")
+    return pow(10,-0.4*parameters[0]*AGN_Gaskell_k(spectrum.spectral_axis))
         
 
 class Extinction(Component):
@@ -145,7 +132,8 @@ class Extinction(Component):
 
         
         self._k = None
-        
+        self._k_wavelengths = None
+
     @property
     def is_analytic(self):
         return True
@@ -184,7 +172,52 @@ class Extinction(Component):
             ln_priors.append(-np.inf)
             
         return ln_priors
+
+    def bounds(self):
+        '''
+        Prior bounds of the parameters, in the order of model_parameter_names.
+        '''
+
+        return [(self.EBV_min, self.EBV_max)]
     
+    def reddening_curve(self, wavelengths):
+        '''
+        Returns k(lambda) of the selected extinction law. If more than one
+        law is selected, the last one in the order MW, AGN, LMC, SMC,
+        Calzetti is used. With no law selected k(lambda) is zero.
+        '''
+        k = np.zeros(len(wavelengths))
+        if self.MW:
+            k = MW_Seaton_k(wavelengths)
+        if self.AGN:
+            k = AGN_Gaskell_k(wavelengths)
+        if self.LMC:
+            k = LMC_Fitzpatrick_k(wavelengths)
+        if self.SMC:
+            k = SMC_Gordon_k(wavelengths)
+        if self.Calzetti:
+            k = Calzetti_k(wavelengths)
+        return k
+
+    def initialize(self, data_spectrum=None):
+        '''
+        Precompute k(lambda) on the data wavelength grid. E(B-V) is the only
+        free parameter, so the curve itself never changes during a fit.
+        '''
+        self._k_wavelengths = np.array(data_spectrum.spectral_axis, dtype=float)
+        self._k = self.reddening_curve(self._k_wavelengths)
+
+    def _reddening_curve_for(self, spectrum):
+        ''' 
+        Return the precomputed k(lambda), recomputing it if spectrum is on 
+        another grid. The grids are compared by value, on a copy of the 
+        wavelengths k was computed for, so that an equal grid in another 
+        array reuses k and a grid modified in place does not.
+        '''
+        if self._k is None or not np.array_equal(spectrum.spectral_axis, self._k_wavelengths):
+            self.initialize(data_spectrum=spectrum)
+        return self._k
+
     def flux(self, spectrum=None):
         '''
         Returns the flux for this component for a given wavelength grid
@@ -196,21 +229,25 @@ class Extinction(Component):
     
     def extinction(self, spectrum=None, params=None):
         EBV = params[self.parameter_index("E(B-V)")]
-        parameters = [EBV]
         if spectrum is None:
             raise Exception("Need a data spectrum")
             sys.exit()
-        if self.MW:
-            ext = MW_Seaton_ext(spectrum=spectrum, parameters=parameters)
-        if self.AGN:
-            ext = AGN_Gaskell_ext(spectrum=spectrum, parameters=parameters)
-        if self.LMC:
-            ext = LMC_Fitzpatrick_ext(spectrum=spectrum, parameters=parameters)
-        if self.SMC:
-            ext = SMC_Gordon_ext(spectrum=spectrum, parameters=parameters)
-        if self.Calzetti:
-            ext = Calzetti_ext(spectrum=spectrum, parameters=parameters)
-        if (not self.MW) & (not self.AGN) & (not self.LMC) & (not self.SMC) & (not self.Calzetti):
-            ext = [1.]*len(spectrum.spectral_axis)
-        return ext
+        return pow(10, -0.4*EBV*self._reddening_curve_for(spectrum))
+
+    def flux_batch(self, spectrum=None, parameters=None):
+        '''
+        Returns the (zero) flux of this component for a batch of parameter vectors.
+        '''
+        parameters = np.atleast_2d(parameters)
+        return np.zeros((len(parameters), len(spectrum.spectral_axis)))
 
+    def extinction_batch(self, spectrum=None, params=None):
+        '''
+        Returns the extinction curves for a batch of parameter vectors as an
+        array of shape (n_walkers, n_pix).
+        '''
+        params = np.atleast_2d(params)
+        if spectrum is None:
+            raise Exception("Need a data spectrum")
+        EBV = params[:, self.parameter_index("E(B-V)"), np.newaxis]
+        return pow(10, -0.4*EBV*self._reddening_curve_for(spectrum))
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+import numpy as np
+
+from utils.parse_pars import parse_pars
+from spamm.components.BalmerContinuumCombined import BalmerCombined
+
+C_KMS = 299792.458
+
+# Wavelength grids, and line parameters: T, log(n_e), offset and width in km/s.
+GRIDS = [np.linspace(3000., 5500., 2500), np.linspace(3400., 4200., 8000)]
+LINES = [(1e4, 9., 0., 1000.), (3e4, 5., 300., 300.), (8e3, 3., -500., 5000.)]
+
+def _component(line_type, **pars):
+    inputpars = parse_pars()["balmer_continuum"]
+    inputpars["bc_line_type"] = line_type
+    inputpars.update(pars)
+    return BalmerCombined(pars=inputpars, BalmerPseudocContinuum=True)
+
+def _full_sum(component, wavelengths, T, n_e, shift, width):
+    ''' Every line on every pixel, as makelines did before it was windowed. '''
+
+    line_orders = np.arange(component.inputpars["bc_lines_min"], component.inputpars["bc_lines_max"])
+    lcenter = component.balmerseries(line_orders)
+    lcenter -= shift*lcenter
+    LL = wavelengths - lcenter.reshape(lcenter.size, 1)
+    lwidth = width*lcenter.reshape(lcenter.size, 1)
+    if component.inputpars["bc_line_type"] == "gaussian":
+        lines = np.exp(- LL**2 /lwidth**2)
+    else:
+        lines = lwidth / (LL**2 + lwidth**2)
+    lflux = component.balmer_ratio(n_e, line_orders, T)
+    return np.sum(lines * lflux.reshape(lflux.size, 1), axis=0)
+
+def _max_error(makelines, component):
+    ''' Largest difference from the full sum, relative to its peak, over GRIDS and LINES. '''
+
+    error = 0.
+    for wavelengths in GRIDS:
+        for T, logNe, offset, width in LINES:
+            args = (wavelengths, T, 10.**logNe, offset / C_KMS, width / C_KMS)
+            expected = _full_sum(component, *args)
+            error = max(error, np.max(np.abs(makelines(*args) - expected)) / np.max(expected))
+    return error
+
+def test_window():
+    '''
+    The windowed sum leaves out the line wings beyond bc_line_window (50)
+    widths: nothing for gaussian lines, and at most 2e-3 of the peak for
+    lorentzian lines, whose wings are 1/(1+50^2) of their peak.
+    '''
+
+    component = _component("gaussian")
+    assert _max_error(component.makelines, component) < 1e-12
+    component = _component("lorentzian")
+    assert _max_error(component.makelines, component) < 2e-3
+
+def test_no_window():
+    ''' With bc_line_window 0 every line covers every pixel. '''
+
+    for line_type in ("gaussian", "lorentzian"):
+        component = _component(line_type, bc_line_window=0)
+        assert _max_error(component.makelines, component) < 1e-12
+
+def test_fft():
+    '''
+    The FFT line series is within 2% of the peak of the full sum. It is
+    accurate to first order in the line width, and is interpolated from
+    the ln(lambda) grid, which dominates for lines as narrow as a pixel.
+    '''
+
+    for line_type in ("gaussian", "lorentzian"):
+        component = _component(line_type, bc_line_method="fft")
+        assert _max_error(component.makelines_fft, component) < 2e-2
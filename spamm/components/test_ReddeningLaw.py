@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from spamm.components.ReddeningLaw import Extinction, Calzetti_ext, LMC_Fitzpatrick_ext, \
+    MW_Seaton_ext, SMC_Gordon_ext, AGN_Gaskell_ext
+
+# 1000 A to 3 micrometres, across the bumps and the range edges of the laws.
+WAVELENGTHS = np.linspace(1000., 30000., 2901)
+
+def _calzetti_loop(wavelengths, EBV):
+    ''' The per-pixel loop the vectorized Calzetti_ext replaced. '''
+
+    ext = [1.]*len(wavelengths)
+    for j in range(len(wavelengths)):
+        wavelengths_um = wavelengths[j]/10000.
+        if (wavelengths_um >= 0.12) & (wavelengths_um < 0.63):
+            k = 2.659*(-1.857+1.040/wavelengths_um)+4.05
+            ext[j] = pow(10,-0.4*EBV*k)
+        if (wavelengths_um >= 0.63) & (wavelengths_um <= 2.2):
+            k = 2.659*(-2.156+1.509/wavelengths_um-0.198/pow(wavelengths_um,2)+0.11/pow(wavelengths_um,3))+4.05
+            ext[j] = pow(10,-0.4*EBV*k)
+    return np.array(ext)
+
+def _bump_loop(wavelengths, EBV, C1, C2, C3, C4, x_0, gamma, Rv):
+    ''' The per-pixel loop the vectorized LMC, MW and SMC curves replaced. '''
+
+    ext = [1.]*len(wavelengths)
+    for j in range(len(wavelengths)):
+        x = pow(wavelengths[j]/10000.,-1)
+        x2 = pow(x,2)
+        D = x2/(pow(x2-pow(x_0,2),2)+x2*pow(gamma,2))
+        F = 0.5392*pow((x-5.9),2)+0.05644*pow((x-5.9),3)
+        k = C1+Rv+C2*x+C3*x*D+(C4 if x >= 5.9 else 0.)*F
+        ext[j] = pow(10,-0.4*EBV*k)
+    return np.array(ext)
+
+def _agn_loop(wavelengths, EBV):
+    ''' Gaskell and Benker 2007 evaluated pixel by pixel. '''
+
+    ext = [1.]*len(wavelengths)
+    for j in range(len(wavelengths)):
+        x = pow(wavelengths[j]/10000.,-1)
+        k = 0.000843*x**5-0.02496*x**4+0.2919*x**3-1.815*x**2+6.83*x-7.92+5.0
+        ext[j] = pow(10,-0.4*EBV*k)
+    return np.array(ext)
+
+# Vectorized extinction curve, law of Extinction and per-pixel reference.
+LAWS = [(Calzetti_ext, "Calzetti", _calzetti_loop),
+        (LMC_Fitzpatrick_ext, "LMC",
+         lambda wl, EBV: _bump_loop(wl, EBV, -0.69, 0.89, 2.55, 0.50, 4.608, 0.994, 3.1)),
+        (MW_Seaton_ext, "MW",
+         lambda wl, EBV: _bump_loop(wl, EBV, -0.38, 0.74, 3.96, 0.26, 4.595, 1.051, 3.1)),
+        (SMC_Gordon_ext, "SMC",
+         lambda wl, EBV: _bump_loop(wl, EBV, -4.96, 2.26, 0.39, 0.26, 4.6, 1.0, 2.74)),
+        (AGN_Gaskell_ext, "AGN", _agn_loop)]
+
+def test_curves():
+    ''' The vectorized curves equal the per-pixel loops. '''
+
+    spectrum = SimpleNamespace(spectral_axis=WAVELENGTHS)
+    for ext, law, loop in LAWS:
+        for EBV in (0., 0.3, 1.7):
+            assert np.allclose(ext(spectrum=spectrum, parameters=[EBV]),
+                               loop(WAVELENGTHS, EBV), rtol=1e-12, atol=0), law
+
+def test_component():
+    ''' Extinction and extinction_batch use the curve of the selected law. '''
+
+    spectrum = SimpleNamespace(spectral_axis=WAVELENGTHS)
+    EBV = np.array([[0.1], [0.5], [1.2]])
+    for ext, law, loop in LAWS:
+        component = Extinction(**{law: True})
+        component.initialize(spectrum)
+        expected = np.array([loop(WAVELENGTHS, e) for e in EBV[:, 0]])
+
+        assert np.allclose(component.extinction_batch(spectrum, EBV), expected, rtol=1e-12, atol=0)
+        for e, row in zip(EBV, expected):
+            assert np.allclose(component.extinction(spectrum, e), row, rtol=1e-12, atol=0)
+
+def test_other_grid():
+    ''' k(lambda) is recomputed for another grid, also one changed in place. '''
+
+    component = Extinction(Calzetti=True)
+    wavelengths = WAVELENGTHS.copy()
+    spectrum = SimpleNamespace(spectral_axis=wavelengths)
+    component.initialize(spectrum)
+
+    other = SimpleNamespace(spectral_axis=np.linspace(2000., 9000., 50))
+    assert np.allclose(component.extinction(other, [0.5]), _calzetti_loop(other.spectral_axis, 0.5),
+                       rtol=1e-12, atol=0)
+
+    component.extinction(spectrum, [0.5])
+    wavelengths *= 1.1
+    assert np.allclose(component.extinction(spectrum, [0.5]), _calzetti_loop(wavelengths, 0.5),
+                       rtol=1e-12, atol=0)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import os
+import copy
 import gzip
+import json
+import argparse
 import dill as pickle
 import datetime
 import numpy as np
@@ -9,22 +12,29 @@ from astropy import units as u
 from specutils import Spectrum1D
 
 from utils.parse_pars import parse_pars
-from spamm.analysis import make_plots_from_pickle
+from utils.read_spectrum import read_spectrum
+from utils.timing import format_report
 #from plot_spamm_results import make_plots_from_pickle
 from spamm.Spectrum import Spectrum
-from spamm.Model import Model
+from spamm.Model import Model, MCMCDidNotConverge
+from spamm.ChainStore import write_chain_store
 from spamm.components.NuclearContinuumComponent import NuclearContinuumComponent
 from spamm.components.HostGalaxyComponent import HostGalaxyComponent
 from spamm.components.FeComponent import FeComponent
 from spamm.components.BalmerContinuumCombined import BalmerCombined
 from spamm.components.ReddeningLaw import Extinction
 
+TIMING_FILE = "timing.json"
+
 ACCEPTED_COMPS = ["PL", "FE", "HOST", "BC", "BPC", "CALZETTI_EXT", "SMC_EXT", "MW_EXT", "AGN_EXT", "LMC_EXT"]
 
 #-----------------------------------------------------------------------------#
 
 def spamm(complist, inspectrum, par_file=None, n_walkers=30, 
-          n_iterations=500, outdir=None, picklefile=None, comp_params=None):
+          n_iterations=500, outdir=None, picklefile=None, comp_params=None,
+          processes=None, checkpoint_every=100, resume=False, check_every=None,
+          marginalize_linear=False, map_starts=None, backend="emcee",
+          profile=False):
     """
     Args:
         complist (list): A list with at least one component to model. 
@@ -46,17 +56,44 @@ def spamm(complist, inspectrum, par_file=None, n_walkers=30,
         par_file (str): Location of parameters file.
         n_walkers (int): Number of walkers, or chains, to use in emcee.
         n_iterations (int): Number of iterations for each walker/chain.
-        outdir (str): Name of output directory for pickle file and plots.
+        outdir (str): Name of output directory for the chain store and plots.
             If None, name will be determined based on current run tie.
-        picklefile (str): Name of output pickle file. If None, name will be
-            determined based on current run time.
+        picklefile (str): Name of the output chain store, see 
+            spamm.ChainStore.write_chain_store(). The store is a directory,
+            not a pickle: a .pickle.gz extension is replaced by .chain, with
+            a warning. If None, name will be determined based on current 
+            run time.
         comp_params : dictionary
             Contains the known values of component parameters, with keys
             defined in each of the individual run scripts (run_XX.py).
             If None, the actual values of parameters will not be plotted.
+        processes (int): Number of worker processes used to evaluate the
+            walkers. If None, run in a single process.
+        checkpoint_every (int): The chain and sampler state are saved to
+            the "chain" subdirectory of outdir every checkpoint_every 
+            iterations. If None, no checkpoints are written. The 
+            checkpoints are removed once the chain store is written.
+        resume (Bool): If True, continue the run checkpointed in outdir,
+            e.g. after it was interrupted. outdir must be given.
+        check_every (int): If not None, check convergence every check_every
+            iterations and stop early once the chain has converged. 
+            n_iterations is then the maximum number of iterations.
+        marginalize_linear (Bool): If True, only sample the nonlinear 
+            parameters and marginalize over the normalizations, see
+            Model.run_mcmc().
+        map_starts (int): If not None, start the walkers around the 
+            maximum a posteriori point found by optimizing from this many
+            starting points, see Model.find_map().
+        backend (str): Sampler backend, see Model.run_mcmc(). Checkpoints
+            are only written with the "emcee" backend.
+        profile (Bool): If True, time the calls of the components during
+            the fit and save the report as timing.json in outdir, see 
+            Model.timing_report().
     """
 
     t1 = datetime.datetime.now()
+    if resume and (outdir is None or checkpoint_every is None):
+        raise Exception("outdir and checkpoint_every must be given to resume a run.")
     if par_file is None:
         pars = parse_pars()
     else:
@@ -88,77 +125,68 @@ def spamm(complist, inspectrum, par_file=None, n_walkers=30,
         if k not in comp_params:
             comp_params[k] = v
 
-    # ------------
-    # Initialize model
-    # ------------
-    model = Model()
-    model.print_parameters = False
-
     # -----------------
     # Initialize components
     # -----------------
-    if components["PL"]:
-        try:
-            if comp_params["broken_pl"] is True:
-                brokenPL = True
-            else:
-                brokenPL = False
-        except:
-            brokenPL = False
-        finally:
-            nuclear_comp = NuclearContinuumComponent(broken=brokenPL,
-                                                     pars=pars["nuclear_continuum"])
-            model.components.append(nuclear_comp)
-    if components["FE"]:
-        fe_comp = FeComponent(pars=pars["fe_forest"])
-        model.components.append(fe_comp)
-    if components["HOST"]:
-        host_galaxy_comp = HostGalaxyComponent(pars=pars["host_galaxy"])
-        model.components.append(host_galaxy_comp)
-    if components["BC"] or components["BPC"]:
-        balmer_comp = BalmerCombined(pars=pars["balmer_continuum"],
-                                     BalmerContinuum=components["BC"],
-                                     BalmerPseudocContinuum=components["BPC"])
-        model.components.append(balmer_comp)
-    if components["CALZETTI_EXT"] or components["SMC_EXT"] or components["MW_EXT"] or components["AGN_EXT"] or components["LMC_EXT"]:
-        ext_comp = Extinction(MW=MW_ext, AGN=AGN_ext, LMC=LMC_ext, SMC=SMC_ext, Calzetti=Calzetti_ext)
-        model.components.append(ext_comp)
+    broken_pl = comp_params.get("broken_pl", False) is True
+    model_components = build_components(complist, pars, broken_pl=broken_pl)
 
-    model.data_spectrum = spectrum # add data
+    nowdt = datetime.datetime.now()
+    now = nowdt.strftime("%Y%m%d_%M%S")
+    if outdir is None:
+        outdir = now
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
 
     # ------------
     # Run MCMC
     # ------------
-    model.run_mcmc(n_walkers=n_walkers, n_iterations=n_iterations)
-    print("Mean acceptance fraction: {0:.3f}".format(np.mean(model.sampler.acceptance_fraction)))
+    if checkpoint_every is None or backend != "emcee":
+        chain_store = None
+    else:
+        chain_store = os.path.join(outdir, "chain")
+    model, converged = fit_spectrum(spectrum, model_components, 
+                                    n_walkers=n_walkers, 
+                                    n_iterations=n_iterations,
+                                    processes=processes, 
+                                    chain_store=chain_store,
+                                    checkpoint_every=checkpoint_every, 
+                                    resume=resume, check_every=check_every,
+                                    marginalize_linear=marginalize_linear,
+                                    map_starts=map_starts, backend=backend,
+                                    profile=profile)
 
     # -------------
     # save chains & model
     # ------------
     p_data = {"model": model,
-              "comp_params": comp_params}
+              "comp_params": comp_params,
+              "converged": converged}
 
-    nowdt = datetime.datetime.now()
-    now = nowdt.strftime("%Y%m%d_%M%S")
     if picklefile is None:
-        picklefile = "model_{0}.pickle.gz".format(now)
+        picklefile = "model_{0}.chain".format(now)
     else:
-        picklefile = os.path.basename(picklefile)
-        if picklefile.endswith(".gz") is False:
-            if picklefile.endswith(".pickle") is True or picklefile.endswith(".p") is True:
-                picklefile += ".gz"
-            else:
-                picklefile += ".pickle.gz"
+        requested = os.path.basename(picklefile)
+        picklefile = requested
+        for ext in (".gz", ".pickle", ".p"):
+            if picklefile.endswith(ext):
+                picklefile = picklefile[:-len(ext)]
+        renamed = picklefile != requested
+        if picklefile.endswith(".chain") is False:
+            picklefile += ".chain"
+        if renamed:
+            print("WARNING: the fit is saved as the chain store {0}, not as {1}".
+                  format(picklefile, requested))
 
-    if outdir is None:
-        outdir = now
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
     pname = os.path.join(outdir, picklefile)
     
-    with gzip.open(pname, "wb") as model_output:
-        model_output.write(pickle.dumps(p_data))
-        print("Saved pickle file {0}".format(pname))
+    write_chain_store(p_data, pname, checkpoint=chain_store)
+    if profile:
+        write_timing_report(model.timing_report(), os.path.join(outdir, TIMING_FILE))
+
+    # The plotting stack is only imported here so that fitting processes,
+    # e.g. batch workers, never load matplotlib.
+    from spamm.analysis import make_plots_from_pickle
     make_plots_from_pickle(pname, outdir)
 
     t2 = datetime.datetime.now()
@@ -168,6 +196,141 @@ def spamm(complist, inspectrum, par_file=None, n_walkers=30,
 
 #-----------------------------------------------------------------------------#
 
+def build_components(complist, pars, broken_pl=False):
+    """
+    Create the model components named in complist. Templates are read 
+    here, so the components can be built once and reused for many spectra
+    (see fit_spectrum).
+
+    Args:
+        complist (list): Component names, see spamm().
+        pars (dict): SPAMM input parameters, as returned by parse_pars().
+        broken_pl (Bool): True if a broken power law should be used.
+
+    Returns:
+        components (list): List of component objects.
+    """
+
+    complist = [x.upper() for x in complist]
+    unknown = [x for x in complist if x not in ACCEPTED_COMPS]
+    if unknown:
+        raise Exception("Unknown components {0}; accepted components are {1}".
+                        format(unknown, ACCEPTED_COMPS))
+    selected = {k:(k in complist) for k in ACCEPTED_COMPS}
+
+    components = []
+    if selected["PL"]:
+        components.append(NuclearContinuumComponent(broken=broken_pl,
+                                                    pars=pars["nuclear_continuum"]))
+    if selected["FE"]:
+        components.append(FeComponent(pars=pars["fe_forest"]))
+    if selected["HOST"]:
+        components.append(HostGalaxyComponent(pars=pars["host_galaxy"]))
+    if selected["BC"] or selected["BPC"]:
+        components.append(BalmerCombined(pars=pars["balmer_continuum"],
+                                         BalmerContinuum=selected["BC"],
+                                         BalmerPseudocContinuum=selected["BPC"]))
+    if (selected["CALZETTI_EXT"] or selected["SMC_EXT"] or selected["MW_EXT"] or 
+        selected["AGN_EXT"] or selected["LMC_EXT"]):
+        components.append(Extinction(MW=selected["MW_EXT"], AGN=selected["AGN_EXT"], 
+                                     LMC=selected["LMC_EXT"], SMC=selected["SMC_EXT"], 
+                                     Calzetti=selected["CALZETTI_EXT"]))
+
+    return components
+
+#-----------------------------------------------------------------------------#
+
+def fit_spectrum(spectrum, components, n_walkers=30, n_iterations=500, 
+                 processes=None, chain_store=None, checkpoint_every=100,
+                 resume=False, check_every=None, vectorize=False,
+                 marginalize_linear=False, map_starts=None, backend="emcee",
+                 profile=False):
+    """
+    Fit one spectrum with MCMC.
+
+    The model is given shallow copies of the components, so the same 
+    component objects (and the templates they hold) can be passed in for 
+    every spectrum of a survey without the fit of one spectrum changing 
+    the priors of the next.
+
+    Args:
+        spectrum (:obj:`spamm.Spectrum`): Spectrum to fit.
+        components (list): Component objects, see build_components().
+        map_starts (int): If not None, start the walkers around the result
+            of Model.find_map() with this many starting points.
+        profile (Bool): If True, time the calls of the components, see
+            Model.timing_report().
+        Other arguments are passed on to Model.run_mcmc().
+
+    Returns:
+        model (:obj:`spamm.Model`): The model, including the sampler.
+        converged (Bool): False if convergence was checked and not reached.
+    """
+
+    model = Model()
+    model.print_parameters = False
+    model.profile = profile
+    model.components = [copy.copy(component) for component in components]
+    model.data_spectrum = spectrum # add data
+
+    start = None
+    if map_starts:
+        start, ln_post = model.find_map(n_starts=map_starts, processes=processes,
+                                        marginalize_linear=marginalize_linear)
+        print("MAP ln(posterior): {0}".format(ln_post))
+
+    converged = True
+    try:
+        model.run_mcmc(n_walkers=n_walkers, n_iterations=n_iterations,
+                       vectorize=vectorize, processes=processes, 
+                       chain_store=chain_store, checkpoint_every=checkpoint_every, 
+                       resume=resume, check_every=check_every,
+                       marginalize_linear=marginalize_linear, start=start,
+                       backend=backend)
+    except MCMCDidNotConverge as e:
+        # Keep the chain; it is saved and flagged as not converged.
+        print("WARNING: {0}".format(e))
+        converged = False
+    print("Mean acceptance fraction: {0:.3f}".format(np.mean(model.result.acceptance_fraction)))
+
+    return model, converged
+
+#-----------------------------------------------------------------------------#
+
+def write_pickle(p_data, pname):
+    """
+    Write the results of a fit, including the whole model, to a gzipped 
+    pickle file. This is the format of older versions of SPAMM; spamm() 
+    writes a chain store instead, see spamm.ChainStore.write_chain_store().
+
+    Args:
+        p_data (dict): Results, see spamm().
+        pname (str): Name of the output file.
+    """
+
+    with gzip.open(pname, "wb") as model_output:
+        model_output.write(pickle.dumps(p_data))
+        print("Saved pickle file {0}".format(pname))
+
+#-----------------------------------------------------------------------------#
+
+def write_timing_report(report, filename):
+    """
+    Print the output of Model.timing_report() as a table and write it to
+    a JSON file.
+
+    Args:
+        report (dict): The timing report.
+        filename (str): Name of the output file.
+    """
+
+    print(format_report(report))
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Saved timing report {0}".format(filename))
+
+#-----------------------------------------------------------------------------#
+
 def parse_comps(argcomp):
     if len(argcomp) == 1:
         if "," in argcomp[0]:
@@ -180,20 +343,36 @@ def parse_comps(argcomp):
     return comps
 
 #-----------------------------------------------------------------------------#
-# NOT SUPPORTED YET #
-
-#if __name__ == "__main__":
-#    parser = argparse.ArgumentParser()
-#    parser.add_argument("inspectrum", help="Input spectrum file", 
-#                        type=str) 
-#    parser.add_argument("--comp", nargs="*",
-#                        help="List of components to use: can be  PL, FE, BC, HG")
-#    parser.add_argument("--n_walkers", dest="n_walkers", default=30,
-#                        help="Number of walkers")
-#    parser.add_argument("--n_iterations", dest="n_iterations", default=500,
-#                        help="Number of iterations per walker")
-#    args = parser.parse_args()
-#
-#
-#    comps = parse_comps(args.comp)
-#    spamm(complist=comps, n_walkers=int(args.n_walkers), n_iterations=int(args.n_iterations))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inspectrum", help="Input spectrum file", 
+                        type=str) 
+    parser.add_argument("--comp", nargs="*",
+                        help="List of components to use: PL, FE, HOST, BC, BPC or *_EXT")
+    parser.add_argument("--z", dest="z", default=0., type=float,
+                        help="Redshift of the spectrum")
+    parser.add_argument("--n_walkers", dest="n_walkers", default=30,
+                        help="Number of walkers")
+    parser.add_argument("--n_iterations", dest="n_iterations", default=500,
+                        help="Number of iterations per walker")
+    parser.add_argument("--outdir", dest="outdir", default=None,
+                        help="Output directory")
+    parser.add_argument("--processes", dest="processes", default=None, type=int,
+                        help="Number of worker processes")
+    parser.add_argument("--marginalize_linear", action="store_true",
+                        help="Marginalize over the normalizations instead of sampling them")
+    parser.add_argument("--map_starts", dest="map_starts", default=None, type=int,
+                        help="Start the walkers at the MAP found from this many starting points")
+    parser.add_argument("--backend", dest="backend", default="emcee",
+                        help="Sampler backend: emcee, pt or nested")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time the components and save timing.json in outdir")
+    args = parser.parse_args()
+
+    comps = parse_comps(args.comp)
+    spamm(complist=comps, inspectrum=read_spectrum(args.inspectrum, z=args.z),
+          n_walkers=int(args.n_walkers), n_iterations=int(args.n_iterations),
+          outdir=args.outdir, processes=args.processes,
+          marginalize_linear=args.marginalize_linear, map_starts=args.map_starts,
+          backend=args.backend, profile=args.profile)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+import os
+
+import numpy as np
+
+from utils.parse_pars import parse_pars
+from spamm.Spectrum import Spectrum
+from spamm.Model import Model
+from spamm.run_spamm import build_components
+from spamm.ChainStore import write_chain_store, StoredChain
+
+def _run_model(marginalize_linear=False):
+    ''' A short fit of a power law to a power-law spectrum with 5% errors. '''
+
+    np.random.seed(0)
+    wl = np.linspace(3000., 7000., 200)
+    flux = 1e-15 * (wl / 5000.)**-1.5
+    model = Model()
+    model.print_parameters = False
+    model.components = build_components(["PL"], parse_pars())
+    model.data_spectrum = Spectrum(spectral_axis=wl, flux=flux, flux_error=0.05 * flux)
+    model.run_mcmc(n_walkers=6, n_iterations=25, marginalize_linear=marginalize_linear)
+    return model
+
+def _check_slices(store, chain, ln_prob):
+    names = store.parameter_names
+    assert store.shape == chain.shape
+    assert np.array_equal(store.chain(), chain)
+    assert np.array_equal(store.ln_prob(), ln_prob)
+    for walkers in (None, 2, [0, 3, 5], slice(1, None, 2)):
+        for iterations in (None, slice(3, 18), slice(0, None, 4), slice(6, 7), slice(30, None)):
+            for parameters in (None, [names[1]], [1, 0]):
+                expected = chain[[walkers] if isinstance(walkers, int) else
+                                 walkers if walkers is not None else slice(None)]
+                expected = expected[:, iterations or slice(None)]
+                if parameters is not None:
+                    expected = expected[:, :, [names.index(p) if isinstance(p, str) else p
+                                               for p in parameters]]
+                assert np.array_equal(store.chain(walkers, iterations, parameters), expected)
+    assert np.array_equal(store.samples(burn=5, thin=2),
+                          chain[:, 5::2].reshape((-1, chain.shape[-1])))
+
+def test_round_trip(tmpdir):
+    ''' Slices of a stored chain equal those of the chain, with and without compression. '''
+
+    model = _run_model()
+    for compress in (False, True):
+        directory = str(tmpdir.join("fit_{0}.chain".format(compress)))
+        write_chain_store({"model": model}, directory, chunk_size=7, compress=compress)
+        store = StoredChain(directory)
+
+        assert store.parameter_names == model.model_parameter_names()
+        _check_slices(store, model.chain, model.result.ln_prob)
+
+def test_marginalized(tmpdir):
+    ''' The linear parameters of a marginalized fit are stored as drawn in Model.chain. '''
+
+    model = _run_model(marginalize_linear=True)
+    directory = str(tmpdir.join("fit.chain"))
+    write_chain_store({"model": model}, directory, chunk_size=7)
+    store = StoredChain(directory)
+
+    assert np.all(np.isfinite(store.chain()))
+    _check_slices(store, model.chain, model.result.ln_prob)
+
+def test_checkpoint_removed(tmpdir):
+    ''' Checkpoints are removed once the store is written, other directories are not. '''
+
+    model = _run_model()
+    other = str(tmpdir.join("other"))
+    os.makedirs(other)
+    write_chain_store({"model": model}, str(tmpdir.join("a.chain")), checkpoint=other)
+    assert os.path.isdir(other)
+
+    chain_store = str(tmpdir.join("checkpoint"))
+    model.run_mcmc(n_walkers=6, n_iterations=10, chain_store=chain_store, checkpoint_every=5)
+    write_chain_store({"model": model}, str(tmpdir.join("b.chain")), checkpoint=chain_store)
+    assert not os.path.exists(chain_store)
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from spamm.Likelihood import Likelihood
+
+def _chi_square_ln_l(wl, flux, flux_error, model_wl, model_flux):
+    ''' The ln(likelihood) of the original Model.likelihood, on the usable pixels only. '''
+
+    good = (np.isfinite(flux) & np.isfinite(flux_error) & (flux_error > 0) &
+            (wl >= model_wl[0]) & (wl <= model_wl[-1]))
+    interp_model_flux = np.interp(wl[good], model_wl, model_flux)
+    ln_l = np.power((flux[good] - interp_model_flux) / flux_error[good], 2) + \
+           np.log(2 * np.pi * np.power(flux_error[good], 2))
+    return -0.5 * np.sum(ln_l)
+
+def _data(seed=0):
+    rng = np.random.RandomState(seed)
+    wl = np.linspace(4000., 6000., 300)
+    flux = 1. + 0.1 * rng.normal(size=len(wl))
+    flux_error = np.full(len(wl), 0.1)
+    flux[10] = np.nan
+    flux_error[20] = 0.
+    flux_error[30] = np.inf
+    return wl, flux, flux_error
+
+def test_same_grid():
+    ''' Masked pixels are dropped when the model is on the data grid. '''
+
+    wl, flux, flux_error = _data()
+    likelihood = Likelihood(SimpleNamespace(spectral_axis=wl, flux=flux, flux_error=flux_error), wl)
+    model_flux = 1. + 0.01 * np.sin(wl / 50.)
+
+    assert likelihood.n_pix == len(wl) - 3
+    assert np.isclose(likelihood(model_flux),
+                      _chi_square_ln_l(wl, flux, flux_error, wl, model_flux), rtol=1e-12)
+
+def test_other_grid():
+    ''' The model is interpolated linearly; data pixels outside of its grid are dropped. '''
+
+    wl, flux, flux_error = _data()
+    model_wl = np.linspace(4100., 6500., 1000)
+    likelihood = Likelihood(SimpleNamespace(spectral_axis=wl, flux=flux, flux_error=flux_error),
+                            model_wl)
+    model_flux = 1. + 0.01 * np.sin(model_wl / 50.)
+
+    assert np.isclose(likelihood(model_flux),
+                      _chi_square_ln_l(wl, flux, flux_error, model_wl, model_flux), rtol=1e-12)
+
+def test_batch():
+    ''' A batch of model spectra gives the ln(likelihood) of each; non-finite models get -inf. '''
+
+    wl, flux, flux_error = _data()
+    model_wl = np.linspace(4100., 6500., 1000)
+    likelihood = Likelihood(SimpleNamespace(spectral_axis=wl, flux=flux, flux_error=flux_error),
+                            model_wl)
+    model_flux = 1. + np.outer([0.01, 0.02, 0.03], np.sin(model_wl / 50.))
+    model_flux[2, 500:510] = np.nan
+
+    ln_l = likelihood(model_flux)
+    assert np.allclose(ln_l[:2], [likelihood(f) for f in model_flux[:2]], rtol=1e-12)
+    assert ln_l[2] == -np.inf
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+import numpy as np
+
+from utils.parse_pars import parse_pars
+from spamm.Spectrum import Spectrum
+from spamm.Model import Model, ln_posterior, ln_posterior_batch
+from spamm.run_spamm import build_components
+
+def _make_model(complist, seed=0):
+    ''' A model of complist and a data spectrum made from it, with 5% errors. '''
+
+    np.random.seed(seed)
+    wl = np.linspace(3000., 7000., 400)
+    flux = 1e-15 * (wl / 5000.)**-1.5
+    model = Model()
+    model.print_parameters = False
+    model.components = build_components(complist, parse_pars())
+    model.data_spectrum = Spectrum(spectral_axis=wl, flux=flux, flux_error=0.05 * flux)
+
+    flux = model.model_flux(_draw_parameters(model))
+    flux = np.where(flux > 0, flux, 1e-20)
+    model.data_spectrum = Spectrum(spectral_axis=wl, flux=flux, flux_error=0.05 * flux)
+    return model
+
+def _draw_parameters(model):
+    ''' One parameter vector drawn from the priors of model. '''
+
+    params = []
+    for component in model.components:
+        params += component.initial_values(model._slim_data_spectrum)
+    return np.array(params)
+
+def _check_batch(complist):
+    model = _make_model(complist)
+    walkers = np.array([_draw_parameters(model) for i in range(6)])
+    # One walker outside of the priors, and two with the same broadening.
+    walkers[1, 0] = -1.
+    walkers[4] = walkers[5]
+    walkers[4, 0] *= 2.
+
+    expected = np.array([ln_posterior(w, model) for w in walkers])
+    ln_post = ln_posterior_batch(walkers, model)
+
+    assert ln_post.shape == (len(walkers),)
+    assert ln_post[1] == -np.inf
+    finite = np.isfinite(expected)
+    assert np.array_equal(np.isfinite(ln_post), finite)
+    assert np.allclose(ln_post[finite], expected[finite], rtol=1e-10, atol=0)
+
+def test_ln_posterior_batch():
+    ''' ln_posterior_batch equals ln_posterior walker by walker. '''
+
+    _check_batch(["PL"])
+    _check_batch(["PL", "FE", "HOST"])
+
+def test_ln_posterior_batch_extinction():
+    ''' Extinction scales the components before it in both. '''
+
+    _check_batch(["PL", "CALZETTI_EXT"])
+    _check_batch(["PL", "FE", "HOST", "CALZETTI_EXT"])
+
+def test_resume(tmpdir):
+    ''' A run interrupted and resumed from its checkpoint gives the chain of an uninterrupted run. '''
+
+    model = _make_model(["PL"])
+    np.random.seed(1)
+    model.run_mcmc(n_walkers=8, n_iterations=30)
+    expected = model.chain.copy()
+
+    # Interrupt the run between two checkpoints.
+    component = model.components[0]
+    flux = component.flux
+    calls = [0]
+    def interrupted_flux(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] > 8 * 17:
+            raise KeyboardInterrupt
+        return flux(*args, **kwargs)
+
+    chain_store = str(tmpdir.join("chain"))
+    component.flux = interrupted_flux
+    np.random.seed(1)
+    try:
+        model.run_mcmc(n_walkers=8, n_iterations=30, chain_store=chain_store, checkpoint_every=5)
+    except KeyboardInterrupt:
+        pass
+    component.flux = flux
+
+    # The sampler state comes from the checkpoint, not from the seed.
+    np.random.seed(2)
+    model.run_mcmc(n_walkers=8, n_iterations=30, chain_store=chain_store, checkpoint_every=5,
+                   resume=True)
+
+    assert np.array_equal(model.chain, expected)
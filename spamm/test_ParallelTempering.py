@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+import numpy as np
+
+from spamm.ParallelTempering import ParallelTemperingSampler, default_ladder
+
+def test_log_evidence_gaussian():
+    ''' A unit Gaussian likelihood with a uniform prior on [-10, 10] has Z = 1/20. '''
+
+    np.random.seed(0)
+    ln_prior = lambda x: np.where(np.all(np.abs(x) < 10., axis=1), -np.log(20.), -np.inf)
+    ln_posterior_map = lambda xs: [-0.5 * x[0]**2 - 0.5 * np.log(2. * np.pi) - np.log(20.)
+                                   for x in xs]
+
+    betas = np.append(np.geomspace(1., 1e-6, 19), 0.)
+    sampler = ParallelTemperingSampler(betas, 8, 1)
+    sampler.run(np.random.uniform(-1., 1., size=(len(betas), 8, 1)), 1000,
+                ln_prior, ln_posterior_map)
+    log_evidence, log_evidence_error = sampler.log_evidence()
+
+    assert abs(log_evidence + np.log(20.)) < 0.2
+    assert abs(log_evidence + np.log(20.)) < log_evidence_error < 0.5
+
+def test_log_evidence_needs_prior_chain():
+    ''' Without a chain at beta=0 the evidence is not estimated. '''
+
+    np.random.seed(0)
+    ln_prior = lambda x: np.where(np.all(np.abs(x) < 10., axis=1), -np.log(20.), -np.inf)
+    ln_posterior_map = lambda xs: [-0.5 * x[0]**2 - np.log(20.) for x in xs]
+
+    betas = default_ladder(4, 1, t_max=1e3)
+    sampler = ParallelTemperingSampler(betas, 8, 1)
+    sampler.run(np.random.uniform(-1., 1., size=(len(betas), 8, 1)), 20,
+                ln_prior, ln_posterior_map)
+
+    assert sampler.log_evidence() == (None, None)
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+
+import numpy as np
+from scipy.fft import next_fast_len
+
+def autocorr_function(x):
+    '''
+    Normalized autocorrelation function of a series, computed with an FFT.
+
+    Args:
+        x (array): Series, or array of series along the last axis.
+
+    Returns:
+        acf (array): Autocorrelation at lags 0..n-1, with acf[..., 0] == 1.
+            It is NaN for constant series.
+    '''
+
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    n_fft = next_fast_len(2 * n, real=True)
+    f = np.fft.rfft(x - np.mean(x, axis=-1, keepdims=True), n=n_fft, axis=-1)
+    acf = np.fft.irfft(f * np.conj(f), n=n_fft, axis=-1)[..., :n]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        acf /= acf[..., :1]
+
+    return acf
+
+def integrated_time(chain, c=5):
+    '''
+    Estimate the integrated autocorrelation time of each parameter of an
+    ensemble chain. The autocorrelation function is averaged over walkers
+    and summed up to the smallest lag M with M >= c*tau(M) (Sokal 1997;
+    Goodman & Weare 2010).
+
+    Args:
+        chain (array): Array of shape (n_walkers, n_steps, n_params).
+        c (float): Window size in units of tau.
+
+    Returns:
+        tau (array): Autocorrelation time of each parameter, in steps.
+            Parameters that did not move at all get np.inf.
+    '''
+
+    chain = np.asarray(chain, dtype=float)
+    n_steps = chain.shape[1]
+    acf = autocorr_function(np.swapaxes(chain, 1, 2))
+
+    # Average over the walkers that moved.
+    finite = np.isfinite(acf)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        acf = np.sum(np.where(finite, acf, 0.), axis=0) / np.sum(finite, axis=0)
+
+    taus = 2. * np.cumsum(acf, axis=-1) - 1.
+    window = np.arange(n_steps) >= c * taus
+    lag = np.where(np.any(window, axis=-1), np.argmax(window, axis=-1), n_steps - 1)
+    tau = taus[np.arange(len(taus)), lag]
+
+    return np.where(np.isfinite(tau), tau, np.inf)
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+import numpy as np
+from scipy.fft import next_fast_len
+
+# Minimum zero padding of template_ffts(), in standard deviations of the
+# widest kernel. The transfer function of gaussian_broaden() is that of an
+# untruncated Gaussian, so less padding wraps flux around the ends of the
+# templates: 1e-3 of a line at the edge is wrapped with 3 sigma, 3e-7 with 5.
+PAD_SIGMA = 5
+
+def template_ffts(fluxes, pad):
+    '''
+    Zero-pad a set of template fluxes to a common length and return their
+    real FFTs, so that they can be broadened repeatedly with
+    gaussian_broaden() without recomputing the forward transforms.
+
+    The padding must be at least as wide as the half-width of the widest
+    kernel that will be applied, otherwise flux from one end of a template
+    wraps around to the other end; see PAD_SIGMA.
+
+    Args:
+        fluxes (list): List of 1D flux arrays, one per template. They may
+            have different lengths.
+        pad (int): Number of zero pixels to add beyond the longest template.
+
+    Returns:
+        template_fft (array): Complex array of shape (n_templates, n_fft//2+1).
+        n_fft (int): Length of the padded templates.
+    '''
+
+    n_fft = next_fast_len(max(len(flux) for flux in fluxes) + int(pad), real=True)
+    padded = np.zeros((len(fluxes), n_fft))
+    for i, flux in enumerate(fluxes):
+        padded[i, :len(flux)] = flux
+
+    return np.fft.rfft(padded, axis=-1), n_fft
+
+def gaussian_broaden(template_fft, sigma, n_fft):
+    '''
+    Convolve templates with normalized Gaussian kernels by multiplying their
+    FFTs with the analytic Gaussian transfer function. The cost does not
+    depend on the width of the kernel.
+
+    Args:
+        template_fft (array): Output of template_ffts(), shape
+            (n_templates, n_fft//2+1).
+        sigma (float or array): Kernel standard deviation in pixels, either
+            one value for all templates or one value per template.
+        n_fft (int): Length of the padded templates.
+
+    Returns:
+        array (array): Broadened templates, shape (n_templates, n_fft).
+            Template i occupies the first len(template i) pixels.
+    '''
+
+    freq = np.fft.rfftfreq(n_fft)
+    sigma = np.reshape(sigma, (-1, 1))
+    transfer = np.exp(-2. * (np.pi * sigma * freq)**2)
+
+    return np.fft.irfft(template_fft * transfer, n_fft, axis=-1)
@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+
+import numpy as np
+from scipy import sparse
+
+def interp_weights(x, xnew):
+    '''
+    Indices and weights of linear interpolation from the grid x onto xnew:
+    np.interp(xnew, x, y) equals y[lo]*(1 - weight) + y[lo+1]*weight.
+    Points of xnew outside of x are clamped to the end values, as in
+    np.interp.
+
+    Args:
+        x (array): Increasing grid the input values are sampled on.
+        xnew (array): Grid to interpolate onto.
+
+    Returns:
+        lo (ndarray): Index of the grid point at or below each point of xnew.
+        weight (ndarray): Weight of the grid point above.
+    '''
+
+    x = np.asarray(x, dtype=float)
+    xnew = np.asarray(xnew, dtype=float)
+    if len(x) < 2:
+        raise ValueError("At least two grid points are needed to interpolate.")
+
+    lo = np.clip(np.searchsorted(x, xnew, side="right") - 1, 0, len(x) - 2)
+    weight = np.clip((xnew - x[lo]) / (x[lo+1] - x[lo]), 0., 1.)
+
+    return lo, weight
+
+def interp_matrix(x, xnew, zero_outside=False):
+    '''
+    Build a sparse matrix M of shape (len(xnew), len(x)) such that
+    M.dot(y) equals np.interp(xnew, x, y) for any y sampled on x. Building
+    the matrix once is much cheaper than constructing an interpolator for
+    every new y on a fixed pair of grids.
+
+    Points of xnew outside of x are clamped to the end values, as in
+    np.interp, or set to zero if zero_outside is True, as in
+    np.interp(xnew, x, y, left=0, right=0).
+
+    Args:
+        x (array): Increasing grid the input values are sampled on.
+        xnew (array): Grid to interpolate onto.
+        zero_outside (Bool): Whether points outside of x are zero.
+
+    Returns:
+        matrix (scipy.sparse.csr_matrix): Linear interpolation operator.
+    '''
+
+    lo, weight = interp_weights(x, xnew)
+    rows = np.arange(len(lo))
+    if zero_outside:
+        x = np.asarray(x, dtype=float)
+        xnew = np.asarray(xnew, dtype=float)
+        inside = (xnew >= x[0]) & (xnew <= x[-1])
+        lo, weight, rows = lo[inside], weight[inside], rows[inside]
+
+    matrix = sparse.coo_matrix((np.concatenate([1. - weight, weight]),
+                                (np.concatenate([rows, rows]),
+                                 np.concatenate([lo, lo + 1]))),
+                               shape=(len(xnew), len(x)))
+
+    return matrix.tocsr()
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    '''
+    A bounded dictionary that evicts the least recently used entry once it
+    holds more than maxsize entries. Hits, misses and evictions are counted
+    so that the effectiveness of the cache can be checked after a run.
+
+    Args:
+        maxsize (int): Maximum number of entries. A value of 0 disables
+            caching.
+
+    Attributes:
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+        evictions (int): Number of entries dropped to respect maxsize.
+    '''
+
+    def __init__(self, maxsize=128):
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        '''
+        Return the value stored under key and mark it as most recently used,
+        or default if key is not in the cache.
+        '''
+
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        ''' Store value under key, evicting the oldest entry if needed. '''
+
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        ''' Remove all entries and reset the counters. '''
+
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        '''
+        Returns:
+            stats (dict): Hit, miss and eviction counts and the current size.
+        '''
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize}
@@ -1,14 +1,87 @@
 #! /usr/bin/env python
 
 import os
+import copy
 import yaml
 from astropy import units as u
 ABSPATH = os.path.dirname(os.path.realpath(__file__))
 
+# Keys every parameters file must define, by section.
+REQUIRED_PARS = {
+    "global": ["flux_unit", "wl_unit"],
+    "nuclear_continuum": ["boxcar_width", "broken_pl", "pl_slope_min",
+                          "pl_slope_max", "pl_norm_min", "pl_norm_max",
+                          "pl_wave_break_min", "pl_wave_break_max"],
+    "host_galaxy": ["boxcar_width", "hg_models", "hg_norm_min", "hg_norm_max",
+                    "hg_stellar_disp_min", "hg_stellar_disp_max",
+                    "hg_template_stellar_disp", "hg_kernel_size_sigma"],
+    "balmer_continuum": ["bc_line_type", "bc_lines_min", "bc_lines_max",
+                         "bc_norm_min", "bc_norm_max", "bc_Te_min", "bc_Te_max",
+                         "bc_tauBE_min", "bc_tauBE_max", "bc_loffset_min",
+                         "bc_loffset_max", "bc_lwidth_min", "bc_lwidth_max",
+                         "bc_logNe_min", "bc_logNe_max"],
+    "fe_forest": ["boxcar_width", "fe_templates", "fe_template_width",
+                  "fe_norm_min", "fe_norm_max", "fe_width_min", "fe_width_max",
+                  "fe_kernel_size_sigma"],
+}
+
+# Values of optional keys, by section, used when a parameters file (or a
+# dictionary passed to a component) does not define them.
+DEFAULT_PARS = {
+    "host_galaxy": {"hg_cache_size": 256},
+    "balmer_continuum": {"bc_line_window": 50, "bc_line_method": "window"},
+    "fe_forest": {"fe_cache_size": 256},
+}
+
+# Keys whose values are numbers, by section. Their string values that
+# parse as numbers are converted, e.g. '1.6e3'; other strings, such as
+# "max_flux", are limits computed from the data and are kept.
+NUMERIC_PARS = {
+    None: ["boxcar_width"],
+    "nuclear_continuum": ["boxcar_width", "pl_slope_min", "pl_slope_max",
+                          "pl_norm_min", "pl_norm_max", "pl_wave_break_min",
+                          "pl_wave_break_max"],
+    "host_galaxy": ["boxcar_width", "hg_norm_min", "hg_norm_max",
+                    "hg_stellar_disp_min", "hg_stellar_disp_max",
+                    "hg_template_stellar_disp", "hg_kernel_size_sigma",
+                    "hg_cache_size"],
+    "balmer_continuum": ["bc_lines_min", "bc_lines_max", "bc_line_window",
+                         "bc_norm_min", "bc_norm_max", "bc_Te_min", "bc_Te_max",
+                         "bc_tauBE_min", "bc_tauBE_max", "bc_loffset_min",
+                         "bc_loffset_max", "bc_lwidth_min", "bc_lwidth_max",
+                         "bc_logNe_min", "bc_logNe_max"],
+    "fe_forest": ["boxcar_width", "fe_template_width", "fe_norm_min",
+                  "fe_norm_max", "fe_width_min", "fe_width_max",
+                  "fe_kernel_size_sigma", "fe_cache_size"],
+    "testing": ["wl_min", "wl_max", "wl_step"],
+}
+
+# Allowed values of keys that select a method.
+CHOICE_PARS = {
+    ("balmer_continuum", "bc_line_type"): ["gaussian", "lorentzian"],
+    ("balmer_continuum", "bc_line_method"): ["window", "fft"],
+}
+
+# Keys whose values are directories, by section. Relative directories are
+# taken relative to the parameters file, not to the working directory, so
+# that fits give the same results whichever directory they are run from 
+# (e.g. batch workers).
+PATH_PARS = {
+    "host_galaxy": ["hg_models"],
+    "fe_forest": ["fe_templates"],
+}
+
+# Parsed parameter files, keyed on (absolute path, modification time).
+_pars_cache = {}
+
 def parse_pars(par_file=os.path.join(ABSPATH, "parameters.yaml")):
     '''
     Read in SPAMM input parameters from input parameters file.
 
+    Each file is read and validated once per process (see validate_pars);
+    later calls return a copy of the cached parameters, so callers may
+    modify what they get. A file that changes on disk is read again.
+
     Args:
         par_file (str): Location of parameters file.
     Returns:
@@ -18,10 +91,79 @@ def parse_pars(par_file=os.path.join(ABSPATH, "parameters.yaml")):
     assert os.path.exists(par_file), \
     "Input parameters {0} is not in {1}".format(par_file, os.getcwd())
 
-    with open(par_file, "r") as f:
-        pars = yaml.load(f)
-    
+    key = (os.path.abspath(par_file), os.path.getmtime(par_file))
+    if key not in _pars_cache:
+        with open(par_file, "r") as f:
+            pars = yaml.safe_load(f)
+        _pars_cache[key] = validate_pars(pars, par_file)
+
+    return copy.deepcopy(_pars_cache[key])
+
+def validate_pars(pars, par_file=""):
+    '''
+    Check that a parameters dictionary has every required key, fill in
+    the optional keys (DEFAULT_PARS) and convert its values to the types
+    SPAMM expects:
+        - Strings that are numbers are converted to float for the keys in
+          NUMERIC_PARS. PyYAML reads e.g. 1.6e3 as the string '1.6e3'.
+        - The units in the "global" section are converted to astropy units.
+        - Relative directories of the keys in PATH_PARS are made absolute,
+          relative to the directory of par_file, if it is given.
+
+    Args:
+        pars (dict): Parameters as read from the parameters file.
+        par_file (str): Location of parameters file, for error messages.
+    Returns:
+        pars (dict): The validated parameters.
+    '''
+
+    if not isinstance(pars, dict):
+        raise Exception("Parameters file {0} does not define any parameters".
+                        format(par_file))
+
+    missing = []
+    for section, keys in REQUIRED_PARS.items():
+        if not isinstance(pars.get(section), dict):
+            missing.append(section)
+            continue
+        missing += ["{0}.{1}".format(section, k) for k in keys if k not in pars[section]]
+    if missing:
+        raise Exception("Parameters file {0} is missing {1}".
+                        format(par_file, ", ".join(missing)))
+
+    pars = copy.deepcopy(pars)
+    for section, defaults in DEFAULT_PARS.items():
+        for key, value in defaults.items():
+            pars[section].setdefault(key, value)
+
+    for section, keys in NUMERIC_PARS.items():
+        values = pars if section is None else pars.get(section)
+        if not isinstance(values, dict):
+            continue
+        for key in keys:
+            if isinstance(values.get(key), str):
+                values[key] = _convert_number(values[key])
+
+    for (section, key), choices in CHOICE_PARS.items():
+        if pars[section][key] not in choices:
+            raise Exception("{0}.{1} in {2} must be one of {3}, not {4!r}".
+                            format(section, key, par_file, choices, pars[section][key]))
+
+    if par_file:
+        par_dir = os.path.dirname(os.path.abspath(par_file))
+        for section, keys in PATH_PARS.items():
+            for key in keys:
+                path = pars[section][key]
+                if isinstance(path, str) and not os.path.isabs(path):
+                    pars[section][key] = os.path.normpath(os.path.join(par_dir, path))
+
     pars["global"]["wl_unit"] = u.Unit(pars["global"]["wl_unit"])
     pars["global"]["flux_unit"] = u.Unit(pars["global"]["flux_unit"])
-    
+
     return pars
+
+def _convert_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
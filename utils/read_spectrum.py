@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+
+import numpy as np
+
+# SDSS fluxes are in units of 1e-17 erg/s/cm^2/Angstrom.
+SDSS_FLUX_SCALE = 1e-17
+
+def read_spectrum(filename, z=0.):
+    '''
+    Read a spectrum from a file and shift it to the rest frame.
+
+    Two formats are understood:
+        - FITS files in the SDSS spec-*.fits layout, i.e. a table in the
+          first extension with "loglam", "flux" and "ivar" columns. Pixels
+          with ivar == 0 get an infinite error.
+        - Any other file is read with np.loadtxt and must have three
+          columns: wavelength, flux and the error on the flux.
+
+    Args:
+        filename (str): Name of the spectrum file.
+        z (float): Redshift of the object.
+
+    Returns:
+        wl (ndarray): Rest-frame wavelengths.
+        flux (ndarray): Rest-frame flux density.
+        flux_error (ndarray): Error on flux.
+    '''
+
+    if filename.lower().endswith((".fits", ".fits.gz", ".fit")):
+        from astropy.io import fits
+        with fits.open(filename) as hdulist:
+            data = hdulist[1].data
+            wl = 10**np.asarray(data["loglam"], dtype=float)
+            flux = np.asarray(data["flux"], dtype=float) * SDSS_FLUX_SCALE
+            ivar = np.asarray(data["ivar"], dtype=float)
+        with np.errstate(divide="ignore"):
+            flux_error = SDSS_FLUX_SCALE / np.sqrt(ivar)
+    else:
+        columns = np.loadtxt(filename, unpack=True, ndmin=2)
+        assert len(columns) == 3, \
+            "{0} must have 3 columns, not {1}".format(filename, len(columns))
+        wl, flux, flux_error = columns
+
+    # F_lambda scales as (1+z) when the wavelengths are divided by (1+z).
+    wl = wl / (1. + z)
+    flux = flux * (1. + z)
+    flux_error = flux_error * (1. + z)
+
+    return wl, flux, flux_error
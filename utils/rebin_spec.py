@@ -1,18 +1,120 @@
 #! /usr/bin/env python
 
+import hashlib
+import numpy as np
+from scipy import sparse
+
+from utils.lru_cache import LRUCache
+
+# Rebinning operators, keyed on the contents of the (source, target) grids.
+# A fit only ever rebins between a handful of fixed grids.
+REBIN_CACHE_SIZE = 32
+_rebin_cache = LRUCache(maxsize=REBIN_CACHE_SIZE)
+
 def rebin_spec(wave, specin, wavnew):
-    """
-    Rebin spectra to bins used in wavnew.
-    Ref: http://www.astrobetter.com/blog/2013/08/12/python-tip-re-sampling-spectra-with-pysynphot/
-    """
-    from pysynphot import observation
-    from pysynphot import spectrum as pysynphot_spec
-    import numpy as np
+    '''
+    Rebin spectra to bins used in wavnew, conserving flux.
+
+    This gives the same result as
+        pysynphot.Observation(spectrum, bandpass, binset=wavnew, force='taper').binflux
+    (ref: http://www.astrobetter.com/blog/2013/08/12/python-tip-re-sampling-spectra-with-pysynphot/)
+    without pysynphot: the spectrum is linearly interpolated between its
+    samples and each output value is its exact average over a bin of
+    wavnew, see rebin_matrix(). The operator is cached, so rebinning
+    again between the same grids is a single sparse matrix product.
+
+    Args:
+        wave (array): Wavelengths of the input spectrum, increasing.
+        specin (array): Flux of the input spectrum, either 1D or 2D with
+            one spectrum per row.
+        wavnew (array): Centers of the output bins, increasing.
+
+    Returns:
+        binflux (ndarray): Rebinned flux, with shape (..., len(wavnew)).
+    '''
+
+    matrix = rebin_matrix(wave, wavnew)
+    specin = np.asarray(specin, dtype=np.float64)
+    if specin.ndim == 1:
+        return matrix.dot(specin)
+
+    return matrix.dot(specin.T).T
+
+def rebin_matrix(wave, wavnew):
+    '''
+    Sparse operator that rebins a spectrum sampled at wave to bins
+    centred on wavnew, cached on the contents of both grids.
+
+    As in pysynphot, the edges of the output bins are the midpoints
+    between the centers in wavnew, with the first and last bins symmetric
+    about their centers, and the input spectrum is "tapered": it drops
+    linearly to zero flux at one extra point at each end (placed with the
+    same ratio as the two samples at that end) and is zero beyond them.
+    Each row of the operator is the exact integral over one bin of the
+    piecewise-linear spectrum, i.e. the difference of its cumulative
+    integral at the bin edges, divided by the width of the bin.
+
+    Args:
+        wave (array): Wavelengths of the input spectrum, increasing.
+        wavnew (array): Centers of the output bins, increasing.
+
+    Returns:
+        matrix (scipy.sparse.csr_matrix): Operator of shape
+            (len(wavnew), len(wave)).
+    '''
+
+    wave = np.ascontiguousarray(wave, dtype=np.float64)
+    wavnew = np.ascontiguousarray(wavnew, dtype=np.float64)
+    key = (hashlib.sha1(wave.tobytes()).hexdigest(),
+           hashlib.sha1(wavnew.tobytes()).hexdigest())
+    matrix = _rebin_cache.get(key)
+    if matrix is None:
+        matrix = _build_rebin_matrix(wave, wavnew)
+        _rebin_cache.put(key, matrix)
+
+    return matrix
+
+def _build_rebin_matrix(wave, wavnew):
+    assert len(wave) > 2 and len(wavnew) > 1, \
+        "Rebinning needs at least 3 input samples and 2 output bins"
+
+    # Tapered input grid; the two extra points have zero flux, so they
+    # only contribute to the integral through the samples next to them.
+    x = np.concatenate(([wave[0]**2/wave[1]], wave, [wave[-1]**2/wave[-2]]))
+
+    edges = np.empty(len(wavnew) + 1)
+    edges[1:-1] = 0.5*(wavnew[1:] + wavnew[:-1])
+    edges[0] = 2.*wavnew[0] - edges[1]
+    edges[-1] = 2.*wavnew[-1] - edges[-2]
+    lo_edges = edges[:-1]
+    hi_edges = edges[1:]
+
+    # Every (bin, segment) pair with an overlap: segment k is [x[k], x[k+1]].
+    first = np.clip(np.searchsorted(x, lo_edges, side="right") - 1, 0, len(x) - 2)
+    last = np.clip(np.searchsorted(x, hi_edges, side="left") - 1, 0, len(x) - 2)
+    counts = np.maximum(last - first + 1, 0)
+    rows = np.repeat(np.arange(len(wavnew)), counts)
+    segments = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) \
+               + np.repeat(first, counts)
 
-    spec = pysynphot_spec.ArraySourceSpectrum(wave=wave, flux=specin)
-    f = np.ones(len(wave))
-    filt = pysynphot_spec.ArraySpectralElement(wave, f, waveunits='angstrom')
-    obs = observation.Observation(spec, filt, binset=wavnew, force='taper')
+    x0 = x[segments]
+    x1 = x[segments + 1]
+    lo = np.clip(lo_edges[rows], x0, x1)
+    hi = np.clip(hi_edges[rows], x0, x1)
+    # Position of the overlap within the segment, from 0 at x0 to 1 at x1.
+    u_lo = (lo - x0)/(x1 - x0)
+    u_hi = (hi - x0)/(x1 - x0)
+    # Trapezoid over [lo, hi], split between the two ends of the segment.
+    width = (hi - lo)/(hi_edges - lo_edges)[rows]
+    left = 0.5*width*((1. - u_lo) + (1. - u_hi))
+    right = 0.5*width*(u_lo + u_hi)
 
-    return obs.binflux
+    # Columns of the tapered grid, shifted to the input samples; the
+    # weights of the zero-flux taper points are dropped.
+    cols = np.concatenate((segments - 1, segments))
+    data = np.concatenate((left, right))
+    rows = np.concatenate((rows, rows))
+    keep = (cols >= 0) & (cols < len(wave)) & (data != 0)
 
+    return sparse.csr_matrix((data[keep], (rows[keep], cols[keep])),
+                             shape=(len(wavnew), len(wave)))
@@ -0,0 +1,363 @@
+#! /usr/bin/env python
+
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+
+# Smallest kernel of StreamingHistogram.mode(), in bin widths. Silverman's
+# bandwidth shrinks with the number of values while the bins do not, so
+# without a floor long chains would not be smoothed at all.
+MIN_BANDWIDTH_BINS = 1.5
+
+# Default size of the quantile sketches: the rank error of a quantile is
+# about 1/SKETCH_SIZE, with about 3*SKETCH_SIZE values kept per parameter.
+SKETCH_SIZE = 200
+
+class RunningMoments(object):
+    '''
+    Count, mean and variance of each column of a stream of arrays, updated
+    with the pairwise algorithm of Chan et al. (1979), which is as stable
+    as Welford's one value at a time. Moments of other streams can be
+    added with merge().
+    '''
+
+    def __init__(self, n_columns):
+        self.count = 0
+        self.mean = np.zeros(n_columns)
+        self._m2 = np.zeros(n_columns)
+
+    def update(self, values):
+        ''' Add the rows of an array of shape (n, n_columns). '''
+
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        mean = values.mean(axis=0)
+        self._add(len(values), mean, ((values - mean)**2).sum(axis=0))
+
+    def merge(self, other):
+        ''' Add the moments of another RunningMoments to these. '''
+
+        if other.count > 0:
+            self._add(other.count, other.mean, other._m2)
+
+    def _add(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self._m2 = self._m2 + m2 + delta**2 * self.count * count / total
+        self.count = total
+
+    @property
+    def variance(self):
+        ''' Variance of each column (ddof=0, as np.var). '''
+
+        return self._m2 / self.count if self.count else np.full(len(self.mean), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+#-----------------------------------------------------------------------------#
+
+class QuantileSketch(object):
+    '''
+    A mergeable quantile sketch of a stream of values, after Karnin, Lang
+    & Liberty (2016, "KLL"). Values are kept in levels of compactors: when
+    a level is full it is sorted and every other value, starting at a
+    random offset, is promoted to the next level with twice the weight.
+    Capacities shrink by 2/3 per level below the top, so the sketch holds
+    O(k) values however long the stream, and quantiles have a rank error
+    of about 1/k. Until the first compaction, quantiles are exact.
+
+    Args:
+        k (int): Capacity of the top level.
+        seed (int): Seed of the random offsets.
+    '''
+
+    def __init__(self, k=SKETCH_SIZE, seed=None):
+        self.k = int(k)
+        self.count = 0
+        self._levels = [np.empty(0)]
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return sum(len(level) for level in self._levels)
+
+    def update(self, values):
+        ''' Add values. '''
+
+        values = np.asarray(values, dtype=float).ravel()
+        self._levels[0] = np.concatenate((self._levels[0], values))
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other):
+        ''' Add the values summarised by another QuantileSketch. '''
+
+        for h, level in enumerate(other._levels):
+            if h == len(self._levels):
+                self._levels.append(np.empty(0))
+            self._levels[h] = np.concatenate((self._levels[h], level))
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, q):
+        '''
+        Args:
+            q (float or array): Quantile(s), between 0 and 1.
+
+        Returns:
+            value (float or array): Estimated quantile(s), interpolated
+                between values as np.quantile does.
+        '''
+
+        values = np.concatenate(self._levels)
+        if len(values) == 0:
+            return np.full(np.shape(q), np.nan)[()]
+        weights = np.concatenate([np.full(len(level), 2.**h)
+                                  for h, level in enumerate(self._levels)])
+        order = np.argsort(values)
+        values = values[order]
+        weights = weights[order]
+        # Rank of each value, from 0 for the first to 1 for the last, which
+        # for equal weights are the positions np.quantile interpolates.
+        ranks = np.cumsum(weights) - weights
+        ranks /= max(ranks[-1], 1.)
+        return np.interp(q, ranks, values)
+
+    def _capacity(self, h):
+        depth = len(self._levels) - 1 - h
+        return max(int(np.ceil(self.k * (2. / 3.)**depth)), 2)
+
+    def _compress(self):
+        h = 0
+        while h < len(self._levels):
+            if len(self._levels[h]) > self._capacity(h):
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                values = np.sort(self._levels[h])
+                # An odd value out stays at this level.
+                kept = values[len(values) - len(values) % 2:]
+                values = values[:len(values) - len(values) % 2]
+                promoted = values[self._rng.randint(2)::2]
+                self._levels[h] = kept
+                self._levels[h + 1] = np.concatenate((self._levels[h + 1], promoted))
+            h += 1
+
+#-----------------------------------------------------------------------------#
+
+class StreamingHistogram(object):
+    '''
+    A histogram with a fixed number of equal bins whose range follows the
+    stream. The range is that of the first values; when later values fall
+    outside it, bins are merged in pairs, doubling their width, and the
+    range doubles towards them. Memory is fixed and counts are never
+    redistributed within a bin, so the histogram of one array is that of
+    np.histogram.
+
+    Args:
+        n_bins (int): Number of bins; an odd number is rounded up.
+    '''
+
+    def __init__(self, n_bins=100):
+        self.n_bins = int(n_bins) + int(n_bins) % 2
+        self.counts = np.zeros(self.n_bins)
+        self.low = None
+        self.width = None
+
+    @property
+    def high(self):
+        return self.low + self.n_bins * self.width
+
+    @property
+    def edges(self):
+        return self.low + self.width * np.arange(self.n_bins + 1)
+
+    @property
+    def centers(self):
+        return self.low + self.width * (np.arange(self.n_bins) + 0.5)
+
+    def update(self, values, weights=None):
+        '''
+        Add values, optionally weighted. Values that are not finite are
+        ignored.
+        '''
+
+        values = np.asarray(values, dtype=float).ravel()
+        finite = np.isfinite(values)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float).ravel()[finite]
+        values = values[finite]
+        if len(values) == 0:
+            return
+
+        low, high = values.min(), values.max()
+        if self.low is None:
+            if low == high:
+                # As np.histogram, for a constant.
+                low, high = low - 0.5, high + 0.5
+            self.low = low
+            self.width = (high - low) / self.n_bins
+        else:
+            while low < self.low:
+                self._grow(down=True)
+            while high > self.high:
+                self._grow(down=False)
+
+        index = np.clip(((values - self.low) / self.width).astype(int), 0, self.n_bins - 1)
+        self.counts += np.bincount(index, weights=weights, minlength=self.n_bins)
+
+    def merge(self, other):
+        '''
+        Add the counts of another StreamingHistogram. Its bins are added
+        at their centres, so this is exact when the bins line up, e.g.
+        for histograms with the same first values, and approximate to
+        within a bin otherwise.
+        '''
+
+        if other.low is not None:
+            self.update([other.low, other.high], weights=[0., 0.])
+            self.update(other.centers, weights=other.counts)
+
+    def max_bin(self):
+        ''' Centre of the fullest bin. '''
+
+        return self.centers[np.argmax(self.counts)]
+
+    def mode(self, bandwidth=None):
+        '''
+        Mode of the kernel density estimate of the binned values: the
+        peak of the counts once they are smoothed with a Gaussian kernel.
+        Unlike the fullest bin of the raw histogram, this is stable
+        against the noise of the counts.
+
+        The peak is located to a fraction of a bin by fitting a parabola
+        to the smoothed counts of the fullest bin and its neighbours.
+
+        Args:
+            bandwidth (float): Standard deviation of the kernel. Defaults to
+                Silverman's rule of thumb for the binned values. It is at
+                least MIN_BANDWIDTH_BINS bins.
+
+        Returns:
+            mode (float): The mode.
+        '''
+
+        total = self.counts.sum()
+        if bandwidth is None:
+            mean = np.sum(self.counts * self.centers) / total
+            std = np.sqrt(np.sum(self.counts * (self.centers - mean)**2) / total)
+            bandwidth = 1.06 * std * total**-0.2
+        bandwidth = max(bandwidth, MIN_BANDWIDTH_BINS * self.width)
+        counts = gaussian_filter1d(self.counts, bandwidth / self.width, mode="constant")
+
+        i = np.argmax(counts)
+        shift = 0.
+        if 0 < i < self.n_bins - 1:
+            left, peak, right = counts[i - 1:i + 2]
+            curvature = left - 2. * peak + right
+            if curvature < 0:
+                shift = 0.5 * (left - right) / curvature
+        return self.centers[i] + shift * self.width
+
+    def _grow(self, down):
+        pairs = self.counts.reshape(-1, 2).sum(axis=1)
+        self.counts = np.zeros(self.n_bins)
+        if down:
+            self.counts[self.n_bins // 2:] = pairs
+            self.low -= self.n_bins * self.width
+        else:
+            self.counts[:self.n_bins // 2] = pairs
+        self.width *= 2.
+
+#-----------------------------------------------------------------------------#
+
+class StreamingStats(object):
+    '''
+    Summary statistics of each parameter of a stream of samples, in
+    bounded memory: running mean and variance, a quantile sketch and a
+    histogram per parameter. Samples are added in chunks of shape
+    (n_samples, n_parameters), and statistics of other streams, e.g.
+    other runs, can be added with merge().
+
+    Args:
+        n_parameters (int): Number of parameters.
+        n_bins (int): Number of bins of the histograms.
+        sketch_size (int): Size of the quantile sketches, see
+            QuantileSketch.
+        seed (int): Seed of the quantile sketches.
+    '''
+
+    def __init__(self, n_parameters, n_bins=100, sketch_size=SKETCH_SIZE, seed=None):
+        self.n_parameters = n_parameters
+        self.moments = RunningMoments(n_parameters)
+        self.sketches = [QuantileSketch(sketch_size, seed=seed) for i in range(n_parameters)]
+        self.histograms = [StreamingHistogram(n_bins) for i in range(n_parameters)]
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    @property
+    def mean(self):
+        return self.moments.mean
+
+    @property
+    def variance(self):
+        return self.moments.variance
+
+    @property
+    def std(self):
+        return self.moments.std
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def update(self, samples):
+        ''' Add samples, an array of shape (n_samples, n_parameters). '''
+
+        samples = np.asarray(samples, dtype=float).reshape((-1, self.n_parameters))
+        self.moments.update(samples)
+        for i in range(self.n_parameters):
+            self.sketches[i].update(samples[:, i])
+            self.histograms[i].update(samples[:, i])
+
+    def merge(self, other):
+        ''' Add the statistics of another StreamingStats. '''
+
+        self.moments.merge(other.moments)
+        for i in range(self.n_parameters):
+            self.sketches[i].merge(other.sketches[i])
+            self.histograms[i].merge(other.histograms[i])
+
+    def quantile(self, q):
+        '''
+        Returns:
+            values (ndarray): The q quantile of each parameter.
+        '''
+
+        return np.array([sketch.quantile(q) for sketch in self.sketches])
+
+    def max_bin(self):
+        '''
+        Returns:
+            values (ndarray): Centre of the fullest histogram bin of each
+                parameter.
+        '''
+
+        return np.array([histogram.max_bin() for histogram in self.histograms])
+
+    def mode(self):
+        '''
+        Returns:
+            values (ndarray): Mode of the smoothed histogram of each
+                parameter, see StreamingHistogram.mode(). The kernel
+                bandwidths follow Silverman's rule with the running
+                standard deviations, with a floor of MIN_BANDWIDTH_BINS
+                bins.
+        '''
+
+        bandwidths = 1.06 * self.std * max(self.count, 1)**-0.2
+        return np.array([histogram.mode(bandwidth)
+                         for histogram, bandwidth in zip(self.histograms, bandwidths)])
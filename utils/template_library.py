@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+
+import os
+import json
+import hashlib
+import numpy as np
+
+# Bump when the layout of the store changes so that old stores are rebuilt.
+LIBRARY_VERSION = 1
+LIBRARY_DIR = ".template_library"
+
+# Memory maps of the stores opened by this process, by file name, so that
+# all the templates of a store share one map.
+_stores = {}
+
+class Template(object):
+    '''
+    A template spectrum read from a template library. Only the wavelength
+    and flux arrays are kept; for templates loaded from a store they are
+    read-only views of a memory-mapped file.
+
+    A template from a store is pickled by reference, as the store file and
+    its offsets in it, and memory-maps the store again when unpickled. So
+    saving a model does not copy its templates, and worker processes that
+    receive the model by pickling (e.g. with spawn) share the pages of the
+    store. If the store no longer exists, the template is read from its
+    source file.
+
+    Attributes:
+        name (str): Name of the source file.
+        spectral_axis (ndarray): Wavelengths.
+        flux (ndarray): Flux values.
+    '''
+
+    def __init__(self, name, spectral_axis, flux, store_file=None, start=None,
+                 end=None, source=None, negative_flux=None):
+        self.name = name
+        self.spectral_axis = spectral_axis
+        self.flux = flux
+        self.store_file = store_file
+        self.start = start
+        self.end = end
+        self.source = source
+        self.negative_flux = negative_flux
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.store_file is not None:
+            del state["spectral_axis"], state["flux"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "flux" in state:
+            return
+        if os.path.exists(self.store_file):
+            store = _open_store(self.store_file)
+            self.spectral_axis = store[0, self.start:self.end]
+            self.flux = store[1, self.start:self.end]
+        else:
+            self.spectral_axis, self.flux = _read_text_template(self.source,
+                                                                self.negative_flux)
+
+def file_hash(filename):
+    ''' SHA-1 hex digest of the contents of a file. '''
+
+    sha = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_template_library(filenames, negative_flux=1e-19, library_dir=None):
+    '''
+    Load ASCII (wavelength, flux) template files through a binary library.
+
+    The first time a set of files is loaded they are parsed with np.loadtxt,
+    negative fluxes are replaced by negative_flux, and the result is written
+    to a single .npy store together with a JSON index. Later loads of the
+    same files memory-map the store instead, so no text is parsed and
+    processes on the same machine share the pages of the store. The store
+    is keyed on the contents of the files, so editing a template rebuilds
+    it.
+
+    If the library directory cannot be written the templates are read
+    directly from the text files.
+
+    Args:
+        filenames (list): Template file names, in the order to return them.
+        negative_flux (float): Value that replaces negative fluxes.
+        library_dir (str): Directory of the store. Defaults to a hidden
+            directory next to the first template.
+
+    Returns:
+        templates (list): List of Template objects.
+    '''
+
+    if library_dir is None:
+        library_dir = os.path.join(os.path.dirname(os.path.abspath(filenames[0])),
+                                   LIBRARY_DIR)
+
+    hashes = [file_hash(filename) for filename in filenames]
+    key = hashlib.sha1(json.dumps([LIBRARY_VERSION, repr(negative_flux), hashes])
+                       .encode()).hexdigest()
+    store_file = os.path.join(library_dir, key + ".npy")
+    index_file = os.path.join(library_dir, key + ".json")
+
+    if not (os.path.exists(store_file) and os.path.exists(index_file)):
+        templates = _read_text_templates(filenames, negative_flux)
+        try:
+            _write_library(templates, hashes, library_dir, store_file, index_file)
+        except OSError:
+            return templates
+
+    with open(index_file, "r") as f:
+        index = json.load(f)
+    store = _open_store(store_file)
+
+    return [Template(name=entry["name"],
+                     spectral_axis=store[0, entry["start"]:entry["end"]],
+                     flux=store[1, entry["start"]:entry["end"]],
+                     store_file=os.path.abspath(store_file), start=entry["start"], end=entry["end"],
+                     source=os.path.abspath(filename), negative_flux=negative_flux)
+            for entry, filename in zip(index["templates"], filenames)]
+
+def _open_store(store_file):
+    store_file = os.path.abspath(store_file)
+    if store_file not in _stores:
+        # A plain ndarray view of the memory map: np.memmap objects cannot
+        # be pickled by dill.
+        _stores[store_file] = np.load(store_file, mmap_mode="r").view(np.ndarray)
+    return _stores[store_file]
+
+def _read_text_template(filename, negative_flux):
+    wavelengths, flux = np.loadtxt(filename, unpack=True)
+    return wavelengths, np.where(flux<0, negative_flux, flux)
+
+def _read_text_templates(filenames, negative_flux):
+    templates = []
+    for filename in filenames:
+        wavelengths, flux = _read_text_template(filename, negative_flux)
+        templates.append(Template(name=os.path.basename(filename),
+                                  spectral_axis=wavelengths, flux=flux))
+    return templates
+
+def _write_library(templates, hashes, library_dir, store_file, index_file):
+    if not os.path.exists(library_dir):
+        os.makedirs(library_dir)
+
+    entries = []
+    start = 0
+    for template, sha in zip(templates, hashes):
+        end = start + len(template.flux)
+        entries.append({"name": template.name, "sha1": sha,
+                        "start": start, "end": end})
+        start = end
+
+    store = np.empty((2, start))
+    for template, entry in zip(templates, entries):
+        store[0, entry["start"]:entry["end"]] = template.spectral_axis
+        store[1, entry["start"]:entry["end"]] = template.flux
+
+    # Write to temporary files first so that a process loading the library
+    # never sees a partly written store.
+    suffix = ".{0}.tmp".format(os.getpid())
+    with open(store_file + suffix, "wb") as f:
+        np.save(f, store)
+    with open(index_file + suffix, "w") as f:
+        json.dump({"version": LIBRARY_VERSION, "templates": entries}, f, indent=1)
+    os.replace(store_file + suffix, store_file)
+    os.replace(index_file + suffix, index_file)
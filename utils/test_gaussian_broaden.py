@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+
+import numpy as np
+
+from utils.gaussian_broaden import template_ffts, gaussian_broaden, PAD_SIGMA
+
+def _templates(n_pix=500, seed=0):
+    ''' A forest of narrow lines, with one at each edge, and a noisy continuum. '''
+
+    rng = np.random.RandomState(seed)
+    pixels = np.arange(n_pix)
+    lines = np.zeros(n_pix)
+    for center in np.append(rng.uniform(0, n_pix, 40), [0, n_pix - 1]):
+        lines += np.exp(-0.5 * ((pixels - center) / 1.5)**2)
+    return [lines, rng.uniform(0., 1., n_pix - 50)]
+
+def _convolve(flux, sigma):
+    ''' Direct convolution with a Gaussian kernel sampled to 10 sigma, zero beyond the ends. '''
+
+    half = int(np.ceil(10 * sigma))
+    x = np.arange(-half, half + 1)
+    kernel = np.exp(-0.5 * (x / sigma)**2)
+    kernel /= kernel.sum()
+    return np.convolve(flux, kernel, mode="full")[half:half + len(flux)]
+
+def test_direct_convolution():
+    '''
+    FFT broadening equals direct convolution to 1e-6 of the peak flux for
+    kernels of 2 pixels or more, with PAD_SIGMA padding; the rest is flux
+    wrapped around the ends. The analytic transfer function is that of a
+    continuous Gaussian, so 1-pixel kernels differ from sampled ones by
+    about 1e-3.
+    '''
+
+    fluxes = _templates()
+    for sigma, rtol in ((1., 2e-3), (2., 1e-6), (3., 1e-6), (8., 1e-6), (20., 1e-6)):
+        template_fft, n_fft = template_ffts(fluxes, np.ceil(PAD_SIGMA * sigma))
+        broadened = gaussian_broaden(template_fft, sigma, n_fft)
+        for flux, row in zip(fluxes, broadened):
+            expected = _convolve(flux, sigma)
+            assert np.max(np.abs(row[:len(flux)] - expected)) < rtol * np.max(expected)
+
+def test_sigma_per_template():
+    ''' Each template is broadened with its own kernel. '''
+
+    fluxes = _templates()
+    template_fft, n_fft = template_ffts(fluxes, np.ceil(PAD_SIGMA * 6.))
+    broadened = gaussian_broaden(template_fft, [6., 2.], n_fft)
+    for flux, row, sigma in zip(fluxes, broadened, (6., 2.)):
+        expected = _convolve(flux, sigma)
+        assert np.max(np.abs(row[:len(flux)] - expected)) < 1e-6 * np.max(expected)
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+
+import numpy as np
+
+from utils.rebin_spec import rebin_spec
+
+def test_matches_pysynphot():
+    ''' Same bins as pysynphot with force='taper', which rebin_spec replaced. '''
+
+    wave = np.linspace(4000., 4090., 10)
+    flux = np.array([1., 3., 2., 5., 4., 4., 6., 1., 2., 3.])
+    wavnew = np.array([3995., 4012., 4031., 4047., 4066., 4081., 4096.])
+    # pysynphot.Observation(..., binset=wavnew, force='taper').binflux
+    expected = np.array([0.5713253630629291, 2.4229166666666666, 4.149285714285715,
+                         4.244285714285715, 3.4639705882352945, 2.1, 1.2949509803921317])
+
+    assert np.allclose(rebin_spec(wave, flux, wavnew), expected, rtol=0., atol=1e-12)
+
+def test_conserves_flux():
+    ''' Bins whose edges fall on input samples hold the integral of the flux. '''
+
+    rng = np.random.RandomState(0)
+    wave = np.arange(1000., 1101.)
+    flux = rng.uniform(0., 10., len(wave))
+    # Edges at 1010, 1012, ..., 1090.
+    wavnew = np.arange(1011., 1090., 2.)
+
+    binflux = rebin_spec(wave, flux, wavnew)
+
+    # Trapezoids over the unit steps of wave from 1010 to 1090.
+    integral = np.sum(0.5 * (flux[10:90] + flux[11:91]))
+    assert np.isclose(np.sum(2. * binflux), integral, rtol=1e-12)
+
+def test_rows():
+    ''' Each row of a 2D input is rebinned as a 1D input. '''
+
+    rng = np.random.RandomState(1)
+    wave = np.linspace(5000., 6000., 200)
+    flux = rng.uniform(0., 1., (3, len(wave)))
+    wavnew = np.linspace(5100., 5900., 57)
+
+    binflux = rebin_spec(wave, flux, wavnew)
+
+    assert binflux.shape == (3, len(wavnew))
+    for row, spectrum in zip(binflux, flux):
+        assert np.allclose(row, rebin_spec(wave, spectrum, wavnew), rtol=1e-14)
@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+
+import numpy as np
+
+from utils.streaming_stats import QuantileSketch, StreamingHistogram
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+def rank_error(values, estimates):
+    ''' Largest difference between QUANTILES and the ranks of estimates in values. '''
+
+    ranks = np.searchsorted(np.sort(values), estimates) / len(values)
+    return np.max(np.abs(ranks - QUANTILES))
+
+def test_sketch_exact_before_compaction():
+    values = np.random.RandomState(0).uniform(size=150)
+    sketch = QuantileSketch(200)
+    sketch.update(values)
+
+    assert np.allclose(sketch.quantile(QUANTILES), np.quantile(values, QUANTILES))
+
+def test_sketch_rank_error():
+    values = np.random.RandomState(1).standard_normal(100000)
+    sketch = QuantileSketch(200, seed=1)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+
+    assert sketch.count == len(values)
+    assert len(sketch) < 3 * 200
+    assert rank_error(values, sketch.quantile(QUANTILES)) < 4. / 200
+
+def test_sketch_merge_rank_error():
+    values = np.random.RandomState(2).standard_normal(100000)
+    sketch = QuantileSketch(200, seed=2)
+    sketch.update(values[:60000])
+    other = QuantileSketch(200, seed=3)
+    other.update(values[60000:])
+    sketch.merge(other)
+
+    assert sketch.count == len(values)
+    assert rank_error(values, sketch.quantile(QUANTILES)) < 4. / 200
+
+def test_histogram_mode():
+    ''' The smoothed mode is closer to the true mode than the fullest bin. '''
+
+    values = np.random.RandomState(3).standard_normal(1000000)
+    histogram = StreamingHistogram(100)
+    histogram.update(values)
+
+    assert abs(histogram.mode()) < 0.5 * histogram.width
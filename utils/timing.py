@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+
+import math
+
+# Latencies are counted in logarithmic bins from 10**LOG_MIN to 10**LOG_MAX
+# seconds, so percentiles are exact to within half a bin (about 6%).
+LOG_MIN = -8
+LOG_MAX = 3
+BINS_PER_DECADE = 20
+N_BINS = (LOG_MAX - LOG_MIN) * BINS_PER_DECADE
+
+class TimingCounters(object):
+    '''
+    Call counts, cumulative wall time and a latency histogram per named
+    operation, e.g. "FeForest.flux". Recording a call is a few additions
+    and one logarithm, so the counters can be kept for every posterior
+    evaluation of a run. Counters of other processes can be added with
+    merge().
+    '''
+
+    def __init__(self):
+        # name -> [calls, total seconds, histogram]
+        self._counters = {}
+
+    def __len__(self):
+        return len(self._counters)
+
+    def record(self, name, seconds):
+        ''' Count one call of name that took seconds. '''
+
+        counter = self._counters.get(name)
+        if counter is None:
+            counter = self._counters[name] = [0, 0., [0] * N_BINS]
+        counter[0] += 1
+        counter[1] += seconds
+        if seconds > 0:
+            b = int((math.log10(seconds) - LOG_MIN) * BINS_PER_DECADE)
+            counter[2][min(max(b, 0), N_BINS - 1)] += 1
+        else:
+            counter[2][0] += 1
+
+    def merge(self, counters):
+        '''
+        Add counters, either a TimingCounters or the output of pop(), to
+        these.
+        '''
+
+        if isinstance(counters, TimingCounters):
+            counters = counters._counters
+        for name, (calls, seconds, histogram) in counters.items():
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = [0, 0., [0] * N_BINS]
+            counter[0] += calls
+            counter[1] += seconds
+            counter[2] = [a + b for a, b in zip(counter[2], histogram)]
+
+    def pop(self):
+        '''
+        Return the raw counters, to be passed to merge() e.g. in another
+        process, and reset them.
+        '''
+
+        counters = self._counters
+        self._counters = {}
+        return counters
+
+    def clear(self):
+        ''' Reset all counters. '''
+
+        self._counters = {}
+
+    def percentile(self, name, q):
+        '''
+        Latency of name below which a fraction q of the calls fall, in
+        seconds (the geometric center of the histogram bin).
+        '''
+
+        calls, seconds, histogram = self._counters[name]
+        target = q * calls
+        total = 0
+        for b, count in enumerate(histogram):
+            total += count
+            if total >= target and count > 0:
+                return 10**(LOG_MIN + (b + 0.5) / BINS_PER_DECADE)
+        return 0.
+
+    def report(self):
+        '''
+        Summary of the counters.
+
+        Returns:
+            report (dict): For each name, a dict with the number of calls,
+                the total and mean time and the 50th and 99th percentile
+                latency, all in seconds, sorted by decreasing total time.
+        '''
+
+        report = {}
+        for name, (calls, seconds, histogram) in sorted(self._counters.items(),
+                                                        key=lambda item: -item[1][1]):
+            report[name] = {"calls": calls,
+                            "total_seconds": seconds,
+                            "mean_seconds": seconds / calls if calls else 0.,
+                            "p50_seconds": self.percentile(name, 0.5),
+                            "p99_seconds": self.percentile(name, 0.99)}
+        return report
+
+def format_report(report):
+    '''
+    Format the output of TimingCounters.report() as a table, one line per
+    operation, with times in milliseconds.
+    '''
+
+    lines = ["{0:32s} {1:>9s} {2:>10s} {3:>9s} {4:>9s} {5:>9s}".format(
+             "operation", "calls", "total [s]", "mean [ms]", "p50 [ms]", "p99 [ms]")]
+    for name, entry in report.items():
+        lines.append("{0:32s} {1:9d} {2:10.3f} {3:9.3f} {4:9.3f} {5:9.3f}".format(
+                     name, entry["calls"], entry["total_seconds"],
+                     1e3 * entry["mean_seconds"], 1e3 * entry["p50_seconds"],
+                     1e3 * entry["p99_seconds"]))
+    return "\n".join(lines)